@@ -0,0 +1,106 @@
+"""
+    Differential benchmark of the protocol backends.
+
+    The same generated streams (clean, full of escaped bytes, adversarial)
+    are decoded by the pure Python backend, for several transport chunk
+    sizes, and by the C binding when its library is built. Each run reports
+    its throughput, and whether it decoded exactly the intact frames of the
+    stream with the same stats as the Python backend, so that a regression
+    of either backend shows up in one report.
+
+    python benchmarks/backends.py --frames 20000 --json backends.json
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pytelemetry.conformance import generate, decode, common_stats, PROFILES
+from pytelemetry.telemetry.telemetry import Telemetry
+
+def backends(names, chunk_sizes):
+    # (name, class, chunk size) of each run
+    runs = []
+    for name in names:
+        if name == 'python':
+            runs.extend(('python', Telemetry, chunk_size) for chunk_size in chunk_sizes)
+        else:
+            from pytelemetry.telemetry.c_binding import TelemetryCBinding
+            runs.append(('c', TelemetryCBinding, None))
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=20000, help="frames per stream")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="best of this many runs")
+    parser.add_argument('--profiles', nargs='+', default=sorted(PROFILES), choices=sorted(PROFILES))
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[1, 4096],
+                        help="transport chunk sizes of the python backend")
+    parser.add_argument('--backends', nargs='+', default=['python', 'c'], choices=['python', 'c'])
+    parser.add_argument('--json', help="writes the report to this file")
+    args = parser.parse_args()
+
+    # Corrupted frames are expected
+    logging.getLogger('telemetry').setLevel(logging.CRITICAL)
+
+    results = []
+    print("{0:>11s} {1:>7s} {2:>10s} {3:>10s} {4:>8s} {5:>8s} {6:>14s}".format(
+          "profile", "backend", "chunk size", "frames/s", "MB/s", "records", "stats"))
+    for profile in args.profiles:
+        chunks, expected = generate(args.seed, frames=args.frames, **PROFILES[profile])
+        size = sum(len(chunk) for chunk in chunks)
+        reference = None
+        for name, backend, chunk_size in backends(args.backends, args.chunk_sizes):
+            attributes = {} if chunk_size is None else {'rx_chunk_size': chunk_size}
+            try:
+                best = None
+                for i in range(args.repeat):
+                    records, stats, elapsed = decode(backend, chunks, **attributes)
+                    best = elapsed if best is None else min(best, elapsed)
+            except OSError as e:
+                # C library not built for this platform
+                print("{0:>11s} {1:>7s} skipped : {2}".format(profile, name, e))
+                continue
+            if reference is None:
+                reference = stats
+            common = common_stats(reference, stats)
+            if common is None:
+                compared = 'not comparable'
+            else:
+                compared = 'same' if common[0] == common[1] else 'differ'
+            result = {'profile' : profile,
+                      'backend' : name,
+                      'chunk_size' : chunk_size,
+                      'frames' : len(records),
+                      'bytes' : size,
+                      'frames_per_second' : len(records) / best,
+                      'bytes_per_second' : size / best,
+                      'records' : 'same' if records == expected else 'differ',
+                      'stats' : compared,
+                      'conformant' : records == expected and compared == 'same',
+                      'counters' : stats}
+            results.append(result)
+            print("{0:>11s} {1:>7s} {2:>10s} {3:>10.0f} {4:>8.3f} {5:>8s} {6:>14s}".format(
+                  profile, name, str(chunk_size), result['frames_per_second'],
+                  result['bytes_per_second'] / 1e6, result['records'], result['stats']))
+            sys.stdout.flush()
+
+    if args.json:
+        report = {'python' : platform.python_version(),
+                  'platform' : platform.platform(),
+                  'settings' : vars(args),
+                  'results' : results}
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if not all(result['conformant'] for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
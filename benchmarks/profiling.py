@@ -0,0 +1,81 @@
+"""
+    Measures the cost of per-stage profiling on a loopback link.
+
+    Runs the same publish/update workload on instances whose profiling is
+    never enabled, enabled, and enabled then disabled, and prints the
+    throughput of each along with the profile gathered while enabled.
+
+    python benchmarks/profiling.py [frames]
+"""
+from __future__ import division, print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pytelemetry import Pytelemetry
+
+class Loopback:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def read(self, maxbytes=1):
+        data = self.buffer[:maxbytes]
+        del self.buffer[:maxbytes]
+        return data
+
+    def readable(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        self.buffer.extend(data)
+
+    def writeable(self):
+        return True
+
+def workload(tlm, frames):
+    for i in range(frames):
+        tlm.publish('adc:%d' % (i % 8), i & 0xffff, 'uint16')
+    tlm.update()
+
+def instance():
+    tlm = Pytelemetry(Loopback())
+    tlm.api.rx_chunk_size = 4096
+    tlm.subscribe(None, lambda topic, data, opts: None)
+    return tlm
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = 10
+
+    never = instance()
+    enabled = instance()
+    enabled.enable_profiling()
+    disabled = instance()
+    disabled.enable_profiling()
+    disabled.enable_profiling(False)
+
+    # Runs are interleaved so that machine noise affects all of them alike,
+    # the best run of each instance is kept
+    best = dict()
+    for _ in range(rounds):
+        for name, tlm in (('never', never), ('enabled', enabled), ('disabled', disabled)):
+            duration = timeit.timeit(lambda: workload(tlm, frames), number=1)
+            best[name] = min(best.get(name, duration), duration)
+
+    rate = dict((name, frames / duration) for name, duration in best.items())
+    print("never enabled : {0:10.0f} frames/s".format(rate['never']))
+    for name in ('enabled', 'disabled'):
+        print("{0:14s}: {1:10.0f} frames/s ({2:+.1f}%)".format(
+            name, rate[name], 100 * (rate[name] / rate['never'] - 1)))
+
+    print()
+    print("{0:14s}{1:>10s}{2:>14s}{3:>14s}".format("stage", "calls", "total ms", "self ms"))
+    profile = enabled.stats()['profile']
+    for name, stage in sorted(profile.items(), key=lambda item: -item[1]['self_ns']):
+        print("{0:14s}{1:>10d}{2:>14.1f}{3:>14.1f}".format(
+            name, stage['calls'], stage['total_ns'] / 1e6, stage['self_ns'] / 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+    Saturation harness : maximum frame rate sustained without loss.
+
+    A DeviceSimulator running in a child process publishes a ramp on a
+    pseudo-terminal at an offered rate, while this process receives it with
+    SerialTransport and Pytelemetry. The offered rate is raised step by step
+    until frames are lost (missing ramp values, incomplete or corrupted
+    frames). The knee is the highest rate received without loss.
+
+    Each step reports the rate actually sent by the device and received by
+    the host, the lost frames, the host CPU usage and its memory growth.
+    Steps are repeated for every combination of chunk size, backend and
+    dispatch mode, so that releases can be compared on the same machine.
+
+    python benchmarks/soak.py --chunk-sizes 1 4096 --dispatch callback frames --json report.json
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytelemetry.pytelemetry
+from pytelemetry import Pytelemetry
+from pytelemetry.simulator import DeviceSimulator, SimulatedTopic
+from pytelemetry.transports.serialtransport import SerialTransport
+
+RAMP_MODULO = 1 << 31
+
+# CPU time of this process (Python 2 : time.clock)
+process_time = getattr(time, 'process_time', getattr(time, 'clock', None))
+
+def device(rate, duration, connection):
+    simulator = DeviceSimulator([SimulatedTopic('load', 'uint32', rate)], reply=None)
+    connection.send(simulator.port)
+    # Wait for the host to be connected
+    connection.recv()
+    simulator.start()
+    time.sleep(duration)
+    simulator.stop()
+    connection.send(simulator.stats())
+    # Wait for the host to be done reading
+    connection.recv()
+    simulator.close()
+
+def rss():
+    # Resident memory of this process in bytes
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+class Receiver:
+    # Counts received ramp values and the gaps between them
+    def __init__(self):
+        self.received = 0
+        self.missing = 0
+        self.last = None
+
+    def __call__(self, topic, data, opts=None):
+        if topic != 'load':
+            return
+        if self.last is not None:
+            self.missing += (data - self.last - 1) % RAMP_MODULO
+        self.last = data
+        self.received += 1
+
+def step(rate, duration, drain, chunk_size, backend, dispatch):
+    pytelemetry.pytelemetry._telemetry_use_c_api = backend == 'c'
+
+    host, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=device, args=(rate, duration, child))
+    process.start()
+    transport = SerialTransport()
+    transport.connect({'port': host.recv(), 'baudrate': 115200})
+    try:
+        tlm = Pytelemetry(transport)
+        if backend == 'python':
+            tlm.api.rx_chunk_size = chunk_size
+        receiver = Receiver()
+
+        memory = rss()
+        cpu = process_time()
+        start = time.time()
+        host.send('start')
+
+        if dispatch == 'frames':
+            # Stops once no frame came for drain seconds
+            for timestamp, topic, data in tlm.frames(timeout=drain):
+                receiver(topic, data)
+        else:
+            tlm.subscribe('load' if dispatch == 'callback' else None, receiver)
+            idle = None
+            while True:
+                received = receiver.received
+                tlm.update()
+                now = time.time()
+                if receiver.received != received or now - start < duration:
+                    idle = now
+                elif now - idle > drain:
+                    break
+
+        wall = time.time() - start
+        cpu = process_time() - cpu
+        memory = rss() - memory
+        sent = host.recv()
+        host.send('done')
+    finally:
+        transport.disconnect()
+        process.join()
+
+    stats = tlm.stats()
+    framing = stats['framing']
+    protocol = stats['protocol']
+    errors = framing.get('rx_uncomplete_frames', 0) + framing.get('rx_oversized_frames', 0) + \
+             sum(protocol.get(key, 0) for key in ('rx_corrupted_crc', 'rx_corrupted_header',
+                                                  'rx_corrupted_topic', 'rx_corrupted_payload'))
+    return {
+        'offered_rate' : rate,
+        'sent_rate' : sent['sent_frames'] / duration,
+        'received_rate' : receiver.received / duration,
+        'sent' : sent['sent_frames'],
+        'dropped_bytes' : sent['dropped_bytes'],
+        'received' : receiver.received,
+        'lost' : max(sent['sent_frames'] - receiver.received, 0),
+        'missing' : receiver.missing,
+        'errors' : errors,
+        'cpu' : cpu / wall,
+        'memory_growth' : memory
+    }
+
+def ramp(args, chunk_size, backend, dispatch):
+    steps = []
+    knee = None
+    rate = args.start
+    while rate <= args.max_rate:
+        result = step(rate, args.duration, args.drain, chunk_size, backend, dispatch)
+        steps.append(result)
+        print("  {offered_rate:>9.0f} {sent_rate:>9.0f} {received_rate:>9.0f} {lost:>7d} "
+              "{errors:>7d} {cpu:>6.0%} {memory_growth:>10d}".format(**result))
+        sys.stdout.flush()
+
+        loss = result['lost'] + result['errors']
+        if loss > args.loss * max(result['sent'], 1):
+            break
+        knee = result['received_rate']
+        rate *= args.factor
+    return {'chunk_size' : chunk_size,
+            'backend' : backend,
+            'dispatch' : dispatch,
+            'knee' : knee,
+            'steps' : steps}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--start', type=float, default=500, help="first offered rate (frames/s)")
+    parser.add_argument('--factor', type=float, default=1.5, help="rate increase between steps")
+    parser.add_argument('--max-rate', type=float, default=200000)
+    parser.add_argument('--duration', type=float, default=2, help="duration of each step (s)")
+    parser.add_argument('--drain', type=float, default=0.2,
+                        help="idle time ending a step once the device stopped (s)")
+    parser.add_argument('--loss', type=float, default=0.001,
+                        help="ratio of lost frames above which the link is saturated")
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[1, 64, 4096])
+    parser.add_argument('--backends', nargs='+', default=['python'], choices=['python', 'c'])
+    parser.add_argument('--dispatch', nargs='+', default=['callback', 'default', 'frames'],
+                        choices=['callback', 'default', 'frames'])
+    parser.add_argument('--json', help="writes the report to this file")
+    args = parser.parse_args()
+
+    results = []
+    for backend in args.backends:
+        for chunk_size in args.chunk_sizes if backend == 'python' else [None]:
+            for dispatch in args.dispatch:
+                print("backend {0}, chunk size {1}, dispatch {2}".format(backend, chunk_size, dispatch))
+                print("  {0:>9s} {1:>9s} {2:>9s} {3:>7s} {4:>7s} {5:>6s} {6:>10s}".format(
+                      "offered", "sent", "received", "lost", "errors", "cpu", "memory"))
+                try:
+                    results.append(ramp(args, chunk_size, backend, dispatch))
+                except OSError as e:
+                    # C library not built for this platform
+                    print("  skipped : {0}".format(e))
+
+    print()
+    print("{0:>8s} {1:>10s} {2:>9s} {3:>12s}".format("backend", "chunk size", "dispatch", "knee (fps)"))
+    for result in results:
+        knee = "-" if result['knee'] is None else "{0:.0f}".format(result['knee'])
+        print("{0:>8s} {1:>10s} {2:>9s} {3:>12s}".format(
+              result['backend'], str(result['chunk_size']), result['dispatch'], knee))
+
+    if args.json:
+        report = {'python' : platform.python_version(),
+                  'platform' : platform.platform(),
+                  'settings' : vars(args),
+                  'results' : results}
+        with open(args.json, 'w') as output:
+            json.dump(report, output, indent=2)
+
+if __name__ == '__main__':
+    main()
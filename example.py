@@ -1,7 +1,6 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 from pytelemetry import Pytelemetry
 from pytelemetry.transports.serialtransport import *
-import time
 import logging
 from logging import getLogger
 from logging import FileHandler
@@ -56,12 +55,7 @@ def main():
 
     c.publish('sometopic','booyaa','string')
 
-    timeout = time.time() + 3
-
-    while True:
-        c.update()
-        if time.time() > timeout:
-            break
+    c.run(until=3)
 
     transport.disconnect()
     print("Done.")
@@ -8,4 +8,26 @@ from __future__ import absolute_import, division, print_function, unicode_litera
     The communication protocol is implemented in C, and new devices can be
     added in a matter of minutes.
 """
-from pytelemetry.pytelemetry import Pytelemetry
+import sys
+
+# Public names and the submodule defining them, imported on first access so
+# that short-lived tools only pay for what they use
+_lazy = {'Pytelemetry' : 'pytelemetry.pytelemetry',
+         'iter_decode' : 'pytelemetry.telemetry.telemetry'}
+
+__all__ = list(_lazy)
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if not name in _lazy:
+            raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+        value = getattr(__import__(_lazy[name], fromlist=[name]), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(__all__))
+else:
+    # No module __getattr__ (PEP 562)
+    from pytelemetry.pytelemetry import Pytelemetry
+    from pytelemetry.telemetry.telemetry import iter_decode
@@ -0,0 +1,150 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import time
+from pytelemetry.telemetry.telemetry import monotonic_ns
+
+# What happens to frames exceeding a budget
+DELAY = 'delay'
+DROP = 'drop'
+
+class _Bucket:
+    # Token bucket of bytes. Tokens may go negative : a frame larger than the
+    # bucket passes once the bucket is full, and the next ones wait for the debt
+    def __init__(self, rate, burst):
+        self.rate = rate / 1e9
+        self.burst = burst
+        self.tokens = burst
+        self.last = monotonic_ns()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def wait(self):
+        # ns until the bucket is no longer in debt
+        return 0 if self.tokens >= 0 else int(-self.tokens / self.rate) + 1
+
+class LinkBudget:
+    """
+        Limits the amount of bytes written on a serial link.
+
+        Frames are charged their size on the wire, stuffing included, against
+        a global bucket refilled at utilization times the link capacity
+        (baudrate / 10 bytes per second for 8N1) and against the bucket of
+        their topic, if given a budget with set_topic_budget().
+        Frames exceeding a budget are delayed until it allows them, or
+        dropped, depending on policy. Delaying sleeps in the thread sending
+        the frame, which must be the transmit thread, after it wrote the
+        frames already admitted.
+    """
+    def __init__(self, baudrate, utilization=0.9, policy=DELAY, window=0.1, bits_per_byte=10):
+        """
+            :param baudrate: link speed in bits per second
+            :param utilization: fraction of the link capacity that can be used
+            :param policy: DELAY or DROP
+            :param window: duration in seconds of the bursts allowed above the
+            rate, once a bucket is full
+        """
+        if not policy in (DELAY, DROP):
+            raise ValueError("Unknown policy {0}".format(policy))
+        self.capacity = baudrate / bits_per_byte
+        self.policy = policy
+        self.window = window
+        rate = self.capacity * utilization
+        self.link = _Bucket(rate, rate * window)
+        self.topics = dict()
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.since = monotonic_ns()
+        self.sent_bytes = 0
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self.delayed_frames = 0
+        self.delay = 0
+        # topic -> dropped frames
+        self.dropped_topics = dict()
+
+    def stats(self):
+        """
+Returns sent, dropped and delayed amounts, along with the link utilization since
+the last resetStats() : the ratio of bytes sent to the link capacity.
+        """
+        elapsed = (monotonic_ns() - self.since) / 1e9
+        return {
+            "capacity" : self.capacity,
+            "utilization" : self.sent_bytes / (elapsed * self.capacity) if elapsed > 0 else 0.,
+            "sent_bytes" : self.sent_bytes,
+            "sent_frames" : self.sent_frames,
+            "dropped_frames" : self.dropped_frames,
+            "dropped_bytes" : self.dropped_bytes,
+            "delayed_frames" : self.delayed_frames,
+            "delay_ns" : self.delay,
+            "dropped_topics" : dict(self.dropped_topics)
+        }
+
+    def set_topic_budget(self, topic, rate, burst=None):
+        """
+Limits frames of topic to rate bytes per second on the wire, with bursts up to
+burst bytes (rate * window by default). rate None removes the budget.
+        """
+        if rate is None:
+            self.topics.pop(topic, None)
+        else:
+            self.topics[topic] = _Bucket(rate, rate * self.window if burst is None else burst)
+
+    def admit(self, topic, size, link=True, before_wait=None):
+        """
+Charges a frame of size bytes on topic (None if several or no topic) to the
+budgets, waiting for them if needed. Returns False if the frame must be dropped.
+With link False, only the budget of the topic is charged. before_wait, if given,
+is called before waiting.
+        """
+        buckets = [self.link] if link else []
+        bucket = self.topics.get(topic)
+        if bucket is not None:
+            buckets.append(bucket)
+        if not buckets:
+            return True
+
+        now = monotonic_ns()
+        for bucket in buckets:
+            bucket.refill(now)
+        wait = max(bucket.wait() for bucket in buckets)
+
+        if wait > 0:
+            if self.policy == DROP:
+                self.dropped_frames += 1
+                self.dropped_bytes += size
+                self.dropped_topics[topic] = self.dropped_topics.get(topic, 0) + 1
+                return False
+            self.delayed_frames += 1
+            self.delay += wait
+            if before_wait is not None:
+                before_wait()
+                # Writing took some of the wait
+                now = monotonic_ns()
+                for bucket in buckets:
+                    bucket.refill(now)
+                wait = max(bucket.wait() for bucket in buckets)
+            time.sleep(wait / 1e9)
+            now = monotonic_ns()
+            for bucket in buckets:
+                bucket.refill(now)
+
+        for bucket in buckets:
+            bucket.tokens -= size
+        if link:
+            self.sent_bytes += size
+            self.sent_frames += 1
+        return True
+
+    def charge(self, size):
+        """
+Charges a frame that is sent in any case (protocol frames) to the link budget.
+        """
+        self.link.refill(monotonic_ns())
+        self.link.tokens -= size
+        self.sent_bytes += size
+        self.sent_frames += 1
@@ -0,0 +1,414 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+"""
+    Compact binary capture of raw frames.
+
+    A capture file starts with the MAGIC string, followed by blocks of
+    records. Each record is [timestamp in ns as int64][direction as uint8]
+    [frame size as uint32][frame], the frame being the unstuffed frame with
+    its CRC, exactly as seen by Telemetry.
+
+    Files closed properly end with a sparse index (first and last timestamp,
+    offset, size, topics and topic id announces of each block) followed by a trailer
+    [index offset as uint64][INDEX_MAGIC]. The index lets a reader jump to a
+    point in time or to the blocks containing a topic without reading the
+    rest of the file. Files without index (interrupted capture) are indexed
+    by scanning them once when opened.
+"""
+from bisect import bisect_left
+from struct import pack, unpack, unpack_from, calcsize
+from threading import Thread, Lock
+import json
+import os
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+from pytelemetry.telemetry.telemetry import Telemetry, monotonic_ns, TOPIC_ID_FLAG, TOPIC_ID_ANNOUNCE, \
+                                            CONTAINER, RX, TX
+
+MAGIC = b'PTLMCAP1'
+INDEX_MAGIC = b'PTLMIDX1'
+
+RECORD = "<qBI"
+RECORD_SIZE = calcsize(RECORD)
+TRAILER = "<Q8s"
+TRAILER_SIZE = calcsize(TRAILER)
+
+# Default amount of bytes per block
+BLOCK_SIZE = 65536
+
+class CaptureWriter:
+    """
+        Writes frames to a capture file.
+
+        Records are appended to one of two buffers while a background thread
+        writes the other one to disk, so record() never waits for the disk
+        unless both buffers are full. Each buffer becomes one indexed block.
+
+        >>> capture = CaptureWriter('session.ptc')
+        >>> tlm.add_recorder(capture)
+        >>> ...
+        >>> tlm.remove_recorder(capture)
+        >>> capture.close()
+    """
+    def __init__(self, path, block_size=BLOCK_SIZE):
+        """
+            :param path: path of the capture file, overwritten if it exists
+            :param block_size: amount of bytes per block. Smaller blocks give
+            a finer index but a bigger one
+        """
+        self.block_size = block_size
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+
+        # blocks index : [first timestamp, last timestamp, offset, size, topics,
+        # [direction, id, topic] of topic id announces]
+        self.index = []
+
+        self.lock = Lock()
+        self.free = Queue()
+        self.full = Queue()
+        self.free.put(bytearray())
+        self.free.put(bytearray())
+        self._new_block()
+
+        self.error = None
+        self.thread = Thread(target=self._write_blocks, name='CaptureWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, direction, timestamp, frame):
+        """
+Appends a frame to the capture. direction is RX or TX, timestamp is in ns
+(time.monotonic_ns() clock). The frame is copied, the caller keeps ownership.
+        """
+        if timestamp is None:
+            timestamp = monotonic_ns()
+
+        with self.lock:
+            if self.first is None:
+                self.first = timestamp
+            self.first = min(self.first, timestamp)
+            self.last = max(self.last, timestamp)
+
+            topics = frame_topics(frame)
+            if topics is None or self.topics is None:
+                # block has frames with unknown topics, never skipped
+                self.topics = None
+            else:
+                self.topics.update(topics)
+            announce = _frame_announce(frame)
+            if announce is not None:
+                self.announces.append([direction, announce[0], announce[1]])
+
+            self.buffer.extend(pack(RECORD, timestamp, direction, len(frame)))
+            self.buffer.extend(frame)
+
+            if len(self.buffer) >= self.block_size:
+                self._swap()
+
+    def flush(self):
+        """
+Hands the current block to the writer thread.
+        """
+        with self.lock:
+            self._swap()
+
+    def close(self):
+        """
+Writes pending blocks and the index, then closes the file.
+        """
+        self.flush()
+        self.full.put(None)
+        self.thread.join()
+
+        self.file.write(json.dumps({'blocks': self.index}).encode('utf8'))
+        self.file.write(pack(TRAILER, self.offset, INDEX_MAGIC))
+        self.file.close()
+
+        if self.error is not None:
+            raise self.error
+
+    def _new_block(self):
+        # Blocks until the writer thread returns a buffer
+        self.buffer = self.free.get()
+        self.first = None
+        self.last = 0
+        self.topics = set()
+        self.announces = []
+
+    def _swap(self):
+        if not self.buffer:
+            return
+        topics = None if self.topics is None else sorted(self.topics)
+        self.index.append([self.first, self.last, self.offset, len(self.buffer), topics, self.announces])
+        self.offset += len(self.buffer)
+        self.full.put(self.buffer)
+        self._new_block()
+
+    def _write_blocks(self):
+        while True:
+            block = self.full.get()
+            if block is None:
+                return
+            try:
+                self.file.write(block)
+            except (IOError, OSError) as e:
+                self.error = e
+            del block[:]
+            self.free.put(block)
+
+class CaptureReader:
+    """
+        Reads a capture file written by CaptureWriter.
+
+        >>> capture = CaptureReader('session.ptc')
+        >>> for timestamp, direction, frame in capture.records(start=t):
+        >>>     ...
+        >>> for timestamp, topic, value in capture.samples('temperature'):
+        >>>     ...
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{0} is not a capture file".format(path))
+        self.index = self._load_index()
+        # Timestamps are not sorted across blocks (directions recorded by
+        # different threads, timestamps given by the caller) : running maximum
+        # of the lasts, and minimum of the firsts of the following blocks
+        self.lasts = []
+        for block in self.index:
+            self.lasts.append(max(block[1], self.lasts[-1]) if self.lasts else block[1])
+        self.firsts = [block[0] for block in self.index]
+        for i in range(len(self.firsts) - 2, -1, -1):
+            self.firsts[i] = min(self.firsts[i], self.firsts[i + 1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def topics(self):
+        """
+Returns the topics found in the capture, None if some blocks hold frames with
+unknown topics (topic ids).
+        """
+        topics = set()
+        for block in self.index:
+            if block[4] is None:
+                return None
+            topics.update(block[4])
+        return topics
+
+    def records(self, start=None, end=None, topic=None, direction=None):
+        """
+Yields (timestamp, direction, frame) of the records between start and end
+timestamps (in ns), only reading the blocks that may contain them.
+With topic, only the blocks that contain this topic are read, but their other
+records are yielded as well.
+        """
+        for block, selected in self._blocks(start, end, topic):
+            if not selected:
+                continue
+            for timestamp, way, frame in self._read_block(block):
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    continue
+                if direction is not None and way != direction:
+                    continue
+                yield timestamp, way, frame
+
+    def seek(self, timestamp):
+        """
+Yields records from timestamp (in ns) to the end of the capture.
+        """
+        return self.records(start=timestamp)
+
+    def samples(self, topic=None, start=None, end=None, direction=RX):
+        """
+Yields decoded (timestamp, topic, value) of a direction, optionally for a single
+topic.
+        """
+        # topic ids are learned from the frames themselves, announces of the
+        # records that are not yielded included
+        decoders = {RX: Telemetry(None, None), TX: Telemetry(None, None)}
+        for block in self.index[:self._first_block(start)]:
+            self._replay_announces(decoders, block)
+
+        for block, selected in self._blocks(start, end, topic):
+            if not selected:
+                self._replay_announces(decoders, block)
+                continue
+            for timestamp, way, frame in self._read_block(block):
+                if direction is not None and way != direction:
+                    continue
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    if _frame_announce(frame) is not None:
+                        decoders[way]._decode_frame(frame)
+                    continue
+                decoded = decoders[way]._decode_frame(frame)
+                if decoded is None:
+                    continue
+                if not isinstance(decoded, list):
+                    decoded = [decoded]
+                for t, value in decoded:
+                    if topic is None or t == topic:
+                        yield timestamp, t, value
+
+    def _first_block(self, start):
+        # Blocks before it hold no record from start
+        if start is None:
+            return 0
+        return bisect_left(self.lasts, start)
+
+    def _blocks(self, start, end, topic):
+        # Yields (block, selected) from the first block that may hold records
+        # from start to the last one that may hold records until end. Selected
+        # blocks may hold records of topic
+        for i in range(self._first_block(start), len(self.index)):
+            if end is not None and self.firsts[i] > end:
+                break
+            block = self.index[i]
+            block_first, block_last, topics = block[0], block[1], block[4]
+            selected = not (start is not None and block_last < start) \
+                       and not (end is not None and block_first > end) \
+                       and not (topic is not None and topics is not None and not topic in topics)
+            yield block, selected
+
+    def _read_block(self, block):
+        # Yields (timestamp, direction, frame) of the records of a block
+        self.file.seek(block[2])
+        data = self.file.read(block[3])
+        pos = 0
+        while pos + RECORD_SIZE <= len(data):
+            timestamp, way, length = unpack_from(RECORD, data, pos)
+            pos += RECORD_SIZE
+            frame = bytearray(data[pos:pos + length])
+            pos += length
+            yield timestamp, way, frame
+
+    def _announces(self, block):
+        # Indexes written before announces were indexed : scanned once
+        if len(block) < 6:
+            announces = []
+            for timestamp, way, frame in self._read_block(block):
+                announce = _frame_announce(frame)
+                if announce is not None:
+                    announces.append([way, announce[0], announce[1]])
+            block.append(announces)
+        return block[5]
+
+    def _replay_announces(self, decoders, block):
+        for way, tid, topic in self._announces(block):
+            decoder = decoders.get(way)
+            if decoder is not None:
+                decoder._decode_frame(decoder._encode_topic_id_frame(TOPIC_ID_ANNOUNCE, topic, tid))
+
+    def _load_index(self):
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        if size >= len(MAGIC) + TRAILER_SIZE:
+            self.file.seek(size - TRAILER_SIZE)
+            offset, magic = unpack(TRAILER, self.file.read(TRAILER_SIZE))
+            if magic == INDEX_MAGIC:
+                self.file.seek(offset)
+                index = self.file.read(size - TRAILER_SIZE - offset)
+                return json.loads(index.decode('utf8'))['blocks']
+        return self._scan_index(size)
+
+    def _scan_index(self, size):
+        # Interrupted capture : records are grouped in blocks of about
+        # BLOCK_SIZE bytes, as CaptureWriter does
+        index = []
+        block = None
+        offset = len(MAGIC)
+        self.file.seek(offset)
+        while offset + RECORD_SIZE <= size:
+            timestamp, way, length = unpack(RECORD, self.file.read(RECORD_SIZE))
+            if offset + RECORD_SIZE + length > size:
+                break
+            frame = bytearray(self.file.read(length))
+            if block is None:
+                block = [timestamp, timestamp, offset, 0, set(), []]
+                index.append(block)
+            block[0] = min(block[0], timestamp)
+            block[1] = max(block[1], timestamp)
+            block[3] += RECORD_SIZE + length
+            topics = frame_topics(frame)
+            if topics is None or block[4] is None:
+                block[4] = None
+            else:
+                block[4].update(topics)
+            announce = _frame_announce(frame)
+            if announce is not None:
+                block[5].append([way, announce[0], announce[1]])
+            offset += RECORD_SIZE + length
+            if block[3] >= BLOCK_SIZE:
+                block = None
+
+        for block in index:
+            if block[4] is not None:
+                block[4] = sorted(block[4])
+        return index
+
+def frame_topics(frame):
+    """
+Returns the topics of an unstuffed frame without decoding it, or None if the
+frame uses topic ids.
+    """
+    if len(frame) < 4:
+        return []
+    header, = unpack_from("<H", frame)
+    if header != CONTAINER:
+        return _body_topics(frame, 0, len(frame) - 2)
+
+    topics = []
+    begin = 2
+    end = len(frame) - 2
+    while begin + 2 <= end:
+        size, = unpack_from("<H", frame, begin)
+        begin += 2
+        record_topics = _body_topics(frame, begin, min(begin + size, end))
+        if record_topics is None:
+            return None
+        topics.extend(record_topics)
+        begin += size
+    return topics
+
+def _frame_announce(frame):
+    # (id, topic) of a topic id announce frame, None for other frames
+    end = len(frame) - 2
+    if end < 2:
+        return None
+    header, = unpack_from("<H", frame)
+    if header != TOPIC_ID_ANNOUNCE:
+        return None
+    i = frame.find(b'\0', 2, end)
+    if i < 0 or end - i != 3:
+        return None
+    tid, = unpack_from("<H", frame, i + 1)
+    return tid, frame[2:i].decode('utf8', 'replace')
+
+def _body_topics(frame, begin, end):
+    if end - begin < 2:
+        return []
+    header, = unpack_from("<H", frame, begin)
+    if header & TOPIC_ID_FLAG:
+        return None
+    i = frame.find(b'\0', begin + 2, end)
+    if i < 0:
+        return []
+    return [frame[begin+2:i].decode('utf8', 'replace')]
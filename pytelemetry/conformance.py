@@ -0,0 +1,197 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+"""
+    Differential testing of the protocol backends.
+
+    generate() builds a received byte stream from random frames, optionally
+    made adversarial : payloads and topics full of bytes that need escaping,
+    frames with a bad crc, truncated frames, frames whose EOF is escaped and
+    garbage between frames. It also returns the records that must be
+    decoded from it : the frames left intact.
+
+    decode() feeds the same chunks to a backend (Telemetry, or the C binding
+    TelemetryCBinding) and returns what it decoded, its stats and the time
+    it took, so that backends can be checked against the expected records,
+    against each other, and timed on the same traffic.
+
+    >>> chunks, expected = generate(seed=1, **PROFILES['adversarial'])
+    >>> records, stats, elapsed = decode(Telemetry, chunks)
+    >>> assert records == expected
+
+    Streams only use what both backends support : scalars and strings of
+    printable characters, without topic ids nor containers.
+"""
+from random import Random
+from struct import unpack
+import math
+import time
+
+from pytelemetry.telemetry.telemetry import Telemetry
+
+# (topic, datatype) of generated frames
+TOPICS = (('a', 'uint8'),
+          ('sensors/temperature', 'float32'),
+          ('imu/acc:2', 'int16'),
+          ('counter', 'uint32'),
+          ('offset', 'int32'),
+          ('delta', 'int8'),
+          ('raw', 'uint16'),
+          ('status', 'string'),
+          # 0x7d and 0x7f are escaped on the wire
+          ('}\x7f', 'uint16'))
+
+# Keyword arguments of generate()
+PROFILES = {
+    'clean' : dict(),
+    'escapes' : dict(escapes=True),
+    'adversarial' : dict(escapes=True, bad_crc=0.05, truncated=0.05, escaped_eof=0.02, garbage=0.05)
+}
+
+# Printable characters of generated strings, including the escaped 0x7d
+CHARACTERS = ''.join(chr(c) for c in range(0x20, 0x7f))
+
+# Time of benchmarks (Python 2 : time.time)
+perf_counter = getattr(time, 'perf_counter', time.time)
+
+def generate(seed=None, frames=1000, escapes=False, bad_crc=0., truncated=0., escaped_eof=0.,
+             garbage=0., max_chunk=64):
+    """
+Returns (chunks, expected) : a received stream cut in chunks of 1 to max_chunk
+bytes, and the (topic, value) records of its intact frames, in order.
+Each frame has a probability bad_crc of being sent with a corrupted byte,
+truncated of being cut before its EOF, escaped_eof of getting an ESC before its
+EOF, and garbage of being followed by random bytes (SOF excepted).
+With escapes, payloads are mostly made of bytes that need escaping.
+    """
+    rng = Random(seed)
+    encoder = Telemetry(None, None)
+    delimiter = encoder.delimiter
+    stream = bytearray()
+    expected = []
+
+    for i in range(frames):
+        topic, datatype = rng.choice(TOPICS)
+        value = _value(rng, encoder, datatype, escapes)
+        frame = encoder._encode_frame(topic, value, datatype)
+
+        draw = rng.random()
+        if draw < bad_crc:
+            # A single corrupted byte is always caught by the crc
+            frame[rng.randrange(len(frame))] ^= rng.randrange(1, 256)
+            stream.extend(delimiter.encode(frame))
+        elif draw < bad_crc + truncated:
+            stuffed = delimiter.encode(frame)
+            stream.extend(_truncate(delimiter, stuffed, rng.randrange(1, len(stuffed) - 1)))
+        elif draw < bad_crc + truncated + escaped_eof:
+            # EOF becomes data, the frame ends with the next SOF
+            stuffed = delimiter.encode(frame)
+            stuffed.insert(len(stuffed) - 1, delimiter.ESC)
+            stream.extend(stuffed)
+        else:
+            stream.extend(delimiter.encode(frame))
+            expected.append((topic, value))
+
+        if rng.random() < garbage:
+            stream.extend(rng.choice([b for b in range(256) if b != delimiter.SOF])
+                          for _ in range(rng.randrange(1, 16)))
+
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.randrange(1, max_chunk + 1)
+        chunks.append(bytes(stream[pos:pos + size]))
+        pos += size
+    return chunks, expected
+
+def decode(factory, chunks, **attributes):
+    """
+Decodes chunks with factory(transport, callback), a backend class, calling its
+update() after each chunk. attributes are set on the backend beforehand (for
+instance rx_chunk_size). Returns the decoded (topic, value) records, the stats
+of the backend ({} if it has none) and the decoding time in seconds.
+    """
+    records = []
+    transport = StreamTransport()
+    api = factory(transport, lambda topic, data, timestamp=None: records.append((topic, data)))
+    for name, value in attributes.items():
+        setattr(api, name, value)
+
+    start = perf_counter()
+    for chunk in chunks:
+        transport.feed(chunk)
+        api.update()
+    elapsed = perf_counter() - start
+
+    return records, stats(api), elapsed
+
+def stats(api):
+    """
+Returns framing and protocol stats of a backend in a single dictionary.
+    """
+    d = dict()
+    delimiter = getattr(api, 'delimiter', None)
+    if delimiter is not None:
+        d.update(delimiter.stats())
+    if hasattr(api, 'stats'):
+        d.update(api.stats())
+    return d
+
+def common_stats(a, b):
+    """
+Returns the stats reported by both backends, as (a, b) dictionaries, or None if
+they report no stat in common : their stats are not comparable.
+    """
+    keys = set(a) & set(b)
+    if not keys:
+        return None
+    return dict((k, a[k]) for k in keys), dict((k, b[k]) for k in keys)
+
+class StreamTransport:
+    """
+        Transport reading the chunks it is fed, discarding written bytes.
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.pos = 0
+
+    def feed(self, chunk):
+        del self.data[:self.pos]
+        self.pos = 0
+        self.data.extend(chunk)
+
+    def read(self, maxbytes=1):
+        data = self.data[self.pos:self.pos + maxbytes]
+        self.pos += len(data)
+        return data
+
+    def readable(self):
+        return len(self.data) - self.pos
+
+    def write(self, data):
+        return 0
+
+    def writeable(self):
+        return True
+
+def _value(rng, encoder, datatype, escapes):
+    # Random value, exactly representable in its datatype
+    if datatype == 'string':
+        if escapes:
+            return ''.join(rng.choice('}\x7f' + CHARACTERS[:4]) for _ in range(rng.randrange(16)))
+        return ''.join(rng.choice(CHARACTERS) for _ in range(rng.randrange(16)))
+
+    special = bytearray(encoder.delimiter.special_bytes)
+    while True:
+        raw = bytearray(rng.choice(special) if escapes and rng.random() < 0.7 else rng.randrange(256)
+                        for _ in range(encoder.sizes[datatype]))
+        value, = unpack("<" + encoder.formats[datatype], bytes(raw))
+        # nan is never equal to itself
+        if not (datatype == 'float32' and math.isnan(value)):
+            return value
+
+def _truncate(delimiter, stuffed, size):
+    # First size bytes of a stuffed frame, without a dangling ESC that would
+    # escape the SOF of the next frame
+    escaping = False
+    for c in stuffed[1:size]:
+        escaping = not escaping and c == delimiter.ESC
+    return stuffed[:size - 1] if escaping else stuffed[:size]
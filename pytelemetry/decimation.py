@@ -0,0 +1,110 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+import six
+from pytelemetry.telemetry.telemetry import monotonic_ns
+
+# Value given to the callback of decimated topics, once per time bucket.
+# min, max and mean are computed over numeric values only, None if the bucket
+# only holds non numeric values (strings). count includes all values
+Aggregate = namedtuple('Aggregate', ['min', 'max', 'mean', 'last', 'count'])
+
+class Decimator:
+    """
+        Reduces a high-rate topic to one Aggregate per time bucket.
+
+        Samples are accumulated in constant memory (min, max, sum, last and
+        count per topic and index) and the aggregate of a bucket is given to
+        the callback when the first sample of a later bucket arrives, or
+        when expire() finds the bucket over.
+        Arrays are aggregated over all their items.
+    """
+    def __init__(self, period, callback, timestamp=False):
+        """
+            :param period: bucket duration in seconds, strictly positive
+            :param callback: called as callback(topic, aggregate, opts), with
+            the timestamp of the last sample of the bucket as fourth argument
+            if timestamp is True
+        """
+        if not period > 0:
+            raise ValueError("Decimation period must be positive, got {0}".format(period))
+        self.period = int(period * 1e9)
+        if self.period <= 0:
+            raise ValueError("Decimation period {0} is below 1 ns".format(period))
+        self.callback = callback
+        self.timestamp = timestamp
+        # (topic, index) -> [bucket, opts, count, min, max, sum, last, last timestamp,
+        # count of numeric values]
+        self.buckets = dict()
+
+    def __call__(self, topic, data, opts, timestamp):
+        if timestamp is None:
+            timestamp = monotonic_ns()
+        bucket = timestamp // self.period
+        key = (topic, opts['index'] if opts else None)
+
+        state = self.buckets.get(key)
+        if state is not None and state[0] != bucket:
+            self._emit(topic, state)
+            state = None
+
+        if isinstance(data, (six.string_types, bytes)):
+            low = high = total = None
+            count = 1
+            last = data
+        elif hasattr(data, '__len__'):
+            # array, aggregated over its items
+            if not len(data):
+                return
+            low = min(data)
+            high = max(data)
+            total = sum(data)
+            count = len(data)
+            last = data[-1]
+        else:
+            low = high = total = last = data
+            count = 1
+
+        if state is None:
+            self.buckets[key] = [bucket, opts, count, low, high, total, last, timestamp,
+                                 0 if total is None else count]
+            return
+
+        state[2] += count
+        if total is not None and state[5] is None:
+            state[3], state[4], state[5] = low, high, total
+            state[8] = count
+        elif total is not None:
+            state[3] = min(state[3], low)
+            state[4] = max(state[4], high)
+            state[5] += total
+            state[8] += count
+        state[6] = last
+        state[7] = timestamp
+
+    def expire(self, now=None):
+        """
+Emits the aggregates of buckets that ended before now (in ns).
+        """
+        if now is None:
+            now = monotonic_ns()
+        bucket = now // self.period
+        for key, state in list(self.buckets.items()):
+            if state[0] < bucket:
+                self._emit(key[0], state)
+
+    def flush(self):
+        """
+Emits all pending aggregates, even of buckets not over yet.
+        """
+        for key, state in list(self.buckets.items()):
+            self._emit(key[0], state)
+
+    def _emit(self, topic, state):
+        bucket, opts, count, low, high, total, last, timestamp, numeric = state
+        del self.buckets[(topic, opts['index'] if opts else None)]
+        mean = None if total is None else total / numeric
+        aggregate = Aggregate(low, high, mean, last, count)
+        if self.timestamp:
+            self.callback(topic, aggregate, opts, timestamp)
+        else:
+            self.callback(topic, aggregate, opts)
@@ -0,0 +1,76 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import six
+from pytelemetry.telemetry.telemetry import monotonic_ns
+
+class ChangeFilter:
+    """
+        Drops samples of a topic before they reach the callback.
+
+        A sample is given to the callback only if it differs from the last
+        sample given to it (on_change), by more than deadband for numbers and
+        array items, and if at least min_interval seconds elapsed since then.
+        The first sample of each topic and index always passes.
+        Comparing with the last sample given to the callback, rather than the
+        last received one, keeps slow drifts from being filtered forever.
+    """
+    def __init__(self, callback, timestamp=False, deadband=None, on_change=False, min_interval=None):
+        """
+            :param callback: called as callback(topic, data, opts), with the
+            timestamp of the sample as fourth argument if timestamp is True
+        """
+        self.callback = callback
+        self.timestamp = timestamp
+        self.deadband = deadband
+        self.on_change = on_change or deadband is not None
+        self.min_interval = None if min_interval is None else int(min_interval * 1e9)
+        # (topic, index) -> [last value, last timestamp] given to the callback
+        self.last = dict()
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.passed = 0
+        self.filtered = 0
+
+    def stats(self):
+        return {
+            "passed" : self.passed,
+            "filtered" : self.filtered
+        }
+
+    def __call__(self, topic, data, opts, timestamp):
+        if timestamp is None:
+            timestamp = monotonic_ns()
+        key = (topic, opts['index'] if opts else None)
+
+        last = self.last.get(key)
+        if last is not None:
+            if self.min_interval is not None and timestamp - last[1] < self.min_interval:
+                self.filtered += 1
+                return
+            if self.on_change and not self._changed(last[0], data):
+                self.filtered += 1
+                return
+            last[0] = data
+            last[1] = timestamp
+        else:
+            self.last[key] = [data, timestamp]
+
+        self.passed += 1
+        if self.timestamp:
+            self.callback(topic, data, opts, timestamp)
+        else:
+            self.callback(topic, data, opts)
+
+    def _changed(self, previous, data):
+        if self.deadband is None or isinstance(data, (six.string_types, bytes)):
+            return previous != data
+        try:
+            if hasattr(data, '__len__'):
+                # arrays change when any item moves by more than the deadband
+                return len(previous) != len(data) or \
+                       any(abs(a - b) > self.deadband for a, b in zip(previous, data))
+            return abs(data - previous) > self.deadband
+        except TypeError:
+            # datatype of the topic changed
+            return True
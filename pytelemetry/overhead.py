@@ -0,0 +1,284 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+"""
+    Protocol overhead analysis.
+
+    Splits the bytes of raw frames into categories : delimiters (SOF, EOF),
+    escapes added by byte stuffing, headers, topics (strings with their NUL,
+    or ids), payload, crc, containers (container headers and record sizes),
+    control (topic id negotiation) and invalid (frames that could not be
+    parsed, bytes outside frames). Everything but the payload is overhead.
+
+    On a live link, the analyzer is a recorder :
+
+    >>> analyzer = OverheadAnalyzer()
+    >>> tlm.add_recorder(analyzer)
+    >>> ...
+    >>> analyzer.report()
+
+    and it reads captures as well :
+
+    >>> analyzer.analyze(CaptureReader('session.ptc').records())
+
+    Totals without the per topic split are also counted by Telemetry and
+    Delimiter, in tlm.stats()['protocol'] (*_bytes) and tlm.stats()['framing'].
+"""
+from struct import unpack_from
+
+from pytelemetry.telemetry.framing import Delimiter, RX_STATE
+from pytelemetry.telemetry.telemetry import Telemetry, TOPIC_ID_FLAG, TOPIC_ID_ANNOUNCE, \
+                                            TOPIC_ID_ACK, TOPIC_ID_UNKNOWN, CONTAINER, RX, TX
+
+CATEGORIES = ('delimiters', 'escapes', 'headers', 'topics', 'payload', 'crc',
+              'containers', 'control', 'invalid')
+
+# Topic of the bytes not belonging to a single topic : containers, control and
+# invalid frames
+SHARED = None
+
+class OverheadAnalyzer:
+    """
+        Accounts bytes of raw frames per topic and category, and estimates the
+        savings of topic ids and batching on the same traffic.
+
+        The batching estimate packs the plain frames of each direction into
+        containers the way Telemetry does with enable_batching(mtu), keeping
+        together only frames at most window seconds apart (any delay if None).
+        The topic id estimate charges an announce and an acknowledgement per
+        topic, and gives 1 byte ids to the 128 most frequent topics.
+    """
+    def __init__(self, direction=None, mtu=256, window=None):
+        """
+            :param direction: RX or TX to analyze a single direction, both if None
+            :param mtu: mtu of the batching estimate
+            :param window: seconds of the batching estimate
+        """
+        self.direction = direction
+        self.mtu = mtu
+        self.window = None if window is None else int(window * 1e9)
+        self.special_bytes = Delimiter(None).special_bytes
+        self.rtypes = Telemetry(None, None).rtypes
+
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        # topic -> category -> bytes, plus records and records with a topic string
+        self.topics = dict()
+        # Ids announced in each direction, for the frames in the same direction
+        self.topic_ids = {RX: dict(), TX: dict()}
+        # Plain frames being packed per direction : [first timestamp, container
+        # records size, escapes of records, records, bytes as plain frames]
+        self.pending = {RX: None, TX: None}
+        self.batching_saved = 0
+
+    def record(self, direction, timestamp, frame):
+        """
+Accounts an unstuffed frame with its crc.
+        """
+        if self.direction is not None and direction != self.direction:
+            return
+        self.frames += 1
+        end = len(frame) - 2
+        if end < 2:
+            self._add(SHARED, 'invalid', 2 + len(frame) + self._escapes(frame, 0, len(frame)))
+            return
+
+        header, = unpack_from("<H", frame)
+        if header == CONTAINER:
+            shared = self._entry(SHARED)
+            shared['delimiters'] += 2
+            shared['containers'] += 2
+            shared['crc'] += 2
+            shared['escapes'] += self._escapes(frame, 0, 2) + self._escapes(frame, end, end + 2)
+            begin = 2
+            while begin + 2 <= end:
+                size, = unpack_from("<H", frame, begin)
+                if begin + 2 + size > end:
+                    break
+                entry = self._body(direction, frame, begin + 2, begin + 2 + size)
+                if entry is None:
+                    self._add(SHARED, 'invalid', 2 + size + self._escapes(frame, begin, begin + 2 + size))
+                else:
+                    entry['containers'] += 2
+                    entry['escapes'] += self._escapes(frame, begin, begin + 2 + size)
+                begin += 2 + size
+            if begin < end:
+                self._add(SHARED, 'invalid', end - begin + self._escapes(frame, begin, end))
+            return
+
+        escapes = self._escapes(frame, 0, len(frame))
+        if header in (TOPIC_ID_ANNOUNCE, TOPIC_ID_ACK, TOPIC_ID_UNKNOWN):
+            self._control(direction, header, frame, end)
+            shared = self._entry(SHARED)
+            shared['delimiters'] += 2
+            shared['control'] += end
+            shared['crc'] += 2
+            shared['escapes'] += escapes
+            return
+
+        entry = self._body(direction, frame, 0, end)
+        if entry is None:
+            self._add(SHARED, 'invalid', 2 + len(frame) + escapes)
+            return
+        entry['delimiters'] += 2
+        entry['crc'] += 2
+        entry['escapes'] += escapes
+        self._batch(direction, timestamp, end, self._escapes(frame, 0, end), escapes)
+
+    def analyze(self, records):
+        """
+Accounts (timestamp, direction, frame) records, for instance
+CaptureReader.records().
+        """
+        for timestamp, direction, frame in records:
+            self.record(direction, timestamp, frame)
+
+    def analyze_stream(self, chunks, direction=RX):
+        """
+Accounts a raw dump of the link (stuffed bytes), given as an iterable of byte
+chunks.
+        """
+        delimiter = Delimiter(lambda frame: self.record(direction, None, frame))
+        for chunk in chunks:
+            delimiter.decode(chunk)
+        if self.direction is None or direction == self.direction:
+            # Bytes outside frames, and SOF of frames never ended
+            unfinished = 1 + delimiter.framesize if delimiter.rx_state == RX_STATE.IN_PROCESS else 0
+            self._add(SHARED, 'invalid', delimiter.discarded_rx_bytes + unfinished +
+                                         delimiter.uncomplete_rx_frames + delimiter.oversized_rx_frames)
+
+    def report(self):
+        """
+Returns the bytes per category, in total and per topic (SHARED for containers,
+control and invalid frames), the overhead (ratio of bytes that are not payload)
+and the estimated savings in bytes of topic ids and batching.
+        """
+        totals = dict((category, 0) for category in CATEGORIES)
+        topics = dict()
+        for topic, entry in self.topics.items():
+            size = sum(entry[category] for category in CATEGORIES)
+            for category in CATEGORIES:
+                totals[category] += entry[category]
+            topics[topic] = dict((category, entry[category]) for category in CATEGORIES)
+            topics[topic].update(records=entry['records'], bytes=size,
+                                 overhead=_overhead(entry['payload'], size))
+        size = sum(totals.values())
+
+        batching = self.batching_saved
+        for pending in self.pending.values():
+            if pending is not None:
+                batching += pending[4] - _packed(pending)
+
+        return {
+            "frames" : self.frames,
+            "bytes" : size,
+            "categories" : totals,
+            "overhead" : _overhead(totals['payload'], size),
+            "topics" : topics,
+            "savings" : {
+                "topic_ids" : self._topic_ids_savings(),
+                "batching" : batching
+            }
+        }
+
+    def _entry(self, topic):
+        entry = self.topics.get(topic)
+        if entry is None:
+            entry = dict((category, 0) for category in CATEGORIES)
+            entry['records'] = 0
+            entry['named'] = 0
+            self.topics[topic] = entry
+        return entry
+
+    def _add(self, topic, category, size):
+        self._entry(topic)[category] += size
+
+    def _escapes(self, frame, begin, end):
+        # Each special byte is preceded by an ESC on the wire
+        part = bytes(frame[begin:end])
+        return len(part) - len(part.translate(None, self.special_bytes))
+
+    def _body(self, direction, frame, begin, end):
+        # Accounts header, topic and payload of frame[begin:end]
+        if end - begin < 2:
+            return None
+        header, = unpack_from("<H", frame, begin)
+        if header & TOPIC_ID_FLAG:
+            if not header ^ TOPIC_ID_FLAG in self.rtypes or end - begin < 3:
+                return None
+            start = begin + (4 if frame[begin+2] & 0x80 else 3)
+            if start > end:
+                return None
+            if start == begin + 4:
+                tid = (frame[begin+2] & 0x7f) << 8 | frame[begin+3]
+            else:
+                tid = frame[begin+2]
+            topic = self.topic_ids[direction].get(tid, '#{0}'.format(tid))
+            named = 0
+        else:
+            if not header in self.rtypes:
+                return None
+            i = frame.find(b'\0', begin + 2, end)
+            if i < 0:
+                return None
+            topic = bytes(frame[begin+2:i]).decode('utf8', 'replace')
+            start = i + 1
+            named = 1
+
+        entry = self._entry(topic)
+        entry['records'] += 1
+        entry['named'] += named
+        entry['headers'] += 2
+        entry['topics'] += start - begin - 2
+        entry['payload'] += end - start
+        return entry
+
+    def _control(self, direction, header, frame, end):
+        # Learns ids announced for the frames of this direction
+        if header != TOPIC_ID_ANNOUNCE:
+            return
+        i = frame.find(b'\0', 2, end)
+        if i < 0 or end - i != 3:
+            return
+        tid, = unpack_from("<H", frame, i + 1)
+        self.topic_ids[direction][tid] = bytes(frame[2:i]).decode('utf8', 'replace')
+
+    def _batch(self, direction, timestamp, record, record_escapes, escapes):
+        # Packs a plain frame as Telemetry.publish would with batching enabled.
+        # Escapes of the crc of the container are not known
+        pending = self.pending[direction]
+        if pending is not None:
+            late = self.window is not None and timestamp is not None and pending[0] is not None \
+                   and timestamp - pending[0] > self.window
+            if late or 4 + pending[1] + 2 + record > self.mtu:
+                self.batching_saved += pending[4] - _packed(pending)
+                pending = None
+        if pending is None:
+            pending = [timestamp, 0, 0, 0, 0]
+            self.pending[direction] = pending
+        pending[1] += 2 + record
+        pending[2] += record_escapes
+        pending[3] += 1
+        pending[4] += 4 + record + escapes
+
+    def _topic_ids_savings(self):
+        # Topics sent as strings, most frequent first
+        named = sorted(((entry['named'], topic) for topic, entry in self.topics.items()
+                        if topic is not SHARED and entry['named']), reverse=True)
+        saved = 0
+        for rank, (count, topic) in enumerate(named):
+            length = len(topic.encode('utf8'))
+            id_size = 1 if rank < 0x80 else 2
+            # announce and acknowledgement : delimiters, header, topic, NUL, id, crc
+            saved += count * (length + 1 - id_size) - 2 * (length + 9)
+        return saved
+
+def _packed(pending):
+    # Bytes of pending frames once packed : a lone frame stays a plain frame
+    if pending[3] == 1:
+        return pending[4]
+    # delimiters, container header, crc, records with their size
+    return 6 + pending[1] + pending[2]
+
+def _overhead(payload, size):
+    return 1. - payload / size if size else 0.
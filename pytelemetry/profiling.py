@@ -0,0 +1,81 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from threading import local
+try:
+    from time import perf_counter_ns
+except ImportError:
+    # Python < 3.7
+    try:
+        from time import perf_counter as _clock
+    except ImportError:
+        from time import time as _clock
+    def perf_counter_ns():
+        return int(_clock() * 1e9)
+
+class Profiler:
+    """
+        Accumulates call counts and wall time of hot path stages.
+
+        A stage is an attribute of an object (a method or a function stored on
+        the instance) that wrap() shadows with a timed instance attribute.
+        unwrap() puts the original functions back, so once profiling is
+        disabled the hot path goes back to plain calls. Original methods are
+        restored as instance attributes rather than deleted : on CPython 3.11+
+        deleting an instance attribute turns the instance dictionary into a
+        regular dict, which makes every attribute lookup on the object slower.
+
+        Stages nest (decoding a chunk calls the frame decoder, which computes
+        a crc...) : total_ns is the time spent in a stage including nested
+        stages, self_ns excludes them.
+    """
+    def __init__(self):
+        # name -> [calls, total_ns, self_ns]
+        self.stages = dict()
+        # (object, attribute, original function)
+        self.wrapped = []
+        # time of nested stages, per thread
+        self.local = local()
+
+    def resetStats(self):
+        for entry in self.stages.values():
+            entry[:] = [0, 0, 0]
+
+    def stats(self):
+        return dict((name, {"calls" : calls, "total_ns" : total, "self_ns" : own})
+                    for name, (calls, total, own) in self.stages.items())
+
+    def wrap(self, obj, attribute, stage):
+        """
+Replaces obj.attribute by a timed version accounted in stage. Objects without
+that attribute are left untouched.
+        """
+        function = getattr(obj, attribute, None)
+        if function is None:
+            return
+        self.stages.setdefault(stage, [0, 0, 0])
+        self.wrapped.append((obj, attribute, function))
+        setattr(obj, attribute, self._timed(function, self.stages[stage]))
+
+    def unwrap(self):
+        """
+Restores all wrapped attributes, most recent first.
+        """
+        while self.wrapped:
+            obj, attribute, function = self.wrapped.pop()
+            setattr(obj, attribute, function)
+
+    def _timed(self, function, entry):
+        state = self.local
+
+        def timed(*args, **kwargs):
+            outer = getattr(state, 'nested', 0)
+            state.nested = 0
+            start = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter_ns() - start
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] += elapsed - state.nested
+                state.nested = outer + elapsed
+        return timed
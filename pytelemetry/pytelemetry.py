@@ -1,13 +1,21 @@
 from __future__ import division  # Use Python 3-style division in Python 2
+from collections import deque, OrderedDict
+import select
+import time
 import six
-from pytelemetry.telemetry.telemetry import Telemetry
-from pytelemetry.telemetry.c_binding import TelemetryCBinding
+from pytelemetry.telemetry.telemetry import Telemetry, TOPIC_ID_MAX, PLAN_CACHE_SIZE, monotonic_ns
 from pytelemetry.remoting import translate
 
 __all__ = ['Pytelemetry']
 
 _telemetry_use_c_api = False
 
+# Longest wait of run() and frames() for received bytes, in seconds, so that
+# stop events and timeouts are noticed
+MAX_WAIT = 0.1
+# Polling period of transports without file descriptor, in seconds
+POLL_INTERVAL = 0.001
+
 # pytelemetry interface
 class Pytelemetry:
     """
@@ -43,11 +51,32 @@ class Pytelemetry:
 
         self.callbacks = dict()
         self.default_callback = None
+        # Topics whose callback also receives the frame arrival timestamp
+        self.timestamped = set()
+        self.batch_callback = None
+        self.batch_timestamp = False
+        # Decimation stages of subscribed topics
+        self.decimators = dict()
+        # Deadband, change-only and rate limiting stages of subscribed topics
+        self.filters = dict()
+        # Periodic publishes : topic -> [next due time in ns, period in ns, value, datatype]
+        self.scheduled = dict()
+        # Thread owning the transmission, if started
+        self.transmitter = None
+        # Held by the instance so that profiling can time it
+        self.translate = translate
+        # Received topic -> (callback, timestamped, translated topic, opts),
+        # least recently used first, emptied when subscriptions change
+        self.routes = OrderedDict()
+        self.profiler = None
 
         if _telemetry_use_c_api:
+            # ctypes and the C binding are only loaded when used
+            from pytelemetry.telemetry.c_binding import TelemetryCBinding
             self.api = TelemetryCBinding(transport,self._on_frame)
         else:
             self.api = Telemetry(transport,self._on_frame)
+        self._filter_topics()
 
     def resetStats(self):
         """
@@ -55,6 +84,14 @@ Resets all counters that monitor transport and protocol to 0.
         """
         self.api.delimiter.resetStats()
         self.api.resetStats()
+        if self.profiler is not None:
+            self.profiler.resetStats()
+        for f in self.filters.values():
+            f.resetStats()
+        if getattr(self.api, 'tx_budget', None) is not None:
+            self.api.tx_budget.resetStats()
+        if self.transmitter is not None:
+            self.transmitter.resetStats()
 
     def stats(self):
         """
@@ -68,38 +105,466 @@ about the transport and protocol behavior, such as:
         d = dict()
         d['framing'] = self.api.delimiter.stats()
         d['protocol'] = self.api.stats()
+        if self.transmitter is not None:
+            d['transmit'] = self.transmitter.stats()
+        if self.profiler is not None:
+            d['profile'] = self.profiler.stats()
+        if self.filters:
+            d['filters'] = dict((topic, f.stats()) for topic, f in self.filters.items())
+        if getattr(self.api, 'tx_budget', None) is not None:
+            d['budget'] = self.api.tx_budget.stats()
 
         return d
 
-    def publish(self, topic, data, datatype):
+    def enable_profiling(self, enabled=True):
+        """
+Enables or disables per-stage profiling. While enabled, call counts and time in
+ns of the hot path stages (read, decode, decode_frame, crc16, translate,
+callbacks, encode, write) are reported in stats()['profile']. total_ns includes
+nested stages, self_ns does not : the self time of callbacks is the time spent
+in subscribed callbacks.
+Disabling restores plain calls, so profiling costs nothing when not enabled.
+        """
+        if self.profiler is not None:
+            self.profiler.unwrap()
+            self.profiler = None
+
+        if enabled:
+            from pytelemetry.profiling import Profiler
+            self.profiler = Profiler()
+            api = self.api
+            if api.transport is not None:
+                self.profiler.wrap(api.transport, 'read', 'read')
+                self.profiler.wrap(api.transport, 'write', 'write')
+            if hasattr(api, 'delimiter'):
+                self.profiler.wrap(api.delimiter, 'decode', 'decode')
+                self.profiler.wrap(api.delimiter, 'encode', 'encode')
+            self.profiler.wrap(api, '_decode_frame', 'decode_frame')
+            self.profiler.wrap(api, 'crc16', 'crc16')
+            self.profiler.wrap(self, 'translate', 'translate')
+            self.profiler.wrap(self, '_on_frame', 'callbacks')
+            self.profiler.wrap(self, '_on_batch', 'callbacks')
+
+        # The api holds bound methods, refreshed to the (un)wrapped ones
+        self.api.on_frame_callback = self._on_frame
+        if self.api.on_batch_callback:
+            self.api.on_batch_callback = self._on_batch
+
+    def publish(self, topic, data, datatype, priority=None):
+        """
+Publishes data of type datatype on topic. When the transmit thread is started,
+the frame is only queued and any thread can publish. priority (transmit.CONTROL
+or transmit.BULK) then overrides the class of the topic.
+        """
+        if self.transmitter is not None:
+            self.transmitter.publish(topic, data, datatype, priority)
+        else:
+            self.api.publish(topic,data,datatype)
+
+    def schedule(self, topic, value, datatype, period):
+        """
+Publishes value on topic every period seconds while run() is running. value may
+be a function, called without argument for the value to publish each time.
+Scheduling a topic again replaces its previous schedule.
+        """
+        if not datatype in self.api.types:
+            raise IndexError("Provided datatype {0} not found for ({1}, {2})".format(datatype, topic, value))
+        self.scheduled[topic] = [monotonic_ns(), int(period * 1e9), value, datatype]
+
+    def unschedule(self, topic):
+        self.scheduled.pop(topic, None)
+
+    def set_link_budget(self, utilization=0.9, policy=None, baudrate=None):
+        """
+Limits sent bytes (on-wire size, stuffing included) to utilization times the
+capacity of the link, from baudrate (transport.baudrate by default). Frames over
+budget are delayed (policy 'delay') or dropped ('drop'). Utilization and dropped
+or delayed frames are reported in stats()['budget'].
+Delaying waits in the transmit thread, so 'delay' requires
+start_transmit_thread() : the default policy is 'delay' when the thread runs,
+'drop' otherwise, and stopping the thread switches the budget to 'drop'.
+utilization None removes the budgets.
+        """
+        from pytelemetry.budget import LinkBudget, DELAY, DROP
+        if utilization is None:
+            self.api.tx_budget = None
+            return
+        if policy is None:
+            policy = DROP if self.transmitter is None else DELAY
+        elif policy == DELAY and self.transmitter is None:
+            # publish() would sleep in the thread running update()
+            raise ValueError("Policy 'delay' requires start_transmit_thread()")
+        if baudrate is None:
+            baudrate = getattr(self.api.transport, 'baudrate', None)
+        if not baudrate:
+            raise ValueError("Baud rate of the link is unknown")
+        self.api.tx_budget = LinkBudget(baudrate, utilization, policy)
+
+    def set_topic_budget(self, topic, rate, burst=None):
+        """
+Limits frames published on topic to rate bytes per second on the wire, on top of
+the link budget set with set_link_budget(). rate None removes the topic budget.
+        """
+        if self.api.tx_budget is None:
+            raise ValueError("set_link_budget() must be called first")
+        self.api.tx_budget.set_topic_budget(topic, rate, burst)
+
+    def start_transmit_thread(self, max_batch=64, maxsize=0, max_write=1024, control_topics=()):
+        """
+Starts a thread owning the transport for writing. publish() then becomes thread
+safe and non-blocking: frames are encoded and written by that thread, in batches
+of up to max_batch frames per transport write. Encoding errors are logged and
+counted in stats()['transmit'] instead of being raised by publish().
+Frames on control_topics are written before any other queued frame, the others
+being written max_write bytes at a time. Queue depth and latency of both
+classes are reported in stats()['transmit'].
+        """
+        from pytelemetry.transmit import TransmitThread
+        if self.transmitter is None:
+            self.transmitter = TransmitThread(self.api, max_batch, maxsize, max_write, control_topics)
+            self.transmitter.start()
+
+    def stop_transmit_thread(self, timeout=None):
+        """
+Sends queued frames and stops the transmit thread. Returns False if the thread
+did not stop within timeout seconds, in which case it is kept running.
+        """
+        if self.transmitter is not None:
+            if not self.transmitter.stop(timeout):
+                return False
+            self.transmitter = None
+            budget = getattr(self.api, 'tx_budget', None)
+            if budget is not None:
+                from pytelemetry.budget import DELAY, DROP
+                if budget.policy == DELAY:
+                    self.api.log_tx.warning("Link budget now drops frames, delaying requires the transmit thread")
+                    budget.policy = DROP
+        return True
+
+    def enable_topic_ids(self, max_ids=TOPIC_ID_MAX):
+        """
+Negotiates short numeric ids with the peer for published topics, saving the
+topic string on each frame. See Telemetry.enable_topic_ids.
+        """
+        self.api.enable_topic_ids(max_ids)
+
+    def enable_batching(self, mtu=256):
+        """
+Packs published values into container frames of at most mtu bytes, sent on
+flush() or update(). See Telemetry.enable_batching.
+        """
+        self.api.enable_batching(mtu)
+
+    def flush(self):
+        """
+Sends published values waiting to be packed in a container frame.
+        """
+        if self.transmitter is not None:
+            self.transmitter.flush()
+        else:
+            self.api.flush()
+
+    def subscribe_batch(self, cb, timestamp=False):
         """
+Calls cb once per received container frame with the list of its
+(topic, data, opts) records, instead of calling topic callbacks for each of them.
+With timestamp=True, cb receives the frame arrival timestamp as second argument.
+Subscribing None restores per-topic callbacks.
+        """
+        self.batch_callback = cb
+        self.batch_timestamp = timestamp
+        self.api.on_batch_callback = self._on_batch if cb else None
+        self._filter_topics()
 
+    def enable_latest(self, enabled=True):
+        """
+Keeps the latest value of each received topic (indexes included, 'foo:2'), read
+with latest() and snapshot(). Frames on unsubscribed topics are then decoded.
+        """
+        self.api.latest = dict() if enabled else None
+        self.api.latest_snapshot = dict()
+        self._filter_topics()
+
+    def latest(self, topic):
+        """
+Returns the telemetry.Sample(value, datatype, timestamp, sequence) last received
+on topic, or None. Can be called from any thread, without blocking update().
+        """
+        latest = self.api.latest
+        if latest is None:
+            return None
+        return latest.get(topic)
+
+    def snapshot(self):
+        """
+Returns a dict of the latest Sample of every topic, as of the end of the last
+update() call. Can be called from any thread in O(1) : the dict is a copy made
+by update(), never modified afterwards. Do not modify it either.
         """
-        self.api.publish(topic,data,datatype)
+        return self.api.latest_snapshot
+
+    def add_recorder(self, recorder):
+        """
+Gives all received and sent raw frames to recorder.record(direction, timestamp,
+frame), for instance a pytelemetry.capture.CaptureWriter.
+        """
+        self.api.recorders.append(recorder)
+
+    def remove_recorder(self, recorder):
+        self.api.recorders.remove(recorder)
+
+    def add_sink(self, sink):
+        """
+Gives the topic, datatype, raw payload and timestamp of every decoded record to
+sink.write(topic, datatype, payload, timestamp), for instance a
+pytelemetry.sharing.SharedMemoryPublisher. Frames on unsubscribed topics are
+then decoded.
+        """
+        self.api.rx_sinks.append(sink)
+        self._filter_topics()
+
+    def remove_sink(self, sink):
+        self.api.rx_sinks.remove(sink)
+        self._filter_topics()
 
     # subscribe a callback to topic
     # Subscribing to None will call that function for any unsubscribed topic
-    def subscribe(self, topic, cb):
+    # With timestamp=True, the callback is called with a fourth argument, the
+    # estimated arrival time of the frame in ns (time.monotonic_ns() clock)
+    # With decimate=period (in seconds), the callback receives one
+    # decimation.Aggregate (min, max, mean, last, count) per period instead of
+    # every sample
+    # With on_change=True, samples equal to the last one given to the callback
+    # are dropped. With deadband=d, numbers (and array items) must also move by
+    # more than d. With min_interval=period (in seconds), the callback is called
+    # at most once per period. Dropped samples are counted in stats()['filters']
+    def subscribe(self, topic, cb, timestamp=False, decimate=None,
+                  deadband=None, on_change=False, min_interval=None):
+        if not topic:
+            topic = None
+        self.decimators.pop(topic, None)
+        self.filters.pop(topic, None)
+
+        if decimate:
+            from pytelemetry.decimation import Decimator
+            cb = Decimator(decimate, cb, timestamp)
+            self.decimators[topic] = cb
+            timestamp = True
+
+        if on_change or deadband is not None or min_interval:
+            from pytelemetry.filters import ChangeFilter
+            cb = ChangeFilter(cb, timestamp, deadband, on_change, min_interval)
+            self.filters[topic] = cb
+            timestamp = True
+
         if topic:
             self.callbacks[topic] = cb
         else:
             self.default_callback = cb
 
+        if timestamp:
+            self.timestamped.add(topic)
+        else:
+            self.timestamped.discard(topic)
+        self._filter_topics(topic)
+
+    # remove the callback subscribed to topic
+    # Unsubscribing None removes the default callback
+    def unsubscribe(self, topic):
+        if topic:
+            self.callbacks.pop(topic, None)
+        else:
+            topic = None
+            self.default_callback = None
+        self.timestamped.discard(topic)
+        self.decimators.pop(topic, None)
+        self.filters.pop(topic, None)
+        self._filter_topics(topic)
+
     def update(self):
         self.api.update()
 
-    def _on_frame(self, topic, payload):
+        # Emit aggregates of decimated topics that went quiet
+        if self.decimators:
+            now = monotonic_ns()
+            for decimator in self.decimators.values():
+                decimator.expire(now)
+
+    def run(self, until=None, stop_event=None):
+        """
+Processes received frames and scheduled publishes for until seconds (forever by
+default), or until stop_event (a threading.Event) is set.
+Instead of calling update() in a loop, run() sleeps until the transport has
+bytes to read or a scheduled publish is due, so an idle link costs no CPU.
+Transports exposing fileno() (like SerialTransport on Linux and macOS) are
+waited with select(), other ones are polled every millisecond.
+        """
+        deadline = None if until is None else monotonic_ns() + int(until * 1e9)
+        while stop_event is None or not stop_event.is_set():
+            due = self._publish_scheduled()
+            self.update()
+
+            now = monotonic_ns()
+            if deadline is not None:
+                if now >= deadline:
+                    return
+                due = deadline if due is None else min(due, deadline)
+            wait = MAX_WAIT
+            if due is not None:
+                wait = min(wait, (due - now) / 1e9)
+            for decimator in self.decimators.values():
+                # Aggregates of quiet topics are emitted once their period is over
+                wait = min(wait, decimator.period / 1e9)
+            self._wait(wait)
+
+    def frames(self, timeout=None):
+        """
+Yields (timestamp, topic, data) of received frames, calling update() whenever
+no frame is left. Topics are given as received, indexes included ('foo:2').
+While the generator runs, frames are not given to subscribed callbacks.
+The generator stops after timeout seconds without any frame (never by default).
+
+>>> for timestamp, topic, data in tlm.frames(timeout=1):
+>>>     print(topic, data)
+        """
+        pending = deque()
+
+        def on_frame(topic, data, timestamp=None):
+            pending.append((timestamp, topic, data))
+
+        def on_batch(records, timestamp=None):
+            for topic, data in records:
+                pending.append((timestamp, topic, data))
+
+        previous = self.api.on_frame_callback, self.api.on_batch_callback
+        self.api.on_frame_callback = on_frame
+        self.api.on_batch_callback = on_batch
+        self.api.rx_topics = None
+        try:
+            idle_since = monotonic_ns()
+            while True:
+                while pending:
+                    yield pending.popleft()
+                    idle_since = None
+                if idle_since is None:
+                    idle_since = monotonic_ns()
+                elif timeout is not None and monotonic_ns() - idle_since > timeout * 1e9:
+                    return
+                # Protocol layer only : decimated topics are not expired either
+                self.api.update()
+                if not pending:
+                    wait = MAX_WAIT
+                    if timeout is not None and idle_since is not None:
+                        wait = min(wait, timeout - (monotonic_ns() - idle_since) / 1e9)
+                    self._wait(wait)
+        finally:
+            self.api.on_frame_callback, self.api.on_batch_callback = previous
+            self._filter_topics()
+
+    def _publish_scheduled(self):
+        # Publishes due values, returns the next due time in ns
+        due = None
+        now = monotonic_ns()
+        for topic, entry in list(self.scheduled.items()):
+            if entry[0] <= now:
+                value = entry[2]() if callable(entry[2]) else entry[2]
+                self.publish(topic, value, entry[3])
+                entry[0] += entry[1]
+                if entry[0] <= now:
+                    # Late publishes are not caught up
+                    entry[0] = now + entry[1]
+            due = entry[0] if due is None else min(due, entry[0])
+        return due
+
+    def _wait(self, timeout):
+        # Blocks until the transport has bytes to read or timeout (in s) elapsed
+        if timeout <= 0:
+            return
+        transport = self.api.transport
+        try:
+            # Returns at once if bytes are waiting. readable() is not called,
+            # transports measure their queue there
+            select.select([transport.fileno()], [], [], timeout)
+            return
+        except (AttributeError, ValueError, OSError, IOError):
+            # No file descriptor to wait for (or not a selectable one)
+            pass
+        if transport.readable():
+            return
+        time.sleep(min(timeout, POLL_INTERVAL))
+
+    def _filter_topics(self, topic=None):
+        # Called whenever subscriptions change. Only the subscription of topic
+        # changed if given, None can change any route
+        if topic is None:
+            self.routes = OrderedDict()
+        else:
+            self.routes.pop(topic, None)
+
+        # Once topics are subscribed, without default or batch callback, latest
+        # values nor sinks, frames on other topics are not decoded. Without any
+        # subscription, frames are still decoded so that protocol stats reflect
+        # the link health
+        if self.callbacks and self.default_callback is None and self.batch_callback is None \
+                and getattr(self.api, 'latest', None) is None and not getattr(self.api, 'rx_sinks', None):
+            if topic is None or self.api.rx_topics is None:
+                self.api.rx_topics = set(t.encode('utf8') for t in self.callbacks)
+            elif topic in self.callbacks:
+                self.api.rx_topics.add(topic.encode('utf8'))
+            else:
+                self.api.rx_topics.discard(topic.encode('utf8'))
+        else:
+            self.api.rx_topics = None
+
+    def _on_batch(self, records, timestamp=None):
+        batch = []
+        for topic, payload in records:
+            route = self.routes.pop(topic, None)
+            if route is None:
+                route = self._route(topic)
+            self.routes[topic] = route
+            opts = route[3]
+            batch.append((route[2], payload, None if opts is None else dict(opts)))
+
+        if self.batch_timestamp:
+            self.batch_callback(batch, timestamp)
+        else:
+            self.batch_callback(batch)
+
+    def _on_frame(self, topic, payload, timestamp=None):
+        # Most recently used last
+        route = self.routes.pop(topic, None)
+        if route is None:
+            route = self._route(topic)
+        self.routes[topic] = route
+        cb, timestamped, topic, opts = route
+
+        # check callback is valid and call
+        if cb:
+            if opts is not None:
+                # Callbacks own their opts
+                opts = dict(opts)
+            if timestamped:
+                cb(topic, payload, opts, timestamp)
+            else:
+                cb(topic,payload, opts)
+
+    def _route(self, topic):
         cb = None
+        key = None
         # Search if topic has a registered callback
         if topic in self.callbacks:
+            key = topic
             cb = self.callbacks[topic]
         # else pick default callback
         else:
             cb = self.default_callback
 
         # Extract eventual indexing and grouping data from topic
-        topic, opts = translate(topic)
+        name, opts = self.translate(topic)
 
-        # check callback is valid and call
-        if cb:
-            cb(topic,payload, opts)
+        # Sized like the decode plans of the protocol
+        if len(self.routes) >= getattr(self.api, 'rx_plan_size', PLAN_CACHE_SIZE):
+            # Least recently used
+            self.routes.popitem(last=False)
+        return (cb, key in self.timestamped, name, opts)
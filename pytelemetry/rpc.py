@@ -0,0 +1,171 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import deque
+from concurrent.futures import Future
+from pytelemetry.telemetry.telemetry import monotonic_ns
+from pytelemetry.remoting import translate
+
+class RpcTimeout(Exception):
+    pass
+
+class Rpc:
+    """
+        Request/response helper built on top of Pytelemetry publish/subscribe.
+
+        Each request is tagged with a correlation id carried in the topic with
+        the usual indexing convention : publishing on `set_gain` sends the
+        frame on `set_gain:17`. The device is expected to answer on the reply
+        topic with the same index (`set_gain:17` or `ack:17`), which resolves
+        the Future returned by call(). Topics given to call() must not carry
+        an index of their own.
+
+        Requests do not wait for each other, so a whole configuration can be
+        sent in one burst and acknowledged within a single link round trip.
+
+        >>> rpc = Rpc(tlm)
+        >>> futures = [rpc.call('gain', g, 'float32', reply_topic='ack') for g in gains]
+        >>> rpc.wait(futures, timeout=1)
+    """
+    def __init__(self, tlm, id_range=65536, rtt_window=1024):
+        """
+            :param tlm: the Pytelemetry instance used to publish and subscribe
+            :param id_range: correlation ids are taken from [0, id_range)
+            :param rtt_window: amount of recent round trip times kept for
+            percentiles computation
+        """
+        self.tlm = tlm
+        self.id_range = id_range
+        self.next_id = 0
+        # (reply topic with index) -> [future, send time, deadline]
+        self.pending = dict()
+        self.rtts = deque(maxlen=rtt_window)
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.requests = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.rtts.clear()
+
+    def stats(self):
+        """
+Returns request counters along with round trip time percentiles in ns,
+computed over the most recent replies.
+        """
+        rtts = sorted(self.rtts)
+        return {
+            "requests" : self.requests,
+            "replies" : self.replies,
+            "timeouts" : self.timeouts,
+            "in_flight" : len(self.pending),
+            "rtt_p50" : _percentile(rtts, 50),
+            "rtt_p90" : _percentile(rtts, 90),
+            "rtt_p99" : _percentile(rtts, 99),
+            "rtt_max" : rtts[-1] if rtts else None
+        }
+
+    def call(self, topic, data, datatype, reply_topic=None, timeout=None):
+        """
+Publishes a request on topic and returns a Future resolved with the payload of
+the matching reply. The reply is expected on reply_topic (topic by default)
+with the same correlation index. If timeout (in seconds) expires before the
+reply, the Future fails with RpcTimeout.
+        """
+        if reply_topic is None:
+            reply_topic = topic
+        for t in (topic, reply_topic):
+            if translate(t)[1] is not None:
+                raise ValueError("{0} already carries an index, the correlation id is added by call()".format(t))
+
+        index = self._allocate_id(reply_topic)
+        key = "%s:%d" % (reply_topic, index)
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.tlm.subscribe(key, self._on_reply, timestamp=True)
+
+        now = monotonic_ns()
+        deadline = None if timeout is None else now + int(timeout * 1e9)
+        self.pending[key] = [future, now, deadline]
+        try:
+            self.tlm.publish("%s:%d" % (topic, index), data, datatype)
+        except Exception:
+            # No reply will ever come
+            self._release(key)
+            raise
+        self.requests += 1
+
+        return future
+
+    def poll(self):
+        """
+Processes received replies and expires requests whose timeout elapsed.
+        """
+        self.tlm.update()
+
+        now = monotonic_ns()
+        for key, (future, sent, deadline) in list(self.pending.items()):
+            if deadline is not None and now > deadline:
+                self._release(key)
+                self.timeouts += 1
+                future.set_exception(RpcTimeout("No reply received on %s" % key))
+
+    def wait(self, futures=None, timeout=None):
+        """
+Drives the Pytelemetry instance until all futures (all pending requests by
+default) are done or timeout (in seconds) expires.
+Returns True if all of them are done.
+        """
+        if futures is None:
+            futures = [entry[0] for entry in self.pending.values()]
+
+        from pytelemetry.pytelemetry import MAX_WAIT
+        deadline = None if timeout is None else monotonic_ns() + int(timeout * 1e9)
+        while True:
+            self.poll()
+            if all(f.done() for f in futures):
+                return True
+            now = monotonic_ns()
+            if deadline is not None and now > deadline:
+                return False
+
+            # Sleeps until replies arrive or a request expires, like run()
+            due = deadline
+            for future, sent, expiry in self.pending.values():
+                if expiry is not None:
+                    due = expiry if due is None else min(due, expiry)
+            wait = MAX_WAIT
+            if due is not None:
+                wait = min(wait, (due - now) / 1e9)
+            self.tlm._wait(wait)
+
+    def _allocate_id(self, reply_topic):
+        # Skip ids that are still waiting for a reply on that topic
+        for _ in range(self.id_range):
+            index = self.next_id
+            self.next_id = (self.next_id + 1) % self.id_range
+            if "%s:%d" % (reply_topic, index) not in self.pending:
+                return index
+        raise RuntimeError("All {0} correlation ids of {1} are in flight"
+                           .format(self.id_range, reply_topic))
+
+    def _release(self, key):
+        self.tlm.unsubscribe(key)
+        return self.pending.pop(key)
+
+    def _on_reply(self, topic, data, opts, timestamp):
+        key = "%s:%d" % (topic, opts['index'])
+        if not key in self.pending:
+            return
+        future, sent, deadline = self._release(key)
+        self.replies += 1
+        if timestamp is not None:
+            self.rtts.append(timestamp - sent)
+        future.set_result(data)
+
+def _percentile(ordered, p):
+    # Nearest-rank percentile of an already sorted sequence
+    if not ordered:
+        return None
+    rank = max(int(-(-p * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
@@ -0,0 +1,281 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+"""
+    Fan-out of decoded records to local processes through shared memory
+    (Python 3.8+).
+
+    The process owning the link decodes frames once and writes the records
+    into a shared memory ring, read by any amount of other processes at
+    their own pace :
+
+    >>> ring = SharedMemoryPublisher('telemetry', size=1 << 20)
+    >>> tlm.add_sink(ring)
+
+    >>> reader = SharedMemoryReader('telemetry')
+    >>> for sequence, timestamp, topic, value in reader.read():
+    >>>     ...
+
+    Layout of the shared memory :
+        [header][topic directory][ring of records]
+    The header holds the MAGIC string, the sizes of the directory and ring,
+    the amount of topics in the directory, the total amount of bytes
+    reserved by the record being written, and the total amount of bytes and
+    records written so far. Directory entries are [length as uint8][topic].
+    Records are [sequence as uint64][timestamp in ns as int64, -1 if unknown]
+    [topic index as uint16][datatype code as uint8][padding][payload size as
+    uint32][payload], the payload being kept as sent on the wire. A record
+    that does not fit before the end of the ring is preceded by a padding
+    record up to the end.
+
+    There is a single writer. Readers check the reserved position after
+    copying a record : when the writer went more than a whole ring ahead of
+    them, the record may have been overwritten, so they count an overrun and
+    resume from the newest record.
+"""
+from struct import pack_into, unpack_from, calcsize, error as StructError
+from multiprocessing import shared_memory
+
+from pytelemetry.telemetry.telemetry import Telemetry
+
+MAGIC = b'PTLMSHM1'
+
+# magic, directory entries, ring size, topics, reserved bytes, written bytes,
+# written records
+HEADER = "<8sIQIQQQ"
+HEADER_SIZE = 64
+TOPICS = calcsize("<8sIQ")
+RESERVED = calcsize("<8sIQI")
+WRITTEN = calcsize("<8sIQIQ")
+TOPIC_SIZE = 64
+RECORD = "<QqHBxI"
+RECORD_SIZE = calcsize(RECORD)
+# topic index of padding records
+PADDING = 0xffff
+
+# Names of the blocks created by publishers of this process
+_created = set()
+
+class SharedMemoryPublisher:
+    """
+        Writes records decoded by Telemetry to a shared memory ring.
+        Topics longer than 63 bytes (utf8) are truncated in the directory.
+    """
+    def __init__(self, name=None, size=1 << 20, max_topics=1024):
+        """
+            :param name: name of the shared memory block, chosen by the system
+            if None (see self.name)
+            :param size: size in bytes of the ring of records
+            :param max_topics: size of the topic directory. Records of topics
+            that do not fit in it are dropped
+        """
+        self.size = size
+        self.max_topics = min(max_topics, PADDING)
+        self.ring = HEADER_SIZE + self.max_topics * TOPIC_SIZE
+        self.shm = shared_memory.SharedMemory(name, create=True, size=self.ring + size)
+        self.name = self.shm.name
+        _created.add(self.shm._name)
+        self.buffer = self.shm.buf
+        self.codes = Telemetry(None, None).types
+
+        self.topics = dict()
+        self.written = 0
+        self.sequence = 0
+        pack_into(HEADER, self.buffer, 0, MAGIC, self.max_topics, size, 0, 0, 0, 0)
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.dropped_records = 0
+
+    def stats(self):
+        return {
+            "topics" : len(self.topics),
+            "written_bytes" : self.written,
+            "written_records" : self.sequence,
+            "dropped_records" : self.dropped_records
+        }
+
+    def write(self, topic, datatype, payload, timestamp):
+        index = self.topics.get(topic)
+        if index is None:
+            index = self._add_topic(topic)
+            if index is None:
+                self.dropped_records += 1
+                return
+
+        length = RECORD_SIZE + len(payload)
+        if length > self.size:
+            self.dropped_records += 1
+            return
+
+        offset = self.written % self.size
+        padding = self.size - offset if offset + length > self.size else 0
+        # Readers of the bytes about to be overwritten will know
+        pack_into("<Q", self.buffer, RESERVED, self.written + padding + length)
+
+        if padding:
+            # Record does not fit before the end of the ring
+            if padding >= RECORD_SIZE:
+                pack_into(RECORD, self.buffer, self.ring + offset, 0, -1, PADDING, 0, padding - RECORD_SIZE)
+            self.written += padding
+            offset = 0
+
+        self.sequence += 1
+        position = self.ring + offset
+        pack_into(RECORD, self.buffer, position, self.sequence,
+                  -1 if timestamp is None else timestamp,
+                  index, self.codes[datatype], len(payload))
+        self.buffer[position + RECORD_SIZE:position + length] = payload
+        self.written += length
+        # Readers only see the record once written
+        pack_into("<QQ", self.buffer, WRITTEN, self.written, self.sequence)
+
+    def close(self):
+        self.buffer = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+        _created.discard(self.shm._name)
+
+    def _add_topic(self, topic):
+        index = len(self.topics)
+        if index >= self.max_topics:
+            return None
+        encoded = topic.encode('utf8')[:TOPIC_SIZE - 1]
+        position = HEADER_SIZE + index * TOPIC_SIZE
+        self.buffer[position] = len(encoded)
+        self.buffer[position + 1:position + 1 + len(encoded)] = encoded
+        self.topics[topic] = index
+        pack_into("<I", self.buffer, TOPICS, index + 1)
+        return index
+
+class SharedMemoryReader:
+    """
+        Follows the ring of a SharedMemoryPublisher, possibly from another
+        process. Reading starts from the newest record.
+    """
+    def __init__(self, name):
+        self.shm = _attach(name)
+        self.buffer = self.shm.buf
+        magic, self.max_topics, self.size, topics, reserved, written, sequence = unpack_from(HEADER, self.buffer)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("{0} is not a telemetry shared memory".format(name))
+        self.ring = HEADER_SIZE + self.max_topics * TOPIC_SIZE
+        self.topic_names = []
+
+        # Payloads are decoded with the tables of the protocol
+        self.decoder = Telemetry(None, None)
+        self.position = written
+        self.sequence = sequence
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.overruns = 0
+        self.lost_records = 0
+        self.corrupted_records = 0
+
+    def stats(self):
+        return {
+            "overruns" : self.overruns,
+            "lost_records" : self.lost_records,
+            "corrupted_records" : self.corrupted_records
+        }
+
+    def topics(self):
+        """
+Returns the topics written so far, in order of first appearance.
+        """
+        count, = unpack_from("<I", self.buffer, TOPICS)
+        for index in range(len(self.topic_names), count):
+            position = HEADER_SIZE + index * TOPIC_SIZE
+            length = self.buffer[position]
+            self.topic_names.append(bytes(self.buffer[position + 1:position + 1 + length]).decode('utf8', 'replace'))
+        return list(self.topic_names)
+
+    def read(self, max_records=None):
+        """
+Returns the (sequence, timestamp, topic, value) records written since the last
+call, up to max_records. timestamp is None if unknown.
+        """
+        records = []
+        while max_records is None or len(records) < max_records:
+            reserved, written, sequence = unpack_from("<QQQ", self.buffer, RESERVED)
+            if self.position >= written:
+                break
+            if reserved - self.position > self.size:
+                self._overrun()
+                continue
+
+            offset = self.position % self.size
+            if self.size - offset < RECORD_SIZE:
+                self.position += self.size - offset
+                continue
+            position = self.ring + offset
+            number, timestamp, index, code, length = unpack_from(RECORD, self.buffer, position)
+            payload = bytes(self.buffer[position + RECORD_SIZE:position + RECORD_SIZE + length])
+
+            # The writer may have overwritten the record while it was copied
+            reserved, = unpack_from("<Q", self.buffer, RESERVED)
+            if reserved - self.position > self.size:
+                self._overrun()
+                continue
+            if index == PADDING:
+                self.position += RECORD_SIZE + length
+                continue
+
+            self.position += RECORD_SIZE + length
+            self.sequence = number
+            if index >= len(self.topic_names):
+                self.topics()
+            try:
+                value = self._decode(code, payload)
+            except (ValueError, StructError):
+                # Unknown datatype (newer writer) or payload not matching it
+                self.corrupted_records += 1
+                continue
+            records.append((number,
+                            None if timestamp < 0 else timestamp,
+                            self.topic_names[index],
+                            value))
+        return records
+
+    def close(self):
+        self.buffer = None
+        self.shm.close()
+
+    def _overrun(self):
+        # Resume from the newest record
+        written, sequence = unpack_from("<QQ", self.buffer, WRITTEN)
+        self.overruns += 1
+        self.lost_records += sequence - self.sequence
+        self.position = written
+        self.sequence = sequence
+
+    def _decode(self, code, payload):
+        datatype = self.decoder.rtypes.get(code)
+        if datatype is None:
+            raise ValueError("unknown datatype code {0}".format(code))
+        if datatype == 'string':
+            return payload.decode('utf8', 'replace')
+        if datatype in self.decoder.array_formats:
+            value = self.decoder._unpack_array(datatype, payload)
+            if value is None:
+                raise ValueError("{0} bytes for {1}".format(len(payload), datatype))
+            return value
+        return unpack_from("<" + self.decoder.formats[datatype], payload)[0]
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # Python < 3.13 : attached blocks are tracked as if created by this process,
+    # and would be unlinked when it exits. Blocks created by a publisher of this
+    # process must stay tracked
+    from multiprocessing import resource_tracker
+    shm = shared_memory.SharedMemory(name)
+    if shm._name not in _created:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
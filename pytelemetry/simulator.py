@@ -0,0 +1,261 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+"""
+    Embedded device simulator on a pseudo-terminal (Linux, macOS).
+
+    The simulator opens a pty pair and speaks the telemetry protocol on the
+    master side from a background thread, while the host connects to the
+    slave device like to any serial port :
+
+    >>> device = DeviceSimulator([SimulatedTopic('adc', 'uint16', 1000)])
+    >>> device.start()
+    >>> transport = SerialTransport()
+    >>> transport.connect({'port': device.port, 'baudrate': 115200})
+    >>> tlm = Pytelemetry(transport)
+    >>> ...
+    >>> device.stop()
+"""
+from collections import namedtuple
+from array import array
+from logging import getLogger
+from threading import Thread, Event
+import errno
+import fcntl
+import math
+import os
+import random
+import select
+import six
+import tty
+
+from pytelemetry.remoting import translate
+from pytelemetry.telemetry.telemetry import Telemetry, monotonic_ns
+
+# A topic published periodically by the simulator, at rate frames per second.
+# For array datatypes, size is the amount of items per frame
+SimulatedTopic = namedtuple('SimulatedTopic', ['topic', 'datatype', 'rate', 'size'])
+SimulatedTopic.__new__.__defaults__ = (1,)
+
+# Datatypes used to send back received values
+_echo_array_types = {'f': 'float32_array', 'B': 'uint8_array', 'H': 'uint16_array',
+                     'I': 'uint32_array', 'b': 'int8_array', 'h': 'int16_array',
+                     'i': 'int32_array'}
+
+class _PtyTransport:
+    # Non blocking writes on the master side : like a device UART, bytes that
+    # do not fit in the kernel buffer are lost
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def read(self, maxbytes=1):
+        return []
+
+    def readable(self):
+        return 0
+
+    def write(self, data):
+        self.simulator._write(data)
+
+    def writeable(self):
+        return True
+
+class DeviceSimulator:
+    """
+        Simulated device publishing a mix of topics and answering publishes.
+
+        Each topic is published at its own rate. On top of that, every
+        burst_interval seconds, burst_size frames are sent back to back.
+        Sent frames are corrupted (one bit flipped) with probability
+        corruption.
+
+        Frames received from the host are answered according to reply :
+            * 'echo' : the value is published back on the same topic
+            * 'ack'  : 1 is published on ack_topic, with the index of the
+              received topic ('set_gain:3' is acknowledged on 'ack:3')
+            * None   : nothing is sent back
+    """
+    def __init__(self, topics=(), reply='echo', ack_topic='ack', corruption=0.,
+                 burst_size=0, burst_interval=1., seed=None):
+        self.topics = list(topics)
+        self.reply = reply
+        self.ack_topic = ack_topic
+        self.corruption = corruption
+        self.burst_size = burst_size
+        self.burst_interval = burst_interval
+        self.random = random.Random(seed)
+        self.log = getLogger('telemetry.simulator')
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        flags = fcntl.fcntl(self.master, fcntl.F_GETFL)
+        fcntl.fcntl(self.master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.port = os.ttyname(self.slave)
+
+        self.api = Telemetry(_PtyTransport(self), self._on_frame)
+        self.thread = None
+        self.stopped = Event()
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.dropped_bytes = 0
+        self.corrupted_frames = 0
+        self.received_frames = 0
+        self.replies = 0
+        self.errors = 0
+
+    def stats(self):
+        return {
+            "sent_frames" : self.sent_frames,
+            "sent_bytes" : self.sent_bytes,
+            "dropped_bytes" : self.dropped_bytes,
+            "corrupted_frames" : self.corrupted_frames,
+            "received_frames" : self.received_frames,
+            "replies" : self.replies,
+            "errors" : self.errors
+        }
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = Thread(target=self._run, name='DeviceSimulator')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def value(self, topic, count):
+        """
+Returns the value of the count-th frame of a topic : a ramp for integers, a
+sine for floats, the counter for strings. Override it for other signals.
+        """
+        datatype = topic.datatype.replace('_array', '')
+        if datatype == 'float32':
+            sample = lambda i: math.sin(2 * math.pi * i / 100.)
+        elif datatype == 'string':
+            return "%s %d" % (topic.topic, count)
+        else:
+            size = self.api.sizes[datatype] * 8
+            sample = lambda i: i % (1 << (size - 1))
+        if topic.datatype.endswith('_array'):
+            return [sample(count * topic.size + i) for i in range(topic.size)]
+        return sample(count)
+
+    def _run(self):
+        start = monotonic_ns()
+        # next due time and amount of sent frames, per topic
+        due = [start] * len(self.topics)
+        counts = [0] * len(self.topics)
+        next_burst = start + int(self.burst_interval * 1e9) if self.burst_size else None
+
+        while not self.stopped.is_set():
+            now = monotonic_ns()
+            for i, topic in enumerate(self.topics):
+                period = int(1e9 / topic.rate)
+                if now - due[i] > 1000000000:
+                    # Too late to catch up, skip frames (like a busy device would)
+                    due[i] = now
+                while due[i] <= now:
+                    self._publish(topic, counts[i])
+                    counts[i] += 1
+                    due[i] += period
+
+            if next_burst is not None and next_burst <= now:
+                for j in range(self.burst_size):
+                    i = j % len(self.topics)
+                    self._publish(self.topics[i], counts[i])
+                    counts[i] += 1
+                next_burst = now + int(self.burst_interval * 1e9)
+
+            wake = min(due) if due else now + 10000000
+            if next_burst is not None:
+                wake = min(wake, next_burst)
+            timeout = min(max(wake - monotonic_ns(), 0) / 1e9, 0.01)
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                self._receive()
+
+    def _publish(self, topic, count):
+        try:
+            self.api.publish(topic.topic, self.value(topic, count), topic.datatype)
+        except Exception as e:
+            self.log.error("Could not publish {0} : {1}".format(topic.topic, e))
+            self.errors += 1
+
+    def _receive(self):
+        try:
+            data = os.read(self.master, 4096)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return
+        self.api.delimiter.decode(data)
+
+    def _write(self, frame):
+        frame = bytearray(frame)
+        if self.corruption and self.random.random() < self.corruption and len(frame) > 2:
+            # Flip one bit of a byte between the delimiters
+            i = self.random.randrange(1, len(frame) - 1)
+            frame[i] ^= 1 << self.random.randrange(8)
+            self.corrupted_frames += 1
+
+        try:
+            written = os.write(self.master, frame)
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            written = 0
+        self.sent_frames += 1
+        self.sent_bytes += written
+        self.dropped_bytes += len(frame) - written
+
+    def _on_frame(self, topic, data, timestamp=None):
+        self.received_frames += 1
+        try:
+            self._reply(topic, data)
+        except Exception as e:
+            # Called from the simulator thread, which must keep running
+            self.log.error("Could not reply to {0} : {1}".format(topic, e))
+            self.errors += 1
+
+    def _reply(self, topic, data):
+        if self.reply == 'echo':
+            datatype = _datatype(data)
+            if datatype is None:
+                return
+            self.api.publish(topic, data, datatype)
+            self.replies += 1
+        elif self.reply == 'ack':
+            name, opts = translate(topic)
+            ack = self.ack_topic if opts is None else "%s:%d" % (self.ack_topic, opts['index'])
+            self.api.publish(ack, 1, 'uint8')
+            self.replies += 1
+
+def _datatype(data):
+    # Datatype able to send data back without loss
+    if isinstance(data, six.string_types):
+        return 'string'
+    if isinstance(data, array):
+        return _echo_array_types.get(data.typecode)
+    if isinstance(data, float):
+        return 'float32'
+    if isinstance(data, six.integer_types):
+        return 'int32' if data < 0x80000000 else 'uint32'
+    return None
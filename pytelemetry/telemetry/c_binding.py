@@ -1,7 +1,9 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 from ctypes import *
 import os
+import sys
 import six
+from .telemetry import monotonic_ns
 
 # Function definitions for C api
 buffer_operation_func_t = CFUNCTYPE(c_int32, POINTER(c_uint8), c_uint32)
@@ -26,6 +28,30 @@ class TM_msg(Structure):
 
 on_frame_callback_t = CFUNCTYPE(None,POINTER(TM_state),POINTER(TM_msg))
 
+def library_names(name):
+    """
+Returns the file names the shared library name may have on this platform :
+name.dll on Windows, libname.dylib or name.dylib on macOS, libname.so or
+name.so elsewhere.
+    """
+    if sys.platform.startswith('win') or sys.platform == 'cygwin':
+        return [name + '.dll']
+    extension = '.dylib' if sys.platform == 'darwin' else '.so'
+    return ['lib' + name + extension, name + extension]
+
+def load_library(name):
+    """
+Loads the shared library name from the directory of this module. Raises OSError
+if none of its platform file names exists there.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    names = library_names(name)
+    for filename in names:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return CDLL(path)
+    raise OSError("{0} not found in {1}".format(' or '.join(names), directory))
+
 class TelemetryCBinding:
     """
 C API Abstraction over the C binding protocol implementation
@@ -33,14 +59,15 @@ C API Abstraction over the C binding protocol implementation
     def __init__(self, transport, on_frame_callback):
         self.transport = transport
         self.on_frame_callback = on_frame_callback
+        # Time (ns) at which the last chunk was read from the transport
+        self.rx_timestamp = None
+        # Container frames are not supported by the C API
+        self.on_batch_callback = None
+        self.resetStats()
 
-        lib_path = os.path.join(os.path.dirname(os.path.dirname(__file__)),'telemetry','telemetry.dll')
-        lib_crc16 = os.path.join(os.path.dirname(os.path.dirname(__file__)),'telemetry','crc16.dll')
-        lib_framing = os.path.join(os.path.dirname(os.path.dirname(__file__)),'telemetry','framing.dll')
-
-        self.crc16 = CDLL(lib_crc16)
-        self.framing = CDLL(lib_framing)
-        self.api = CDLL(lib_path)
+        self.crc16 = load_library('crc16')
+        self.framing = load_library('framing')
+        self.api = load_library('telemetry')
 
         # Interface types definition
         self.api.init_telemetry.argtypes = [POINTER(TM_state),POINTER(TM_transport)]
@@ -79,6 +106,16 @@ C API Abstraction over the C binding protocol implementation
         self.api.init_telemetry(byref(self.u),byref(self.t))
         self.api.subscribe(self.__on_frame)
 
+    def resetStats(self):
+        self.rx_decoded_frames = 0
+
+    def stats(self):
+        # The C library does not expose its counters, decoded frames are
+        # counted on this side
+        return {
+            "rx_decoded_frames" : self.rx_decoded_frames
+        }
+
     def update(self):
         self.api.update_telemetry(0)
 
@@ -112,6 +149,8 @@ C API Abstraction over the C binding protocol implementation
             self.api.publish_i32(topic_bytes, data)
         elif datatype == 'float32':
             self.api.publish_f32(topic_bytes, data)
+        else:
+            raise IndexError("Provided datatype {0} not supported by the C API for ({1}, {2})".format(datatype, topic, data))
 
     def __get_on_frame_cb(self):
         def on_frame(state,msg):
@@ -186,13 +225,15 @@ C API Abstraction over the C binding protocol implementation
                 # Store decoded data
                 payload = cbuf.value
 
-            self.on_frame_callback(topic,payload)
+            self.rx_decoded_frames += 1
+            self.on_frame_callback(topic,payload,self.rx_timestamp)
         return on_frame_callback_t(on_frame)
 
     def __get_read_cb(self):
         def read(uint8_ptr, data_size):
             # Read the data
             data = self.transport.read(maxbytes=data_size)
+            self.rx_timestamp = monotonic_ns()
 
             if data is None:
                 return 0
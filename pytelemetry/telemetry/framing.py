@@ -3,10 +3,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # For conditions of distribution and use, see copyright notice in the LICENSE file
 
 from enum import Enum
-try:
-    from queue import Queue  # Python 3
-except ImportError:
-    from Queue import Queue  # Python 2
+import re
 
 class RX_STATE(Enum):
     IDLE = 0
@@ -16,17 +13,37 @@ class ESC_STATE(Enum):
     IDLE = 0
     NEXT = 1
 
+# Default maximum size of an unstuffed frame
+MAX_FRAME_LENGTH = 65536
+# Initial size of the reception buffer, doubled as longer frames arrive
+INITIAL_BUFFER_SIZE = 256
+
 class Delimiter():
-    def __init__(self,on_frame_decoded_callback):
+    """
+    Byte stuffing and frame delimitation.
+
+    Received bytes are unstuffed into a single buffer reused for every frame,
+    grown in place up to max_frame_length as longer frames arrive. Each complete
+    frame is given to the callback as an immutable bytes copy that the callback
+    owns and may keep. Frames growing beyond max_frame_length are aborted and
+    counted in rx_oversized_frames.
+    """
+    def __init__(self,on_frame_decoded_callback, max_frame_length=MAX_FRAME_LENGTH):
         self.rx_state = RX_STATE.IDLE;
         self.escape_state = ESC_STATE.IDLE;
         self.SOF = 0xf7
         self.EOF = 0x7f
         self.ESC = 0x7d
+        # Bytes that need to be escaped, and pattern prefixing them with ESC
+        self.special_bytes = bytes(bytearray([self.SOF, self.EOF, self.ESC]))
+        self.special_pattern = re.compile(b'([' + re.escape(self.special_bytes) + b'])')
+        self.escaped_pattern = bytes(bytearray([self.ESC])) + b'\\1'
 
-        self.payload = bytearray()
-        # Max amount of payloads
+        # Reception buffer, framesize is the amount of bytes of the current frame
+        self.set_max_frame_length(max_frame_length)
         self.framesize = 0;
+        # Estimated arrival time (ns) of the EOF of the last decoded frame
+        self.frame_timestamp = None
         # new frame callback
         self.on_frame_decoded_callback = on_frame_decoded_callback
 
@@ -38,6 +55,7 @@ class Delimiter():
         self.escaped_rx_bytes = 0 # Total amount of escaping characters inside received frames
         self.complete_rx_frames = 0 # Total amount of correctly delimited frames
         self.uncomplete_rx_frames = 0 # Total amount of badly delimited frames (frames that started by SOF but did not finish with EOF)
+        self.oversized_rx_frames = 0 # Total amount of frames aborted for exceeding max_frame_length
 
         self.processed_tx_bytes = 0 # Total amount of processed TX bytes
         self.encoded_tx_frames = 0 # Total amount of encoded frames
@@ -50,12 +68,35 @@ class Delimiter():
             "rx_escaped_bytes"     : self.escaped_rx_bytes,
             "rx_complete_frames"   : self.complete_rx_frames,
             "rx_uncomplete_frames" : self.uncomplete_rx_frames,
+            "rx_oversized_frames"  : self.oversized_rx_frames,
             "tx_processed_bytes"   : self.processed_tx_bytes,
             "tx_encoded_frames"    : self.encoded_tx_frames,
-            "tx_escaped_bytes"     : self.escaped_tx_bytes
+            "tx_escaped_bytes"     : self.escaped_tx_bytes,
+            # SOF and EOF, aborted frames only count their SOF
+            "rx_delimiter_bytes"   : 2 * self.complete_rx_frames + self.uncomplete_rx_frames + self.oversized_rx_frames,
+            "tx_delimiter_bytes"   : 2 * self.encoded_tx_frames
         }
 
-    def decode(self, data):
+    def set_max_frame_length(self, max_frame_length):
+        """
+Sets the maximum size of a received frame (after unstuffing) and allocates the
+reception buffer, which then grows on demand up to that size. A frame in process
+is dropped.
+        """
+        self.max_frame_length = max_frame_length
+        self.payload = bytearray(min(INITIAL_BUFFER_SIZE, max_frame_length))
+        self.framesize = 0
+        self.rx_state = RX_STATE.IDLE
+
+    def decode(self, data, timestamp=None, byte_time=0):
+        """
+Decodes a chunk of received bytes.
+
+timestamp is the time (ns) at which the chunk was read from the transport and
+byte_time the duration (ns) of one byte on the wire. When provided, the arrival
+time of each frame EOF is interpolated from its offset inside the chunk and
+exposed in frame_timestamp while the frame callback runs.
+        """
         # Ensure data is iterable for both Python 2 and 3
         if isinstance(data, (bytes, bytearray)):
             # It's already iterable, no need to wrap it
@@ -66,8 +107,10 @@ class Delimiter():
         else:
             # Single integer value
             char_iter = bytearray([data])
-            
-        for c in char_iter:
+
+        last = len(char_iter) - 1
+
+        for offset, c in enumerate(char_iter):
             # In Python 2, bytes (str) elements are strings, so we need to get the ordinal value
             if isinstance(c, str):
                 c = ord(c)
@@ -80,8 +123,7 @@ class Delimiter():
                     # New frame started
                     self.rx_state = RX_STATE.IN_PROCESS
                     self.escape_state = ESC_STATE.IDLE
-                    self.framesize = 0
-                    self.payload = bytearray()  # Reset payload for new frame
+                    self.framesize = 0  # Reset payload for new frame
                 else:
                     self.discarded_rx_bytes += 1
 
@@ -89,21 +131,28 @@ class Delimiter():
             else:
                 # escaping
                 if self.escape_state == ESC_STATE.NEXT:
-                    self.payload.append(c)
                     self.escape_state = ESC_STATE.IDLE
+                    if self.framesize == len(self.payload):
+                        if self.framesize >= self.max_frame_length:
+                            self._abort_oversized()
+                            continue
+                        self._grow()
+                    self.payload[self.framesize] = c
                     self.framesize += 1;
 
                 elif self.escape_state == ESC_STATE.IDLE:
                     if c == self.EOF:
-                        # Send frame to callback function
-                        self.on_frame_decoded_callback(self.payload)
-                        self.payload = bytearray()
+                        if timestamp is None:
+                            self.frame_timestamp = None
+                        else:
+                            # bytes after EOF in the chunk arrived later
+                            self.frame_timestamp = timestamp - (last - offset) * byte_time
+                        # Send a copy of the frame to callback function, buffer is reused
                         self.rx_state = RX_STATE.IDLE
                         self.complete_rx_frames += 1
+                        self.on_frame_decoded_callback(memoryview(self.payload)[:self.framesize].tobytes())
 
                     elif c == self.SOF:
-                        self.payload = bytearray()
-                        self.rx_state = RX_STATE.IDLE
                         self.rx_state = RX_STATE.IN_PROCESS
                         self.framesize = 0
                         self.uncomplete_rx_frames += 1
@@ -115,22 +164,53 @@ class Delimiter():
 
                     # pure data
                     else:
-                        self.payload.append(c)
+                        if self.framesize == len(self.payload):
+                            if self.framesize >= self.max_frame_length:
+                                self._abort_oversized()
+                                continue
+                            self._grow()
+                        self.payload[self.framesize] = c
                         self.framesize += 1;
 
+    def _grow(self):
+        # Doubles the buffer in place, up to max_frame_length
+        size = len(self.payload)
+        self.payload.extend(bytearray(min(max(2 * size, 1), self.max_frame_length) - size))
+
+    def _abort_oversized(self):
+        # Drop the frame, following bytes are discarded until next SOF
+        self.rx_state = RX_STATE.IDLE
+        self.framesize = 0
+        self.oversized_rx_frames += 1
+
     def encode(self, rxpayload):
-        frame = bytearray()
-        frame.append(self.SOF)
+        frame = self.stuff(rxpayload)
+        self.count_encoded(len(rxpayload), len(frame))
+        return frame
 
-        self.encoded_tx_frames += 1
+    def stuff(self, rxpayload):
+        """
+Returns the delimited and escaped frame of rxpayload, without counting it.
+        """
+        if not isinstance(rxpayload, (bytes, bytearray)):
+            rxpayload = bytearray(rxpayload)
 
-        for c in rxpayload:
-            self.processed_tx_bytes += 1
-            if c == self.SOF or c == self.EOF or c == self.ESC:
-                frame.append(self.ESC)
-                self.escaped_tx_bytes += 1
-            frame.append(c)
+        # Count special bytes at C speed, by deleting them
+        escaped = len(rxpayload) - len(rxpayload.translate(None, self.special_bytes))
 
+        frame = bytearray()
+        frame.append(self.SOF)
+        if escaped:
+            frame.extend(self.special_pattern.sub(self.escaped_pattern, rxpayload))
+        else:
+            frame.extend(rxpayload)
         frame.append(self.EOF)
-
         return frame
+
+    def count_encoded(self, payload_size, frame_size):
+        """
+Counts a frame returned by stuff(), once it is actually sent.
+        """
+        self.encoded_tx_frames += 1
+        self.processed_tx_bytes += payload_size
+        self.escaped_tx_bytes += frame_size - payload_size - 2
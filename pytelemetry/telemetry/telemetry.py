@@ -4,10 +4,25 @@ from __future__ import division, print_function
 from .crc import crc16
 from .framing import Delimiter
 from struct import pack, unpack, unpack_from, calcsize
-from logging import getLogger
+from logging import getLogger, INFO
+from collections import deque, namedtuple, OrderedDict
+from six.moves import intern
+from array import array
 import struct
+import sys
 import six
 
+try:
+    from time import monotonic_ns
+except ImportError:
+    # Python < 3.7
+    try:
+        from time import monotonic as _clock
+    except ImportError:
+        from time import time as _clock
+    def monotonic_ns():
+        return int(_clock() * 1e9)
+
 # For Python 2 compatibility when dealing with bytes/strings
 if six.PY3:
     from binascii import hexlify
@@ -18,6 +33,27 @@ else:
             return ''.join('{:02x}'.format(b) for b in data)
         return ''.join('{:02x}'.format(ord(c)) for c in data)
 
+# Header flag of frames carrying a short topic id instead of the topic string
+TOPIC_ID_FLAG = 0x8000
+# Headers of topic id negotiation frames. Payload : [topic][0][id as uint16]
+TOPIC_ID_ANNOUNCE = 0x0100
+TOPIC_ID_ACK = 0x0101
+TOPIC_ID_UNKNOWN = 0x0102
+# Ids are sent on 1 byte below 0x80, 2 bytes (big endian, MSB set) up to 0x7fff
+TOPIC_ID_MAX = 0x8000
+# Directions of recorded frames
+RX = 0
+TX = 1
+# Header of container frames. Payload : records of [size as uint16][header][topic][payload]
+CONTAINER = 0x0200
+
+# Default amount of decode plans (one per received header and topic) kept
+PLAN_CACHE_SIZE = 1024
+
+# Latest value of a topic : decoded value, datatype, frame arrival timestamp in
+# ns and sequence number of the frame among received ones
+Sample = namedtuple('Sample', ['value', 'datatype', 'timestamp', 'sequence'])
+
 class Telemetry:
     """
     Low level telemetry protocol (github.com/Overdrivr/Telemetry) implemented in python
@@ -25,7 +61,31 @@ class Telemetry:
     def __init__(self, transport, callback):
         self.transport = transport
         self.on_frame_callback = callback
+        # When set, records of container frames are given at once to this callback
+        self.on_batch_callback = None
+        # Objects with a record(direction, timestamp, frame) method, given all raw frames
+        self.recorders = []
+        # Objects with a write(topic, datatype, payload, timestamp) method, given
+        # the raw payload of all decoded records
+        self.rx_sinks = []
         self.delimiter = Delimiter(self._on_frame_detected)
+        # Held by the instance so that profiling can time it
+        self.crc16 = crc16
+        # Maximum amount of bytes requested from the transport per read
+        self.rx_chunk_size = 1
+        # When not None, raw topics (utf8 bytes) worth decoding. Frames on other
+        # topics are counted in rx_skipped_frames and dropped undecoded
+        self.rx_topics = None
+        # Header and topic bytes -> decode plan, least recently used first
+        self.rx_plans = OrderedDict()
+        self.rx_plan_size = PLAN_CACHE_SIZE
+        # When not None, topic -> Sample of the latest decoded value per topic
+        self.latest = None
+        # Copy of latest taken after each update() that changed it, never
+        # modified afterwards so that other threads can read it without lock
+        self.latest_snapshot = dict()
+        self.latest_sequence = 0
+        self.latest_changed = False
         self.types = {'float32' : 0,
                       'uint8'   : 1,
                       'uint16'  : 2,
@@ -33,7 +93,15 @@ class Telemetry:
                       'int8'    : 4,
                       'int16'   : 5,
                       'int32'   : 6,
-                      'string'  : 7}
+                      'string'  : 7,
+                      # Arrays of scalars, sent in one frame
+                      'float32_array' : 16,
+                      'uint8_array'   : 17,
+                      'uint16_array'  : 18,
+                      'uint32_array'  : 19,
+                      'int8_array'    : 20,
+                      'int16_array'   : 21,
+                      'int32_array'   : 22}
 
         self.sizes = {'float32' : 4,
                       'uint8'   : 1,
@@ -53,9 +121,44 @@ class Telemetry:
                         'int16'   : "h",
                         'int32'   : "l"}
 
+        # array module typecodes of array types (items are little endian on the wire)
+        self.array_formats = {'float32_array' : "f",
+                              'uint8_array'   : "B",
+                              'uint16_array'  : "H",
+                              'uint32_array'  : "I",
+                              'int8_array'    : "b",
+                              'int16_array'   : "h",
+                              'int32_array'   : "i"}
+
         self.log_rx = getLogger('telemetry.rx')
         self.log_tx = getLogger('telemetry.tx')
 
+        # Topic ids. Sent ids are only used once acknowledged by the peer
+        self.tx_topic_ids = None
+        self.tx_topic_names = dict()
+        self.tx_confirmed_topics = set()
+        self.tx_max_topic_ids = TOPIC_ID_MAX
+        # Ids announced by the peer
+        self.rx_topic_ids = dict()
+        # Unknown ids already reported to the peer, until it announces them
+        self.rx_reported_ids = set()
+
+        # Batching of published values into container frames
+        self.tx_mtu = None
+        self.tx_pending = []
+        self.tx_pending_size = 0
+
+        # When another thread owns the transmission, callable(function, args)
+        # running function in that thread
+        self.tx_executor = None
+        # When not None, sent frames are appended there instead of written
+        self.tx_buffer = None
+        # When not None, budget.LinkBudget limiting the bytes sent on the link
+        self.tx_budget = None
+        # When not None, called before a frame waits for the budget, to write
+        # the frames of tx_buffer
+        self.tx_before_wait = None
+
         self.resetStats()
 
     def resetStats(self):
@@ -65,7 +168,27 @@ class Telemetry:
         self.rx_corrupted_eol = 0
         self.rx_corrupted_topic = 0
         self.rx_corrupted_payload = 0
+        self.rx_unknown_topic_ids = 0
+        self.rx_control_frames = 0
+        self.rx_container_frames = 0
+        self.rx_skipped_frames = 0
+        self.rx_plan_misses = 0
         self.tx_encoded_frames = 0
+        self.tx_container_frames = 0
+        # Bytes of frames, before stuffing, per category. Received frames are
+        # only accounted once decoded
+        self.rx_header_bytes = 0
+        self.rx_topic_bytes = 0
+        self.rx_payload_bytes = 0
+        self.rx_crc_bytes = 0
+        self.rx_container_bytes = 0 # container headers and record sizes
+        self.rx_control_bytes = 0 # topic id negotiation, crc excluded
+        self.tx_header_bytes = 0
+        self.tx_topic_bytes = 0
+        self.tx_payload_bytes = 0
+        self.tx_crc_bytes = 0
+        self.tx_container_bytes = 0
+        self.tx_control_bytes = 0
 
     def stats(self):
         return {
@@ -75,30 +198,133 @@ class Telemetry:
             "rx_corrupted_eol" : self.rx_corrupted_eol,
             "rx_corrupted_topic" : self.rx_corrupted_topic,
             "rx_corrupted_payload" : self.rx_corrupted_payload,
-            "tx_encoded_frames" : self.tx_encoded_frames
+            "rx_unknown_topic_ids" : self.rx_unknown_topic_ids,
+            "rx_control_frames" : self.rx_control_frames,
+            "rx_container_frames" : self.rx_container_frames,
+            "rx_skipped_frames" : self.rx_skipped_frames,
+            "rx_plan_misses" : self.rx_plan_misses,
+            "tx_encoded_frames" : self.tx_encoded_frames,
+            "tx_container_frames" : self.tx_container_frames,
+            "rx_header_bytes" : self.rx_header_bytes,
+            "rx_topic_bytes" : self.rx_topic_bytes,
+            "rx_payload_bytes" : self.rx_payload_bytes,
+            "rx_crc_bytes" : self.rx_crc_bytes,
+            "rx_container_bytes" : self.rx_container_bytes,
+            "rx_control_bytes" : self.rx_control_bytes,
+            "tx_header_bytes" : self.tx_header_bytes,
+            "tx_topic_bytes" : self.tx_topic_bytes,
+            "tx_payload_bytes" : self.tx_payload_bytes,
+            "tx_crc_bytes" : self.tx_crc_bytes,
+            "tx_container_bytes" : self.tx_container_bytes,
+            "tx_control_bytes" : self.tx_control_bytes
         }
 
-    def _encode_frame(self, topic, data, datatype):
-        # Ensure topic is bytes for both Python 2 and 3
+    def enable_topic_ids(self, max_ids=TOPIC_ID_MAX):
+        """
+Replaces topic strings by short numeric ids on sent frames.
+Each new topic is announced to the peer along with its id. Frames keep the full
+topic string until the peer acknowledges the id, so peers that do not support
+topic ids keep receiving regular frames.
+        """
+        if self.tx_topic_ids is None:
+            self.tx_topic_ids = dict()
+        self.tx_max_topic_ids = min(max_ids, TOPIC_ID_MAX)
+
+    def enable_batching(self, mtu=256):
+        """
+Packs published values into container frames of at most mtu bytes (before byte
+stuffing) instead of sending one frame per value. Pending values are sent when
+the next one does not fit, on flush() and at the beginning of update().
+mtu=None disables batching.
+        """
+        self.flush()
+        self.tx_mtu = mtu
+
+    def flush(self):
+        """
+Sends values waiting to be packed in a container frame.
+        """
+        if not self.tx_pending:
+            return
+        if len(self.tx_pending) == 1:
+            # a lone value is cheaper as a regular frame
+            frame = self.tx_pending[0]
+        else:
+            frame = bytearray(pack("<H", CONTAINER))
+            for record in self.tx_pending:
+                frame.extend(pack("<H", len(record)))
+                frame.extend(record)
+        self.tx_pending = []
+        self.tx_pending_size = 0
+        self._send(self._seal(frame))
+
+    def announce_topic_ids(self):
+        """
+Announces again all ids not acknowledged yet by the peer.
+        """
+        for topic, tid in list((self.tx_topic_ids or {}).items()):
+            if not topic in self.tx_confirmed_topics:
+                self._send_topic_id_frame(TOPIC_ID_ANNOUNCE, topic, tid)
+
+    def _assign_topic_id(self, topic):
+        if topic in self.tx_topic_ids or len(self.tx_topic_ids) >= self.tx_max_topic_ids:
+            return
+        tid = len(self.tx_topic_ids)
+        self.tx_topic_ids[topic] = tid
+        self.tx_topic_names[tid] = topic
+        self._send_topic_id_frame(TOPIC_ID_ANNOUNCE, topic, tid)
+
+    def _send_topic_id_frame(self, header, topic, tid):
+        self._send(self._encode_topic_id_frame(header, topic, tid), control=True)
+
+    def _encode_topic_id_frame(self, header, topic, tid):
         if isinstance(topic, six.text_type):
             topic = topic.encode('utf8')
+        frame = bytearray(pack("<H%dsBH" % len(topic), header, topic, 0, tid))
+        return self._seal(frame)
+
+    def _encode_frame(self, topic, data, datatype):
+        return self._seal(self._encode_body(topic, data, datatype))
+
+    def _encode_body(self, topic, data, datatype):
+        # frame without crc
+        header = self.types[datatype]
+
+        if topic in self.tx_confirmed_topics:
+            # Replace topic by its id
+            header |= TOPIC_ID_FLAG
+            tid = self.tx_topic_ids[topic]
+            if tid < 0x80:
+                topic_field = pack("B", tid)
+            else:
+                topic_field = pack(">H", tid | 0x8000)
+        else:
+            # Ensure topic is bytes for both Python 2 and 3
+            if isinstance(topic, six.text_type):
+                topic = topic.encode('utf8')
+            topic_field = topic + b'\0'
 
         if datatype == "string":
             # Handle string data for both Python versions
             if isinstance(data, six.text_type):
                 data = data.encode("utf8")
             payload_fmt = "%ds" % len(data)
+        elif datatype in self.array_formats:
+            data = self._pack_array(datatype, data)
+            payload_fmt = "%ds" % len(data)
         else:
             payload_fmt = self.formats[datatype]
 
-        frame = pack("<H%dsB%s" % (len(topic), payload_fmt),
-                        self.types[datatype],
-                        topic, 0,
+        frame = pack("<H%ds%s" % (len(topic_field), payload_fmt),
+                        header,
+                        topic_field,
                         data)
-        frame = bytearray(frame)
 
+        return bytearray(frame)
+
+    def _seal(self, frame):
         # crc
-        _crc = crc16(frame)
+        _crc = self.crc16(frame)
         _crc = pack("<H", _crc)
         frame.extend(_crc)
 
@@ -108,16 +334,61 @@ class Telemetry:
             hex_frame = hex_frame.decode('ascii')
         self.log_tx.info(hex_frame)
 
-        self.tx_encoded_frames += 1
-
         return frame
 
+    def _pack_array(self, datatype, data):
+        typecode = self.array_formats[datatype]
+        if hasattr(data, 'astype'):
+            # NumPy array, converted to little endian in bulk. astype wraps
+            # integers silently, array.array raises OverflowError
+            if typecode != 'f' and data.size:
+                bits = 8 * calcsize(typecode)
+                if typecode.isupper():
+                    low, high = 0, 2 ** bits - 1
+                else:
+                    low, high = -2 ** (bits - 1), 2 ** (bits - 1) - 1
+                if data.min() < low or data.max() > high:
+                    raise OverflowError("{0} out of range [{1}, {2}]".format(datatype, low, high))
+            return data.astype('<' + typecode, copy=False).tobytes()
+        if not isinstance(data, array) or data.typecode != typecode:
+            data = array(typecode, data)
+        if sys.byteorder == 'big':
+            data = array(typecode, data)
+            data.byteswap()
+        if six.PY2:
+            return data.tostring()
+        return data.tobytes()
+
+    def _unpack_array(self, datatype, payload):
+        data = array(self.array_formats[datatype])
+        if len(payload) % data.itemsize:
+            return None
+        if six.PY2:
+            data.fromstring(bytes(payload))
+        else:
+            data.frombytes(payload)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        return data
+
     def _decode_frame(self, frame):
         if len(frame) < 2:
             return
+        if type(frame) is not bytes:
+            # Slices are used as keys of decode plans
+            frame = bytes(frame)
+
+        # Plain frames nobody listens to are dropped before checking the crc.
+        # Records of containers and frames with topic ids are filtered later
+        if self.rx_topics is not None and len(frame) > 4:
+            header, = unpack_from("<H", frame)
+            i = frame.find(b'\0', 2, len(frame) - 2)
+            if header in self.rtypes and i >= 0 and not bytes(frame[2:i]) in self.rx_topics:
+                self.rx_skipped_frames += 1
+                return
 
         # compute local crc
-        local_crc = crc16(frame[:-2])
+        local_crc = self.crc16(frame[:-2])
 
         # unpack frame crc
         try:
@@ -133,97 +404,298 @@ class Telemetry:
             hex_frame = hexlify(frame)
             if isinstance(hex_frame, six.binary_type):
                 hex_frame = hex_frame.decode('ascii')
-            self.log_rx.warn("CRC local {0} vs frame {1} for {2}"
+            self.log_rx.warning("CRC local {0} vs frame {1} for {2}"
                              .format(local_crc, frame_crc, hex_frame))
             self.rx_corrupted_crc += 1
             return
+        self.rx_crc_bytes += 2
 
-        # unpack header
-        try:
-            header, = unpack_from("<H", frame)
-        except struct.error as e:
-            hex_frame = hexlify(frame)
-            if isinstance(hex_frame, six.binary_type):
-                hex_frame = hex_frame.decode('ascii')
-            self.log_rx.error("Could not unpack header in frame {1} : {0}".format(e, hex_frame))
-            self.rx_corrupted_header += 1
-            return
+        # containers hold several records under a single crc
+        if len(frame) >= 4 and unpack_from("<H", frame)[0] == CONTAINER:
+            records = self._decode_container(frame)
+        else:
+            records = self._decode_body(frame, 0, len(frame) - 2)
 
-        if not header in self.rtypes:
-            hex_frame = hexlify(frame)
-            if isinstance(hex_frame, six.binary_type):
-                hex_frame = hex_frame.decode('ascii')
-            self.log_rx.warn("Header not found in frame {0}".format(hex_frame))
-            self.rx_corrupted_header += 1
+        if records is None:
             return
 
-        # locate EOL
-        try:
-            i = frame.index(0, 2, -2)
-        except:
+        if self.log_rx.isEnabledFor(INFO):
             hex_frame = hexlify(frame)
             if isinstance(hex_frame, six.binary_type):
                 hex_frame = hex_frame.decode('ascii')
-            self.log_rx.warn("topic EOL not found for {0}"
-                             .format(hex_frame))
-            self.rx_corrupted_eol += 1
-            return
+            self.log_rx.info(hex_frame)
 
-        # decode topic
-        try:
-            topic = frame[2:i].decode("utf8")
-        except UnicodeError as e:
-            self.log_rx.warning("Decoding error for topic. %s. Using 'replace' option." % e)
-            self.rx_corrupted_topic += 1
-            topic = frame[2:i].decode("utf8", errors='replace')
+        return records
 
-        # Find type from header
-        _type = self.rtypes[header]
-
-        # decode data
-        if _type == "string":
-            # start at i+1 to remove EOL zero
+    def _decode_container(self, frame):
+        self.rx_container_frames += 1
+        self.rx_container_bytes += 2
+        records = []
+        end = len(frame) - 2
+        begin = 2
+        while begin < end:
             try:
-                data = frame[i+1:-2].decode("utf8")
-            except UnicodeError:
-                data = frame[i+1:-2].decode("utf8", errors='replace')
+                size, = unpack_from("<H", frame, begin)
+            except struct.error:
+                size = end
+            begin += 2
+            self.rx_container_bytes += 2
+            if begin + size > end:
+                hex_frame = hexlify(frame)
+                if isinstance(hex_frame, six.binary_type):
+                    hex_frame = hex_frame.decode('ascii')
+                self.log_rx.warning("Record size {0} exceeds container {1}".format(size, hex_frame))
+                self.rx_corrupted_payload += 1
+                break
+            record = self._decode_body(frame, begin, begin + size)
+            if record is not None:
+                records.append(record)
+            begin += size
+        if not records:
+            # Nothing to give to the callbacks
+            return None
+        return records
+
+    def _decode_body(self, frame, begin, end):
+        # frame[begin:end] holds header, topic and payload. Decoding a known
+        # header and topic is a plan lookup and a payload unpack
+        if end - begin > 2 and frame[begin+1] & 0x80:
+            # topic id on 1 or 2 bytes
+            start = begin + 4 if frame[begin+2] & 0x80 else begin + 3
         else:
-            # Find format
-            fmt = self.formats[_type]
+            # payload starts after EOL zero
+            start = frame.find(b'\0', begin + 2, end) + 1
+        plan = None
+        if begin + 2 < start <= end:
+            key = frame[begin:start]
+            # Most recently used last (move_to_end is Python 3 only)
+            plan = self.rx_plans.pop(key, None)
+        if plan is None:
+            plan = self._plan(frame, begin, end)
+            if plan is None:
+                return
+        else:
+            self.rx_plans[key] = plan
+        topic, raw, _type, unpacker, expected_size = plan
+
+        if self.rx_topics is not None and not raw in self.rx_topics:
+            self.rx_skipped_frames += 1
+            return
+
+        # decode data
+        if unpacker is not None:
             # Check actual sizes matches the one expected by unpack
-            # (start at i+1 to remove EOL zero)
-            expected_size = self.sizes[_type]
-            actual_size = len(frame[i+1:-2])
+            actual_size = end - start
             if actual_size != expected_size:
                 hex_frame = hexlify(frame)
                 if isinstance(hex_frame, six.binary_type):
                     hex_frame = hex_frame.decode('ascii')
-                self.log_rx.warn("Payload size {0} not matching {1} for {2}"
+                self.log_rx.warning("Payload size {0} not matching {1} for {2}"
                         .format(actual_size,
                                 expected_size,
                                 hex_frame))
                 self.rx_corrupted_payload += 1
                 return
-
-            # Unpack payload
+            data, = unpacker.unpack_from(frame, start)
+        elif _type == "string":
             try:
-                data, = unpack_from("<%s" % fmt, frame, i+1)
-            except struct.error as e:
+                data = frame[start:end].decode("utf8")
+            except UnicodeError:
+                data = frame[start:end].decode("utf8", errors='replace')
+        else:
+            # Unpack all items at once
+            data = self._unpack_array(_type, frame[start:end])
+            if data is None:
                 hex_frame = hexlify(frame)
                 if isinstance(hex_frame, six.binary_type):
                     hex_frame = hex_frame.decode('ascii')
-                self.log_rx.error("Could not unpack payload in frame {0} : {1}".format(hex_frame, e))
+                self.log_rx.warning("Payload size {0} not a multiple of {1} items for {2}"
+                        .format(end - start,
+                                _type,
+                                hex_frame))
                 self.rx_corrupted_payload += 1
                 return
 
-        hex_frame = hexlify(frame)
-        if isinstance(hex_frame, six.binary_type):
-            hex_frame = hex_frame.decode('ascii')
-        self.log_rx.info(hex_frame)
         self.rx_decoded_frames += 1
+        self.rx_header_bytes += 2
+        self.rx_topic_bytes += start - begin - 2
+        self.rx_payload_bytes += end - start
+
+        for sink in self.rx_sinks:
+            sink.write(topic, _type, frame[start:end], self.delimiter.frame_timestamp)
+
+        if self.latest is not None:
+            self.latest_sequence += 1
+            self.latest[topic] = Sample(data, _type, self.delimiter.frame_timestamp, self.latest_sequence)
+            self.latest_changed = True
 
         return topic, data
 
+    def _plan(self, frame, begin, end):
+        # Returns the decode plan of the header and topic of frame[begin:end] :
+        # (topic, raw topic, datatype, struct.Struct of scalars, payload size)
+        # unpack header
+        try:
+            header, = unpack_from("<H", frame, begin)
+        except struct.error as e:
+            hex_frame = hexlify(frame)
+            if isinstance(hex_frame, six.binary_type):
+                hex_frame = hex_frame.decode('ascii')
+            self.log_rx.error("Could not unpack header in frame {1} : {0}".format(e, hex_frame))
+            self.rx_corrupted_header += 1
+            return
+
+        # short topic id instead of topic string
+        with_id = header & TOPIC_ID_FLAG
+        if with_id:
+            header ^= TOPIC_ID_FLAG
+        elif header in (TOPIC_ID_ANNOUNCE, TOPIC_ID_ACK, TOPIC_ID_UNKNOWN):
+            self._on_topic_id_frame(header, frame, begin, end)
+            return
+
+        if not header in self.rtypes:
+            hex_frame = hexlify(frame)
+            if isinstance(hex_frame, six.binary_type):
+                hex_frame = hex_frame.decode('ascii')
+            self.log_rx.warning("Header not found in frame {0}".format(hex_frame))
+            self.rx_corrupted_header += 1
+            return
+
+        # Plans of topics that did not decode cleanly are not kept, so that
+        # each of their frames is counted
+        cache = True
+        if with_id:
+            topic, start = self._decode_topic_id(frame, begin, end)
+            if topic is None:
+                return
+            raw = topic.encode('utf8')
+        else:
+            # locate EOL
+            try:
+                i = frame.index(0, begin + 2, end)
+            except:
+                hex_frame = hexlify(frame)
+                if isinstance(hex_frame, six.binary_type):
+                    hex_frame = hex_frame.decode('ascii')
+                self.log_rx.warning("topic EOL not found for {0}"
+                                 .format(hex_frame))
+                self.rx_corrupted_eol += 1
+                return
+            raw = bytes(frame[begin+2:i])
+            start = i + 1
+
+            # decode topic
+            try:
+                topic = raw.decode("utf8")
+            except UnicodeError as e:
+                self.log_rx.warning("Decoding error for topic. %s. Using 'replace' option." % e)
+                self.rx_corrupted_topic += 1
+                topic = raw.decode("utf8", errors='replace')
+                cache = False
+
+        # Find type from header
+        _type = self.rtypes[header]
+        if _type in self.formats:
+            plan = (intern(topic), raw, _type, struct.Struct("<" + self.formats[_type]), self.sizes[_type])
+        else:
+            plan = (intern(topic), raw, _type, None, None)
+
+        self.rx_plan_misses += 1
+        if cache:
+            if len(self.rx_plans) >= self.rx_plan_size:
+                # Least recently used
+                self.rx_plans.popitem(last=False)
+            self.rx_plans[bytes(frame[begin:start])] = plan
+        return plan
+
+    def _decode_topic_id(self, frame, begin, end):
+        # payload starts after the 1 or 2 bytes id
+        start = begin + 3
+        if start <= end and frame[begin+2] & 0x80:
+            start += 1
+        if start > end:
+            hex_frame = hexlify(frame)
+            if isinstance(hex_frame, six.binary_type):
+                hex_frame = hex_frame.decode('ascii')
+            self.log_rx.warning("Topic id not found in frame {0}".format(hex_frame))
+            self.rx_corrupted_header += 1
+            return None, start
+
+        if start == begin + 4:
+            tid = (frame[begin+2] & 0x7f) << 8 | frame[begin+3]
+        else:
+            tid = frame[begin+2]
+
+        topic = self.rx_topic_ids.get(tid)
+        if topic is None:
+            # Ask the peer to fall back to the topic string
+            self.log_rx.warning("Unknown topic id {0}".format(tid))
+            self.rx_unknown_topic_ids += 1
+            if not tid in self.rx_reported_ids:
+                # Once per id : frames already in flight carry it as well
+                self.rx_reported_ids.add(tid)
+                self._on_tx_thread(self._send_topic_id_frame, TOPIC_ID_UNKNOWN, '', tid)
+        return topic, start
+
+    def _on_topic_id_frame(self, header, frame, begin, end):
+        try:
+            i = frame.index(0, begin + 2, end)
+            topic = frame[begin+2:i].decode("utf8")
+            tid, = unpack("<H", frame[i+1:end])
+        except (ValueError, UnicodeError, struct.error) as e:
+            hex_frame = hexlify(frame)
+            if isinstance(hex_frame, six.binary_type):
+                hex_frame = hex_frame.decode('ascii')
+            self.log_rx.warning("Malformed topic id frame {0} : {1}".format(hex_frame, e))
+            self.rx_corrupted_payload += 1
+            return
+
+        self.rx_control_frames += 1
+        self.rx_control_bytes += end - begin
+
+        if header == TOPIC_ID_ANNOUNCE:
+            if self.rx_topic_ids.get(tid) != topic:
+                self._evict_topic_id_plans(tid)
+            self.rx_topic_ids[tid] = topic
+            self.rx_reported_ids.discard(tid)
+            self._on_tx_thread(self._send_topic_id_frame, TOPIC_ID_ACK, topic, tid)
+
+        elif header == TOPIC_ID_ACK:
+            self._on_tx_thread(self._confirm_topic_id, topic, tid)
+
+        elif header == TOPIC_ID_UNKNOWN:
+            self._on_tx_thread(self._fall_back_topic_id, tid)
+
+    def _evict_topic_id_plans(self, tid):
+        # Plans of the previous topic of this id : header with the id flag,
+        # followed by the id field
+        if tid < 0x80:
+            topic_field = pack("B", tid)
+        else:
+            topic_field = pack(">H", tid | 0x8000)
+        for key in [key for key in self.rx_plans
+                    if six.indexbytes(key, 1) & 0x80 and key[2:] == topic_field]:
+            del self.rx_plans[key]
+
+    def _confirm_topic_id(self, topic, tid):
+        if self.tx_topic_ids is not None and self.tx_topic_ids.get(topic) == tid:
+            self.tx_confirmed_topics.add(topic)
+
+    def _fall_back_topic_id(self, tid):
+        # Peer lost the id, send the topic string until acknowledged again. An
+        # announce not acknowledged yet is already on its way
+        topic = self.tx_topic_names.get(tid)
+        if topic is not None and topic in self.tx_confirmed_topics:
+            self.tx_confirmed_topics.discard(topic)
+            self._send_topic_id_frame(TOPIC_ID_ANNOUNCE, topic, tid)
+
+    def _on_tx_thread(self, function, *args):
+        # Transmission state is only touched by the thread owning the transmission
+        if self.tx_executor is None:
+            function(*args)
+        else:
+            self.tx_executor(function, args)
+
     def publish(self, topic, data, datatype):
         # header
         if not datatype in self.types:
@@ -231,25 +703,151 @@ class Telemetry:
             raise IndexError("Provided datatype {0} not found for ({1}, {2})".format(datatype, topic, data))
             return
 
-        frame = self._encode_frame(topic, data, datatype)
+        if self.tx_topic_ids is not None:
+            self._assign_topic_id(topic)
+
+        if self.tx_mtu is None:
+            self._send(self._encode_frame(topic, data, datatype), topic)
+            return
+
+        record = self._encode_body(topic, data, datatype)
+        # Topic budgets are charged the record size, the container is charged
+        # to the link budget when sent
+        if self.tx_budget is not None and not self.tx_budget.admit(topic, 2 + len(record), link=False):
+            return
+        # container header + crc, and record size
+        if self.tx_pending and 4 + self.tx_pending_size + 2 + len(record) > self.tx_mtu:
+            self.flush()
+        self.tx_pending.append(record)
+        self.tx_pending_size += 2 + len(record)
+
+    def _send(self, frame, topic=None, control=False):
+        if self.tx_budget is None:
+            # bytestuff
+            stuffed = self.delimiter.encode(frame)
+        else:
+            # On-wire size is charged to the budgets, protocol frames are never
+            # dropped. Frames are only counted once admitted
+            stuffed = self.delimiter.stuff(frame)
+            if control:
+                self.tx_budget.charge(len(stuffed))
+            elif not self.tx_budget.admit(topic, len(stuffed), before_wait=self.tx_before_wait):
+                return
+            self.delimiter.count_encoded(len(frame), len(stuffed))
+        self._count_tx(frame, control)
 
-        # bytestuff
-        frame = self.delimiter.encode(frame)
+        for recorder in self.recorders:
+            recorder.record(TX, monotonic_ns(), frame)
+        frame = stuffed
+
+        if self.tx_buffer is not None:
+            self.tx_buffer.extend(frame)
+            return
 
         # send
-        if self.transport.writeable():
+        if self.transport is not None and self.transport.writeable():
             self.transport.write(frame)
 
+    def _count_tx(self, frame, control):
+        # Accounts a sent frame (unstuffed, with crc) per category
+        end = len(frame) - 2
+        self.tx_crc_bytes += 2
+        if control:
+            self.tx_encoded_frames += 1
+            self.tx_control_bytes += end
+            return
+        if unpack_from("<H", frame)[0] != CONTAINER:
+            self._count_tx_body(frame, 0, end)
+            return
+        self.tx_container_frames += 1
+        self.tx_container_bytes += 2
+        begin = 2
+        while begin < end:
+            size, = unpack_from("<H", frame, begin)
+            self.tx_container_bytes += 2
+            self._count_tx_body(frame, begin + 2, begin + 2 + size)
+            begin += 2 + size
+
+    def _count_tx_body(self, frame, begin, end):
+        if frame[begin+1] & 0x80:
+            # topic id
+            topic_size = 2 if frame[begin+2] & 0x80 else 1
+        else:
+            # topic string and EOL
+            topic_size = frame.find(b'\0', begin + 2, end) + 1 - begin - 2
+        self.tx_encoded_frames += 1
+        self.tx_header_bytes += 2
+        self.tx_topic_bytes += topic_size
+        self.tx_payload_bytes += end - begin - 2 - topic_size
+
     def update(self):
+        if self.tx_executor is None:
+            self.flush()
+
         amount = self.transport.readable()
-        for i in range(amount):
-            c = self.transport.read(maxbytes=1)
+        # The last of the amount bytes arrived about now, whatever the chunks
+        # they are read by
+        timestamp = monotonic_ns()
+        byte_time = self._byte_time()
+        for i in range(0, amount, self.rx_chunk_size):
+            c = self.transport.read(maxbytes=min(self.rx_chunk_size, amount - i))
             if c:  # Handle None or empty data
-                self.delimiter.decode(c)
+                # Arrival of the last byte of the chunk
+                self.delimiter.decode(c, timestamp - (amount - i - len(c)) * byte_time, byte_time)
+
+        if self.latest_changed:
+            self.latest_snapshot = dict(self.latest)
+            self.latest_changed = False
+
+    def _byte_time(self):
+        # Duration in ns of one byte on the wire (8N1 : 10 bits per byte)
+        baudrate = getattr(self.transport, 'baudrate', None)
+        if not baudrate:
+            return 0
+        return 10 * 1000000000 // baudrate
 
     def _on_frame_detected(self, frame):
+        timestamp = self.delimiter.frame_timestamp
+
+        for recorder in self.recorders:
+            recorder.record(RX, timestamp, frame)
+
         topic_data = self._decode_frame(frame)
         if topic_data is None:
             return
+
+        # container frame
+        if isinstance(topic_data, list):
+            if self.on_batch_callback:
+                self.on_batch_callback(topic_data, timestamp)
+                return
+            for topic, data in topic_data:
+                self.on_frame_callback(topic, data, timestamp)
+            return
+
         topic, data = topic_data
-        self.on_frame_callback(topic, data)
+        self.on_frame_callback(topic, data, timestamp)
+
+def iter_decode(chunks):
+    """
+Yields (topic, data) of the frames found in an iterable of byte chunks, for
+instance a file read in blocks or a recorded stream. Decoding happens lazily,
+one chunk at a time, without callbacks or transport.
+    """
+    telemetry = Telemetry(None, None)
+    decoded = deque()
+
+    def on_frame(frame):
+        topic_data = telemetry._decode_frame(frame)
+        if topic_data is None:
+            return
+        if isinstance(topic_data, list):
+            decoded.extend(topic_data)
+        else:
+            decoded.append(topic_data)
+
+    delimiter = Delimiter(on_frame)
+    for chunk in chunks:
+        delimiter.decode(chunk)
+        while decoded:
+            yield decoded.popleft()
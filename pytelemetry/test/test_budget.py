@@ -0,0 +1,178 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.budget import DELAY, DROP
+import time
+import pytest
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_delay_to_link_capacity():
+    t = transportMock()
+    t.baudrate = 10000
+    c = Pytelemetry(t)
+    c.start_transmit_thread()
+    # 1000 bytes per second, bursts of 100 bytes
+    c.set_link_budget(utilization=1.)
+    assert c.api.tx_budget.policy == DELAY
+
+    start = time.time()
+    for i in range(20):
+        # 20 bytes on the wire
+        c.publish('foo', 'x' * 10, 'string')
+    # publish() does not wait, the transmit thread does
+    assert time.time() - start < 0.1
+    c.stop_transmit_thread()
+    elapsed = time.time() - start
+
+    assert t.queue.qsize() == 400
+    assert 0.25 < elapsed < 0.6
+    budget = c.stats()['budget']
+    assert budget['capacity'] == 1000
+    assert budget['sent_bytes'] == 400
+    assert budget['sent_frames'] == 20
+    assert budget['delayed_frames'] > 10
+    assert budget['dropped_frames'] == 0
+    # the first window is sent as a burst
+    assert 0.5 < budget['utilization'] <= 1.5
+    # publish() would now wait in the caller thread
+    assert c.api.tx_budget.policy == DROP
+
+def test_admitted_frames_written_before_delay():
+    class stampedTransport(transportMock):
+        def __init__(self):
+            transportMock.__init__(self)
+            self.stamps = []
+
+        def write(self, data):
+            self.stamps.append((time.time(), len(data)))
+            return transportMock.write(self, data)
+
+    t = stampedTransport()
+    t.baudrate = 10000
+    c = Pytelemetry(t)
+    c.start_transmit_thread()
+    c.set_link_budget(utilization=1.)
+
+    start = time.time()
+    for i in range(20):
+        c.publish('foo', 'x' * 10, 'string')
+    c.stop_transmit_thread()
+
+    assert t.queue.qsize() == 400
+    # The burst of the first window does not wait for the delayed frames
+    first, size = t.stamps[0]
+    assert first - start < 0.1
+    assert size < 400
+
+def test_delay_requires_transmit_thread():
+    t = transportMock()
+    c = Pytelemetry(t)
+    with pytest.raises(ValueError):
+        c.set_link_budget(policy=DELAY, baudrate=10000)
+    c.set_link_budget(baudrate=10000)
+    assert c.api.tx_budget.policy == DROP
+
+def test_stuffing_is_charged():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.set_link_budget(policy=DROP, baudrate=10000)
+    # 0x7f, 0xf7 and 0x7d are escaped on the wire
+    c.publish('foo', b'\x7f\xf7\x7d'.decode('latin1'), 'string')
+    assert c.stats()['budget']['sent_bytes'] == t.queue.qsize()
+
+def test_drop_per_topic():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append(topic))
+    c.set_link_budget(policy=DROP, baudrate=1000000)
+    c.set_topic_budget('chatty', 100, burst=40)
+
+    for i in range(10):
+        c.publish('chatty', i, 'uint8')
+        c.publish('quiet', i, 'uint8')
+    c.update()
+
+    # 14 bytes frames : bucket of 40 bytes lets 3 of them go (the last one in debt)
+    assert received.count('chatty') == 3
+    assert received.count('quiet') == 10
+    budget = c.stats()['budget']
+    assert budget['dropped_frames'] == 7
+    assert budget['dropped_topics'] == {'chatty': 7}
+
+    c.set_topic_budget('chatty', None)
+    c.publish('chatty', 1, 'uint8')
+    c.update()
+    assert received.count('chatty') == 4
+
+def test_protocol_frames_never_dropped():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.set_link_budget(policy=DROP, baudrate=100)
+    c.enable_topic_ids()
+
+    for i in range(5):
+        c.publish('topic%d' % i, i, 'uint8')
+    # looped back : announces are received, then acks
+    c.update()
+    c.update()
+
+    # announces and acks are sent, values are dropped once the budget is spent
+    assert len(c.api.tx_confirmed_topics) == 5
+    assert c.stats()['budget']['dropped_frames'] > 0
+
+def test_budget_needs_baudrate():
+    c = Pytelemetry(transportMock())
+    with pytest.raises(ValueError):
+        c.set_link_budget()
+    with pytest.raises(ValueError):
+        c.set_topic_budget('foo', 10)
+    c.set_link_budget(baudrate=9600)
+    c.set_link_budget(None)
+    assert 'budget' not in c.stats()
+
+def test_dropped_frames_are_not_counted():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.set_link_budget(policy=DROP, baudrate=1000)
+    for i in range(50):
+        c.publish('foo', i, 'uint8')
+
+    stats = c.stats()
+    budget = stats['budget']
+    framing = stats['framing']
+    protocol = stats['protocol']
+    assert budget['dropped_frames'] > 0
+    assert budget['sent_frames'] + budget['dropped_frames'] == 50
+    assert framing['tx_encoded_frames'] == protocol['tx_encoded_frames'] == budget['sent_frames']
+    assert framing['tx_delimiter_bytes'] == 2 * budget['sent_frames']
+    assert framing['tx_processed_bytes'] + framing['tx_delimiter_bytes'] + framing['tx_escaped_bytes'] \
+        == budget['sent_bytes'] == t.queue.qsize()
+    assert protocol['tx_header_bytes'] + protocol['tx_topic_bytes'] + protocol['tx_payload_bytes'] \
+        + protocol['tx_crc_bytes'] == framing['tx_processed_bytes']
@@ -0,0 +1,161 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.capture import CaptureWriter, CaptureReader, frame_topics, RX, TX
+from pytelemetry.telemetry.telemetry import Telemetry, TOPIC_ID_ANNOUNCE, TOPIC_ID_FLAG
+from struct import pack
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def write_capture(path, block_size=256):
+    writer = CaptureWriter(path, block_size=block_size)
+    t = Telemetry(None, None)
+    for i in range(1000):
+        writer.record(RX, i * 1000, t._encode_frame('counter', i, 'uint32'))
+        if i % 100 == 0:
+            writer.record(RX, i * 1000, t._encode_frame('status', 'ok %d' % i, 'string'))
+    return writer
+
+def test_live_capture(tmpdir):
+    path = str(tmpdir.join('live.ptc'))
+    t = transportMock()
+    c = Pytelemetry(t)
+    capture = CaptureWriter(path)
+    c.add_recorder(capture)
+
+    c.publish('foo', 12, 'uint8')
+    c.publish('bar', 'baz', 'string')
+    c.update()
+    c.remove_recorder(capture)
+    c.publish('ignored', 1, 'uint8')
+    capture.close()
+
+    reader = CaptureReader(path)
+    records = list(reader.records())
+    assert [way for ts, way, frame in records] == [TX, TX, RX, RX]
+    assert records[0][2] == records[2][2]
+    assert list(reader.samples()) == [(records[2][0], 'foo', 12), (records[3][0], 'bar', 'baz')]
+    assert [(topic, value) for ts, topic, value in reader.samples(direction=TX)] == [('foo', 12), ('bar', 'baz')]
+    assert reader.topics() == set(['foo', 'bar'])
+
+def test_seek(tmpdir):
+    path = str(tmpdir.join('seek.ptc'))
+    write_capture(path).close()
+
+    reader = CaptureReader(path)
+    assert len(reader.index) > 10
+    samples = list(reader.samples('counter', start=500000, end=600000))
+    assert [value for ts, topic, value in samples] == list(range(500, 601))
+    assert [ts for ts, way, frame in reader.seek(999000)] == [999000]
+
+def test_topic_blocks(tmpdir):
+    path = str(tmpdir.join('topic.ptc'))
+    write_capture(path).close()
+
+    reader = CaptureReader(path)
+    blocks = [block for block in reader.index if 'status' in block[4]]
+    assert len(blocks) == 10
+    assert len(blocks) < len(reader.index)
+    samples = list(reader.samples('status'))
+    assert [value for ts, topic, value in samples] == ['ok %d' % i for i in range(0, 1000, 100)]
+
+def test_interrupted_capture(tmpdir):
+    path = str(tmpdir.join('interrupted.ptc'))
+    writer = write_capture(path)
+    writer.flush()
+    writer.full.put(None)
+    writer.thread.join()
+    writer.file.close()
+
+    reader = CaptureReader(path)
+    # Records are grouped in blocks, not indexed one by one
+    assert len(reader.index) == 1
+    assert [value for ts, topic, value in reader.samples('counter', start=998000)] == [998, 999]
+
+def test_unsorted_timestamps(tmpdir):
+    path = str(tmpdir.join('unsorted.ptc'))
+    writer = CaptureWriter(path, block_size=32)
+    t = Telemetry(None, None)
+    # Blocks overlap and their first timestamps are not sorted
+    timestamps = [0, 500, 100, 50, 400, 20, 300, 900, 10, 600, 250, 30]
+    for i, timestamp in enumerate(timestamps):
+        writer.record(RX, timestamp, t._encode_frame('a', i, 'uint8'))
+    writer.close()
+
+    reader = CaptureReader(path)
+    assert len(reader.index) == 6
+    for start, end in [(None, 60), (40, 60), (150, None), (450, 550), (550, 950)]:
+        expected = [timestamp for timestamp in timestamps
+                    if (start is None or timestamp >= start) and (end is None or timestamp <= end)]
+        assert [ts for ts, way, frame in reader.records(start, end)] == expected
+
+def write_topic_id_capture(path):
+    writer = CaptureWriter(path, block_size=64)
+    t = Telemetry(None, None)
+    writer.record(RX, 0, t._encode_topic_id_frame(TOPIC_ID_ANNOUNCE, 'foo', 1))
+    writer.record(RX, 0, t._encode_topic_id_frame(TOPIC_ID_ANNOUNCE, 'bar', 2))
+    for i in range(1, 100):
+        tid = 1 if i % 2 else 2
+        writer.record(RX, i * 1000, t._seal(bytearray(pack("<HBB", t.types['uint8'] | TOPIC_ID_FLAG, tid, i))))
+        if i == 50:
+            # id reassigned
+            writer.record(RX, i * 1000, t._encode_topic_id_frame(TOPIC_ID_ANNOUNCE, 'baz', 1))
+    return writer
+
+def test_seek_replays_topic_ids(tmpdir):
+    path = str(tmpdir.join('ids.ptc'))
+    write_topic_id_capture(path).close()
+
+    reader = CaptureReader(path)
+    assert len(reader.index) > 10
+    assert list(reader.samples(start=90000, end=92000)) == [(90000, 'bar', 90), (91000, 'baz', 91), (92000, 'bar', 92)]
+    assert [value for ts, topic, value in reader.samples('foo', start=40000)] == [41, 43, 45, 47, 49]
+
+    # Index of a capture written before announces were indexed
+    for block in reader.index:
+        del block[5:]
+    assert list(reader.samples(start=97000)) == [(97000, 'baz', 97), (98000, 'bar', 98), (99000, 'baz', 99)]
+
+def test_interrupted_capture_replays_topic_ids(tmpdir):
+    path = str(tmpdir.join('interrupted_ids.ptc'))
+    writer = write_topic_id_capture(path)
+    writer.flush()
+    writer.full.put(None)
+    writer.thread.join()
+    writer.file.close()
+
+    reader = CaptureReader(path)
+    assert list(reader.samples(start=99000)) == [(99000, 'baz', 99)]
+
+def test_frame_topics():
+    t = Telemetry(None, None)
+    assert frame_topics(t._encode_frame('foo:2', 1, 'uint8')) == ['foo:2']
+    t.enable_topic_ids()
+    t.tx_topic_ids['foo'] = 1
+    t.tx_confirmed_topics.add('foo')
+    assert frame_topics(t._encode_frame('foo', 1, 'uint8')) is None
@@ -0,0 +1,58 @@
+from __future__ import division, print_function
+from pytelemetry.conformance import generate, decode, common_stats, PROFILES, StreamTransport
+from pytelemetry.telemetry.telemetry import Telemetry
+import pytest
+
+def c_backend():
+    # (backend, None), or (None, reason) if the C library is not built for
+    # this platform
+    from pytelemetry.telemetry.c_binding import TelemetryCBinding
+    try:
+        TelemetryCBinding(StreamTransport(), lambda topic, data, timestamp=None: None)
+    except OSError as e:
+        return None, str(e)
+    return TelemetryCBinding, None
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_python_backend(profile):
+    for seed in range(3):
+        chunks, expected = generate(seed, frames=500, **PROFILES[profile])
+        records, stats, elapsed = decode(Telemetry, chunks)
+        assert records == expected
+        assert stats['rx_decoded_frames'] == len(expected)
+
+        # Reading the transport by bigger chunks changes nothing
+        assert decode(Telemetry, chunks, rx_chunk_size=4096)[:2] == (records, stats)
+
+def test_adversarial_stream():
+    chunks, expected = generate(0, frames=1000, **PROFILES['adversarial'])
+    records, stats, elapsed = decode(Telemetry, chunks)
+    assert len(expected) < 1000
+    assert stats['rx_corrupted_crc'] > 0
+    assert stats['rx_uncomplete_frames'] > 0
+    assert stats['rx_discarded_bytes'] > 0
+    assert stats['rx_escaped_bytes'] > 0
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_c_backend_matches_python(profile):
+    backend, reason = c_backend()
+    if backend is None:
+        pytest.skip("C library not available : " + reason)
+    for seed in range(3):
+        chunks, expected = generate(seed, frames=500, **PROFILES[profile])
+        python_records, python_stats, elapsed = decode(Telemetry, chunks)
+        c_records, c_stats, elapsed = decode(backend, chunks)
+        assert c_records == python_records == expected
+        common = common_stats(python_stats, c_stats)
+        assert common is not None, "stats not comparable"
+        assert common[0] == common[1]
+
+def test_common_stats():
+    assert common_stats({'a': 1, 'b': 2}, {'b': 2, 'c': 3}) == ({'b': 2}, {'b': 2})
+    # Nothing in common is reported, not compared as equal
+    assert common_stats({'a': 1}, {}) is None
+
+def test_library_names():
+    from pytelemetry.telemetry.c_binding import library_names
+    names = library_names('telemetry')
+    assert names[0] in ('telemetry.dll', 'libtelemetry.so', 'libtelemetry.dylib')
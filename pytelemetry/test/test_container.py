@@ -0,0 +1,138 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.telemetry.telemetry import Telemetry
+from pytelemetry.telemetry.crc import crc16
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+import struct
+
+# For Python 2 compatibility, if unittest.mock is not available
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+        self.writes = 0
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        self.writes += 1
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_batched_publish():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe(None, cb)
+    c.enable_batching()
+
+    c.publish('foo', 1, 'uint8')
+    c.publish('bar:3', -2, 'int16')
+    c.publish('baz', 'hello', 'string')
+    c.publish('adc', [1, 2, 3], 'uint16_array')
+    assert t.writes == 0
+
+    c.update() # flushes, then reads back the container
+    assert t.writes == 1
+    assert cb.call_count == 4
+    calls = [args[0] for args in cb.call_args_list]
+    assert calls[:3] == [('foo', 1, None), ('bar', -2, {'index': 3}), ('baz', 'hello', None)]
+    assert calls[3][0] == 'adc' and list(calls[3][1]) == [1, 2, 3]
+
+    stats = c.stats()['protocol']
+    assert stats['tx_container_frames'] == 1
+    assert stats['rx_container_frames'] == 1
+    assert stats['tx_encoded_frames'] == 4
+    assert stats['rx_decoded_frames'] == 4
+
+def test_mtu():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe(None, cb)
+    # each record is 2 + 2 + 4 + 4 bytes, 3 fit in 4 + 3 * 12 = 40 bytes
+    c.enable_batching(mtu=40)
+
+    for i in range(7):
+        c.publish('val', i, 'uint32')
+    c.flush()
+
+    # two containers of 3 values and a regular frame
+    assert t.writes == 3
+    assert c.stats()['protocol']['tx_container_frames'] == 2
+    c.update()
+    assert [args[0][1] for args in cb.call_args_list] == list(range(7))
+
+def test_batch_callback():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    batch_cb = mock.Mock(spec=["records"])
+    c.subscribe('foo', cb)
+    c.subscribe_batch(batch_cb)
+    c.enable_batching()
+
+    c.publish('foo', 1, 'uint8')
+    c.publish('foo:1', 2, 'uint8')
+    c.update()
+
+    assert cb.call_count == 0
+    batch_cb.assert_called_once_with([('foo', 1, None), ('foo', 2, {'index': 1})])
+
+def test_corrupted_record():
+    t = Telemetry(None, None)
+    good = t._encode_body('foo', 1, 'uint8')
+    bad = t._encode_body('bar', 2, 'uint8')[:-1] # payload too short
+    frame = bytearray(struct.pack("<H", 0x0200))
+    for record in (good, bad, good):
+        frame.extend(struct.pack("<H", len(record)))
+        frame.extend(record)
+    frame.extend(struct.pack("<H", crc16(frame)))
+
+    assert t._decode_frame(frame) == [('foo', 1), ('foo', 1)]
+    assert t.stats()['rx_corrupted_payload'] == 1
+
+    # record size running past the end of the container
+    frame = frame[:-2]
+    frame.extend(struct.pack("<H", 200))
+    frame.extend(struct.pack("<H", crc16(frame)))
+    assert t._decode_frame(frame) == [('foo', 1), ('foo', 1)]
+    # short record again, and the truncated one
+    assert t.stats()['rx_corrupted_payload'] == 3
+
+def test_container_without_valid_records():
+    t = transportMock()
+    c = Pytelemetry(t)
+    batch_cb = mock.Mock(spec=["records"])
+    c.subscribe_batch(batch_cb)
+
+    bad = c.api._encode_body('bar', 2, 'uint8')[:-1] # payload too short
+    frame = bytearray(struct.pack("<HH", 0x0200, len(bad)))
+    frame.extend(bad)
+    assert c.api._decode_frame(c.api._seal(bytearray(frame))) is None
+    c.api._send(c.api._seal(frame))
+    c.update()
+
+    assert batch_cb.call_count == 0
+    assert c.stats()['protocol']['rx_corrupted_payload'] == 2
@@ -0,0 +1,115 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.decimation import Decimator, Aggregate
+import pytest
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+# For Python 2 compatibility, if unittest.mock is not available
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_buckets():
+    cb = mock.Mock(spec=["topic","data","opts"])
+    d = Decimator(0.001, cb)
+
+    # 1 ms buckets, 5 samples per bucket
+    for i in range(20):
+        d('adc', i % 7, None, i * 200000)
+    assert cb.call_count == 3
+    assert cb.call_args_list[0][0] == ('adc', Aggregate(0, 4, 2, 4, 5), None)
+    assert cb.call_args_list[1][0] == ('adc', Aggregate(0, 6, 2.8, 2, 5), None)
+
+    d.flush()
+    assert cb.call_count == 4
+    assert d.buckets == {}
+
+def test_indexes_and_types():
+    cb = mock.Mock(spec=["topic","data","opts","timestamp"])
+    d = Decimator(1, cb, timestamp=True)
+
+    d('foo', 1, {'index': 0}, 10)
+    d('foo', 5, {'index': 1}, 20)
+    d('foo', 'on', None, 30)
+    d('foo', 'off', None, 40)
+    d.expire(2 * 10**9)
+
+    calls = [args[0] for args in cb.call_args_list]
+    assert len(calls) == 3
+    assert ('foo', Aggregate(None, None, None, 'off', 2), None, 40) in calls
+    assert ('foo', Aggregate(1, 1, 1, 1, 1), {'index': 0}, 10) in calls
+    assert ('foo', Aggregate(5, 5, 5, 5, 1), {'index': 1}, 20) in calls
+
+def test_array_aggregate():
+    cb = mock.Mock(spec=["topic","data","opts"])
+    d = Decimator(1, cb)
+    d('adc', [3, -1, 4], None, 0)
+    d('adc', [10], None, 1)
+    d.flush()
+    cb.assert_called_once_with('adc', Aggregate(-1, 10, 4, 10, 4), None)
+
+def test_decimated_subscription():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe('adc', cb, decimate=3600)
+
+    for i in range(100):
+        c.publish('adc', i, 'uint8')
+    c.update()
+    assert cb.call_count == 0
+
+    c.decimators['adc'].flush()
+    cb.assert_called_once_with('adc', Aggregate(0, 99, 49.5, 99, 100), None)
+
+    # plain subscription again
+    c.subscribe('adc', cb)
+    assert c.decimators == {}
+
+def test_mixed_values():
+    cb = mock.Mock(spec=["topic","data","opts"])
+    d = Decimator(1, cb)
+    # The mean skips strings
+    d('foo', 2, None, 0)
+    d('foo', 'on', None, 1)
+    d('foo', 4, None, 2)
+    d.flush()
+    d('foo', 'off', None, 3)
+    d('foo', 6, None, 4)
+    d.flush()
+    assert [args[0] for args in cb.call_args_list] == [('foo', Aggregate(2, 4, 3, 4, 3), None),
+                                                       ('foo', Aggregate(6, 6, 6, 6, 2), None)]
+
+def test_invalid_period():
+    cb = mock.Mock(spec=["topic","data","opts"])
+    for period in (0, -1, 1e-12):
+        with pytest.raises(ValueError):
+            Decimator(period, cb)
@@ -0,0 +1,88 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.filters import ChangeFilter
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_on_change():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe('status', lambda topic, data, opts: received.append(data), on_change=True)
+
+    for value in [0, 0, 0, 1, 1, 0, 0]:
+        c.publish('status', value, 'uint8')
+    c.update()
+
+    assert received == [0, 1, 0]
+    assert c.stats()['filters'] == {'status': {'passed': 3, 'filtered': 4}}
+
+    c.resetStats()
+    assert c.stats()['filters']['status']['filtered'] == 0
+    c.unsubscribe('status')
+    assert 'filters' not in c.stats()
+
+def test_deadband_per_index():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append((opts['index'], data)), deadband=0.5)
+
+    for value in [20.0, 20.2, 20.4, 20.6, 20.7, 19.9]:
+        c.publish('temp:0', value, 'float32')
+    c.publish('temp:1', 30.0, 'float32')
+    c.update()
+
+    # compared with the last value given to the callback
+    assert [(i, round(v, 1)) for i, v in received] == [(0, 20.0), (0, 20.6), (0, 19.9), (1, 30.0)]
+
+def test_min_interval():
+    received = []
+    f = ChangeFilter(lambda topic, data, opts, timestamp: received.append((data, timestamp)),
+                     timestamp=True, min_interval=0.01)
+
+    for i, ms in enumerate([0, 2, 9, 10, 15, 21]):
+        f('adc', i, None, ms * 1000000)
+
+    assert received == [(0, 0), (3, 10000000), (5, 21000000)]
+    assert f.stats() == {'passed': 3, 'filtered': 3}
+
+def test_arrays_and_strings():
+    received = []
+    f = ChangeFilter(lambda topic, data, opts: received.append(data), deadband=1)
+
+    f('spectrum', [0, 0, 0], None, None)
+    f('spectrum', [1, 0, 1], None, None)
+    f('spectrum', [0, 2, 0], None, None)
+    f('spectrum', [0, 2], None, None)
+    f('name', 'foo', None, None)
+    f('name', 'foo', None, None)
+    f('name', 'bar', None, None)
+
+    assert received == [[0, 0, 0], [0, 2, 0], [0, 2], 'foo', 'bar']
@@ -0,0 +1,44 @@
+from __future__ import division, print_function
+import os
+import subprocess
+import sys
+import pytest
+import pytelemetry
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires Python 3.7")
+
+# Cumulative import time budget of `from pytelemetry import Pytelemetry`, in us.
+# Typically 20 to 30 ms, the margin absorbs slow CI machines
+IMPORT_BUDGET = 150000
+
+def import_times(statement):
+    """ Runs statement in a fresh interpreter and returns cumulative import times per module """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(pytelemetry.__file__)))
+    output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', statement],
+                                     stderr=subprocess.STDOUT,
+                                     cwd=root,
+                                     universal_newlines=True)
+    times = dict()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+def test_package_import_is_lazy():
+    times = import_times("import pytelemetry")
+    assert 'pytelemetry' in times
+    assert [name for name in times if name.startswith('pytelemetry.')] == []
+
+def test_c_binding_not_loaded():
+    times = import_times("from pytelemetry import Pytelemetry")
+    assert 'pytelemetry.pytelemetry' in times
+    assert not 'pytelemetry.telemetry.c_binding' in times
+    assert not 'ctypes' in times
+
+def test_import_budget():
+    statement = "from pytelemetry import Pytelemetry"
+    best = min(sum(t for name, t in import_times(statement).items() if name in ('pytelemetry', 'pytelemetry.pytelemetry'))
+               for i in range(3))
+    assert best < IMPORT_BUDGET, "importing Pytelemetry took %d us" % best
@@ -0,0 +1,108 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.telemetry.telemetry import Sample
+from threading import Thread, Event
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+        self.baudrate = 115200
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_latest_values():
+    t = transportMock()
+    c = Pytelemetry(t)
+    assert c.latest('foo') is None
+    assert c.snapshot() == {}
+
+    c.enable_latest()
+    c.subscribe('foo', lambda topic, data, opts: None)
+    c.publish('foo', 1, 'uint8')
+    c.publish('foo', 2, 'uint8')
+    c.publish('bar:3', 'baz', 'string')
+    c.publish('spectrum', [1, 2, 3], 'int16_array')
+
+    assert c.snapshot() == {}
+    c.update()
+
+    foo = c.latest('foo')
+    assert isinstance(foo, Sample)
+    assert (foo.value, foo.datatype, foo.sequence) == (2, 'uint8', 2)
+    assert foo.timestamp is not None
+    # unsubscribed topics are decoded as well
+    assert c.latest('bar:3')[:2] == ('baz', 'string')
+    assert list(c.latest('spectrum').value) == [1, 2, 3]
+    assert c.latest('bar:3').timestamp > foo.timestamp
+    assert c.api.stats()['rx_skipped_frames'] == 0
+
+    snapshot = c.snapshot()
+    assert sorted(snapshot) == ['bar:3', 'foo', 'spectrum']
+    assert snapshot['foo'] == foo
+
+    # published snapshots are never modified
+    c.publish('foo', 3, 'uint8')
+    c.update()
+    assert snapshot['foo'].value == 2
+    assert c.snapshot()['foo'].value == 3
+    assert c.snapshot() is c.snapshot()
+
+    c.enable_latest(False)
+    assert c.latest('foo') is None
+    assert c.snapshot() == {}
+
+def test_latest_from_other_threads():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.enable_latest()
+    done = Event()
+    errors = []
+
+    def reader():
+        last = 0
+        while not done.is_set():
+            snapshot = c.snapshot()
+            sample = c.latest('counter')
+            if sample is None:
+                continue
+            # values never go back in time, snapshots lag behind latest values
+            if sample.value < last:
+                errors.append((last, sample.value))
+            if 'counter' in snapshot and snapshot['counter'].value > sample.value:
+                errors.append((snapshot['counter'].value, sample.value))
+            last = sample.value
+
+    readers = [Thread(target=reader) for _ in range(3)]
+    for r in readers:
+        r.start()
+    for i in range(300):
+        c.publish('counter', i, 'uint16')
+        c.update()
+    done.set()
+    for r in readers:
+        r.join()
+
+    assert errors == []
+    assert c.latest('counter').value == 299
@@ -406,3 +406,95 @@ def test_protocol_stats():
     assert measures['framing']["tx_processed_bytes"] == 0
     assert measures['framing']["tx_encoded_frames"] == 0
     assert measures['framing']["tx_escaped_bytes"] == 0
+
+def test_frame_timestamp():
+    t = transportMock()
+    t.baudrate = 115200
+    c = Pytelemetry(t)
+    c.api.rx_chunk_size = 64
+    cb = mock.Mock(spec=["topic","data","opts","timestamp"])
+    plain_cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe('stamped', cb, timestamp=True)
+    c.subscribe('plain', plain_cb)
+
+    c.publish('stamped', 12, 'uint8')
+    first_size = t.queue.qsize()
+    c.publish('plain', 13, 'uint8')
+    c.publish('stamped', 14, 'uint8')
+    gap = t.queue.qsize() - first_size
+    c.update()
+
+    plain_cb.assert_called_once_with('plain', 13, None)
+    assert cb.call_count == 2
+    first, second = [args[0] for args in cb.call_args_list]
+    assert first[:3] == ('stamped', 12, None)
+    assert second[:3] == ('stamped', 14, None)
+    # all frames were read in one chunk : EOFs are spaced by the bytes in between
+    assert second[3] - first[3] == gap * (10 * 1000000000 // 115200)
+
+def test_frame_timestamp_default_chunks():
+    # Bytes read one at a time, stamps still follow the wire
+    t = transportMock()
+    t.baudrate = 115200
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts","timestamp"])
+    c.subscribe('stamped', cb, timestamp=True)
+
+    c.publish('stamped', 12, 'uint8')
+    first_size = t.queue.qsize()
+    c.publish('stamped', 14, 'uint8')
+    gap = t.queue.qsize() - first_size
+    c.update()
+
+    first, second = [args[0][3] for args in cb.call_args_list]
+    assert second - first == gap * (10 * 1000000000 // 115200)
+
+def test_end_to_end_array():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe('adc', cb)
+
+    c.publish('adc', list(range(64)), 'uint16_array')
+    c.update()
+    assert t.queue.qsize() == 0
+    assert cb.call_count == 1
+    topic, data, opts = cb.call_args[0]
+    assert topic == 'adc'
+    assert list(data) == list(range(64))
+
+def test_unsubscribed_topics_not_decoded():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe('wanted', cb)
+
+    c.publish('wanted', 1, 'uint8')
+    c.publish('chatty', 2, 'uint8')
+    c.publish('chatty:3', 'foo', 'string')
+    # corrupted frames of unsubscribed topics are not even checked
+    t.write(bytearray.fromhex("f70700636861747479006261720000007f"))
+    c.update()
+
+    cb.assert_called_once_with('wanted', 1, None)
+    measures = c.api.stats()
+    assert measures['rx_decoded_frames'] == 1
+    assert measures['rx_skipped_frames'] == 3
+    assert measures['rx_corrupted_crc'] == 0
+
+    # containers are filtered per record
+    c.enable_batching()
+    c.publish('chatty', 4, 'uint8')
+    c.publish('wanted', 5, 'uint8')
+    c.flush()
+    c.update()
+    assert cb.call_args[0] == ('wanted', 5, None)
+    assert c.api.stats()['rx_skipped_frames'] == 4
+
+    # a default callback receives everything again
+    default_cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe(None, default_cb)
+    c.publish('chatty', 6, 'uint8')
+    c.flush()
+    c.update()
+    default_cb.assert_called_once_with('chatty', 6, None)
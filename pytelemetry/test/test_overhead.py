@@ -0,0 +1,153 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.capture import CaptureWriter, CaptureReader
+from pytelemetry.overhead import OverheadAnalyzer, SHARED
+from pytelemetry.telemetry.telemetry import RX, TX
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_categories_of_live_link():
+    t = transportMock()
+    c = Pytelemetry(t)
+    analyzer = OverheadAnalyzer(direction=TX)
+    c.add_recorder(analyzer)
+
+    for i in range(10):
+        c.publish('foo', i, 'uint8')
+    # escaped on the wire
+    c.publish('bar', 0x7d, 'uint8')
+    sent = t.queue.qsize()
+    c.update()
+
+    report = analyzer.report()
+    assert report['frames'] == 11
+    assert report['bytes'] == sent
+    # 11 bytes per frame, plus escapes (value of 'bar', and possibly crcs)
+    escapes = sent - 11 * 11
+    assert escapes >= 1
+    assert report['categories'] == {'delimiters': 22, 'escapes': escapes, 'headers': 22,
+                                    'topics': 44, 'payload': 11, 'crc': 22,
+                                    'containers': 0, 'control': 0, 'invalid': 0}
+    assert report['overhead'] == 1 - 11 / sent
+    foo = report['topics']['foo']
+    assert foo['records'] == 10
+    assert foo['bytes'] == 110 + foo['escapes']
+    assert foo['payload'] == 10
+    assert report['topics']['bar']['escapes'] == 1
+
+    # Same totals from the counters of the link
+    stats = c.stats()
+    for way in ('rx', 'tx'):
+        assert stats['protocol'][way + '_header_bytes'] == 22
+        assert stats['protocol'][way + '_topic_bytes'] == 44
+        assert stats['protocol'][way + '_payload_bytes'] == 11
+        assert stats['protocol'][way + '_crc_bytes'] == 22
+        assert stats['framing'][way + '_delimiter_bytes'] == 22
+
+def test_savings_estimates_match_the_real_thing():
+    t = transportMock()
+    c = Pytelemetry(t)
+    analyzer = OverheadAnalyzer(direction=TX, mtu=256)
+    c.add_recorder(analyzer)
+    for i in range(10):
+        c.publish('foo', i, 'uint8')
+    report = analyzer.report()
+    plain = report['bytes']
+    assert plain == t.queue.qsize()
+    assert report['savings']['topic_ids'] == 10 * (4 - 1) - 2 * 12
+
+    batched = OverheadAnalyzer(direction=TX)
+    c.remove_recorder(analyzer)
+    c.add_recorder(batched)
+    c.enable_batching(mtu=256)
+    for i in range(10):
+        c.publish('foo', i, 'uint8')
+    c.flush()
+    assert batched.report()['bytes'] == t.queue.qsize() - plain
+    assert plain - batched.report()['bytes'] == report['savings']['batching']
+    assert batched.report()['topics'][SHARED]['containers'] == 2
+    assert batched.report()['topics']['foo']['containers'] == 20
+
+    with_ids = OverheadAnalyzer(direction=TX)
+    c.remove_recorder(batched)
+    c.add_recorder(with_ids)
+    c.enable_batching(None)
+    c.enable_topic_ids()
+    c.publish('foo', 0, 'uint8')
+    # announce and acknowledgement
+    c.update()
+    c.update()
+    for i in range(9):
+        c.publish('foo', i, 'uint8')
+    sent = with_ids.report()
+    # Frames with ids are accounted to their topic
+    foo = sent['topics']['foo']
+    assert foo['records'] == 10
+    assert foo['topics'] == 4 + 9 * 1
+    assert sent['topics'][SHARED]['control'] > 0
+    assert not '#0' in sent['topics']
+
+def test_batching_window():
+    analyzer = OverheadAnalyzer(window=0.001)
+    c = Pytelemetry(transportMock())
+    for i in range(10):
+        analyzer.record(TX, i * 2000000, c.api._encode_frame('foo', i, 'uint8'))
+    # frames too far apart are not packed
+    assert analyzer.report()['savings']['batching'] == 0
+
+def test_capture_and_stream(tmpdir):
+    path = str(tmpdir.join('session.ptc'))
+    t = transportMock()
+    c = Pytelemetry(t)
+    live = OverheadAnalyzer(direction=RX)
+    capture = CaptureWriter(path)
+    c.add_recorder(live)
+    c.add_recorder(capture)
+    c.subscribe(None, lambda topic, data, opts: None)
+    for i in range(20):
+        c.publish('foo', i, 'uint16')
+        c.publish('bar', 'x' * i, 'string')
+    raw = list(t.queue.queue)
+    c.update()
+    capture.close()
+
+    offline = OverheadAnalyzer(direction=RX)
+    with CaptureReader(path) as reader:
+        offline.analyze(reader.records())
+    assert offline.report() == live.report()
+
+    # garbage before the first frame
+    stream = OverheadAnalyzer()
+    stream.analyze_stream([bytearray(b'\x01\x02') + bytearray(raw[:100]), bytearray(raw[100:])])
+    report = stream.report()
+    assert report['topics'][SHARED]['invalid'] == 2
+    assert report['bytes'] == len(raw) + 2
+    topics = live.report()['topics']
+    topics[SHARED] = report['topics'][SHARED]
+    assert report['topics'] == topics
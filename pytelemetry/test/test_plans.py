@@ -0,0 +1,139 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.telemetry.telemetry import Telemetry, TOPIC_ID_FLAG, TOPIC_ID_ANNOUNCE
+from struct import pack
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_plans_are_reused():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append((topic, data, opts)))
+
+    for i in range(5):
+        c.publish('foo', i, 'uint16')
+        c.publish('foo:1', 2.5, 'float32')
+        c.publish('bar', 'x' * i, 'string')
+    c.update()
+
+    assert received[:3] == [('foo', 0, None), ('foo', 2.5, {'index': 1}), ('bar', '', None)]
+    assert len(received) == 15
+    assert c.stats()['protocol']['rx_plan_misses'] == 3
+    assert len(c.api.rx_plans) == 3
+
+    # opts are not shared between calls
+    received[1][2]['index'] = 7
+    c.publish('foo:1', 3.5, 'float32')
+    c.update()
+    assert received[-1] == ('foo', 3.5, {'index': 1})
+
+def test_same_topic_other_type():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe('foo', lambda topic, data, opts: received.append(data))
+    c.publish('foo', 300, 'uint16')
+    c.publish('foo', -3, 'int8')
+    c.publish('foo', 'bar', 'string')
+    c.update()
+    assert received == [300, -3, 'bar']
+    assert c.stats()['protocol']['rx_plan_misses'] == 3
+
+def test_wrong_payload_size():
+    t = Telemetry(None, None)
+    frame = t._encode_frame('foo', 300, 'uint16')
+    assert t._decode_frame(frame) == ('foo', 300)
+    # Same header and topic, one byte short
+    body = bytearray(pack("<H", t.types['uint16'])) + b'foo\0' + b'\x01'
+    assert t._decode_frame(t._seal(body)) is None
+    assert t.stats()['rx_corrupted_payload'] == 1
+    assert t.stats()['rx_plan_misses'] == 1
+
+def test_least_recently_used_evicted():
+    t = Telemetry(None, None)
+    t.rx_plan_size = 2
+    frames = dict((topic, t._encode_frame(topic, 1, 'uint8')) for topic in ('a', 'b', 'c'))
+    for topic in ('a', 'b', 'a', 'c', 'a'):
+        assert t._decode_frame(frames[topic]) == (topic, 1)
+    # 'b' was evicted when 'c' arrived
+    assert t.stats()['rx_plan_misses'] == 3
+    assert t._decode_frame(frames['b']) == ('b', 1)
+    assert t.stats()['rx_plan_misses'] == 4
+    assert len(t.rx_plans) == 2
+
+def test_corrupted_topics_not_cached():
+    t = Telemetry(None, None)
+    body = bytearray(pack("<H", t.types['uint8'])) + b'\xff\xfe\0' + b'\x01'
+    frame = t._seal(body)
+    for i in range(3):
+        topic, data = t._decode_frame(frame)
+        assert data == 1
+    assert t.stats()['rx_corrupted_topic'] == 3
+    assert len(t.rx_plans) == 0
+
+def test_reassigned_topic_id():
+    t = Telemetry(None, None)
+    t.tx_executor = lambda function, args: None
+
+    def announce(topic, tid):
+        t._decode_frame(t._seal(bytearray(pack("<H3sBH", TOPIC_ID_ANNOUNCE, topic, 0, tid))))
+
+    def with_id(tid, value):
+        return t._seal(bytearray(pack("<HBB", t.types['uint8'] | TOPIC_ID_FLAG, tid, value)))
+
+    announce(b'foo', 1)
+    assert t._decode_frame(with_id(1, 5)) == ('foo', 5)
+    # A capture gives bytearrays
+    assert t._decode_frame(bytearray(with_id(1, 6))) == ('foo', 6)
+    t._decode_frame(t._encode_frame('baz', 1, 'uint8'))
+    announce(b'qux', 2)
+    assert t._decode_frame(with_id(2, 8)) == ('qux', 8)
+    assert len(t.rx_plans) == 3
+
+    announce(b'bar', 1)
+    assert t._decode_frame(with_id(1, 7)) == ('bar', 7)
+    # Only the plan of the reassigned id was evicted
+    assert len(t.rx_plans) == 3
+    misses = t.stats()['rx_plan_misses']
+    assert t._decode_frame(with_id(2, 9)) == ('qux', 9)
+    assert t._decode_frame(t._encode_frame('baz', 2, 'uint8')) == ('baz', 2)
+    assert t.stats()['rx_plan_misses'] == misses
+
+def test_least_recently_used_routes_evicted():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.api.rx_plan_size = 2
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append(topic))
+    for topic in ('a', 'b', 'a', 'c', 'a'):
+        c._on_frame(topic, 1)
+    assert received == ['a', 'b', 'a', 'c', 'a']
+    # 'b' was evicted when 'c' arrived, 'a' stayed
+    assert list(c.routes) == ['c', 'a']
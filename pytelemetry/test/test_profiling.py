@@ -0,0 +1,96 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.telemetry.crc import crc16
+from pytelemetry.remoting import translate
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_profile_stages():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append(data))
+    assert 'profile' not in c.stats()
+
+    c.enable_profiling()
+    c.publish('foo', 12, 'uint8')
+    c.publish('foo:2', 13, 'uint8')
+    c.update()
+    assert received == [12, 13]
+
+    profile = c.stats()['profile']
+    assert profile['write']['calls'] == 2
+    assert profile['encode']['calls'] == 2
+    assert profile['decode_frame']['calls'] == 2
+    assert profile['translate']['calls'] == 2
+    assert profile['callbacks']['calls'] == 2
+    # crc computed once when sending, once when receiving each frame
+    assert profile['crc16']['calls'] == 4
+    # byte per byte reads
+    assert profile['read']['calls'] == profile['decode']['calls'] == c.stats()['framing']['rx_processed_bytes']
+
+    for stage in profile.values():
+        assert 0 <= stage['self_ns'] <= stage['total_ns']
+    # Frames are decoded from within the delimiter
+    assert profile['decode']['total_ns'] >= profile['decode_frame']['total_ns']
+
+    c.resetStats()
+    assert c.stats()['profile']['crc16'] == {'calls': 0, 'total_ns': 0, 'self_ns': 0}
+
+def test_disabling_restores_plain_calls():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = []
+    c.subscribe_batch(lambda records: cb.extend(records))
+    c.enable_batching()
+
+    c.enable_profiling()
+    c.publish('foo', 1, 'uint8')
+    c.publish('bar', 2, 'uint8')
+    c.update()
+    c.update()
+    assert len(cb) == 2
+    assert c.stats()['profile']['callbacks']['calls'] == 1
+
+    c.enable_profiling(False)
+    assert 'profile' not in c.stats()
+    assert c.api.crc16 is crc16
+    assert c.translate is translate
+    assert c.api.on_frame_callback == c._on_frame
+    assert c.api.on_batch_callback == c._on_batch
+    for obj in (c, c.api, c.api.delimiter, t):
+        for value in vars(obj).values():
+            assert getattr(value, '__name__', None) != 'timed'
+    assert t.read == transportMock.read.__get__(t)
+
+    c.publish('foo', 3, 'uint8')
+    c.publish('bar', 4, 'uint8')
+    c.update()
+    c.update()
+    assert len(cb) == 4
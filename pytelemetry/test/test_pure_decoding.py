@@ -109,3 +109,105 @@ def test_delimiter_stats():
     assert measures["tx_processed_bytes"] == 0
     assert measures["tx_encoded_frames"] == 0
     assert measures["tx_escaped_bytes"] == 0
+
+def test_delimiter_frame_timestamp():
+    stamps = []
+    d = Delimiter(lambda frame: stamps.append(d.frame_timestamp))
+
+    # two frames in one chunk, followed by two bytes of a third one
+    chunk = bytearray.fromhex("f70700666f6f0062617247027f" + "f70700666f6f0062617247027f" + "f707")
+    d.decode(chunk, 10000, 100)
+
+    # EOFs are 15 and 2 bytes from the end of the chunk
+    assert stamps == [10000 - 15 * 100, 10000 - 2 * 100]
+
+    d.decode(bytearray.fromhex("f70700666f6f0062617247027f"))
+    assert stamps[-1] is None
+
+def reference_encode(d, payload):
+    frame = bytearray([d.SOF])
+    for c in payload:
+        if c in (d.SOF, d.EOF, d.ESC):
+            frame.append(d.ESC)
+        frame.append(c)
+    frame.append(d.EOF)
+    return frame
+
+def test_encode_matches_bytewise_stuffing():
+    import random
+    rng = random.Random(0)
+    d = Delimiter(cb)
+    processed = 0
+    escaped = 0
+    payloads = [bytearray(), bytearray(b'\xf7\x7f\x7d'), bytearray(b'\x7d\x7d\\1')]
+    payloads += [bytearray(rng.choice([0x00, 0xf7, 0x7f, 0x7d, 0x31, 0x5c]) for i in range(rng.randint(0, 300)))
+                 for j in range(200)]
+
+    for payload in payloads:
+        assert d.encode(payload) == reference_encode(d, payload)
+        processed += len(payload)
+        escaped += sum(1 for c in payload if c in (d.SOF, d.EOF, d.ESC))
+
+    measures = d.stats()
+    assert measures["tx_encoded_frames"] == len(payloads)
+    assert measures["tx_processed_bytes"] == processed
+    assert measures["tx_escaped_bytes"] == escaped
+
+    # round trip
+    frames = []
+    decoder = Delimiter(lambda frame: frames.append(bytearray(frame)))
+    for payload in payloads:
+        decoder.decode(d.encode(payload))
+    assert frames == payloads
+
+def test_callbacks_keep_frames():
+    frames = []
+    d = Delimiter(frames.append)
+    d.decode(bytearray.fromhex("f70700666f6f0062617247027f" + "f703006b6c6d6f707100ffffffff107b7f"))
+    buffer = d.payload
+
+    assert frames == [bytes(bytearray.fromhex("0700666f6f006261724702")),
+                      bytes(bytearray.fromhex("03006b6c6d6f707100ffffffff107b"))]
+    # reception buffer is reused
+    assert d.payload is buffer
+
+def test_oversized_frames():
+    frames = []
+    d = Delimiter(frames.append, max_frame_length=8)
+
+    # 9 bytes frame, then a valid 8 bytes one
+    d.decode(bytearray.fromhex("f7000102030405060708" + "7f" + "f7" + "7d7f01020304050607" + "7f"))
+
+    measures = d.stats()
+    assert measures["rx_oversized_frames"] == 1
+    assert measures["rx_complete_frames"] == 1
+    assert measures["rx_discarded_bytes"] == 1 # EOF of the aborted frame
+    assert frames == [bytes(bytearray.fromhex("7f01020304050607"))]
+    assert len(d.payload) == 8
+
+    # escaped byte overflowing
+    d.decode(bytearray.fromhex("f70001020304050607" + "7d7d" + "7f"))
+    assert d.stats()["rx_oversized_frames"] == 2
+    assert len(frames) == 1
+
+    d.resetStats()
+    assert d.stats()["rx_oversized_frames"] == 0
+
+def test_buffer_grows_on_demand():
+    frames = []
+    d = Delimiter(frames.append)
+    buffer = d.payload
+    assert len(buffer) < d.max_frame_length
+
+    payload = bytearray(range(256)) * 8
+    d.decode(d.encode(payload))
+    assert frames == [bytes(payload)]
+    # grown in place, only as much as needed
+    assert d.payload is buffer
+    assert len(payload) <= len(d.payload) < 2 * len(payload)
+
+    d.set_max_frame_length(1000)
+    d.decode(d.encode(payload[:1000]) + d.encode(payload[:1001]))
+    assert frames[1:] == [bytes(payload[:1000])]
+    assert len(d.payload) == 1000
+    assert d.stats()["rx_oversized_frames"] == 1
@@ -0,0 +1,131 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.rpc import Rpc, RpcTimeout
+import pytest
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class linkedTransportMock:
+    """ One end of a link, writes go to the other end """
+    def __init__(self, rx, tx):
+        self.rx = rx
+        self.tx = tx
+
+    def read(self, maxbytes=1):
+        data = []
+        while len(data) < maxbytes and not self.rx.empty():
+            data.append(self.rx.get())
+        return data
+
+    def readable(self):
+        return self.rx.qsize()
+
+    def write(self, data):
+        for c in data:
+            self.tx.put(c)
+        return 0
+
+    def writeable(self):
+        return True
+
+def link():
+    a, b = Queue(), Queue()
+    return linkedTransportMock(a, b), linkedTransportMock(b, a)
+
+def test_pipelined_requests():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    device = Pytelemetry(device_transport)
+    rpc = Rpc(host)
+
+    # device acknowledges each request with the doubled value
+    def on_set(topic, data, opts):
+        device.publish('ack:%d' % opts['index'], data * 2, 'int32')
+    device.subscribe(None, on_set)
+
+    futures = [rpc.call('set', i, 'int32', reply_topic='ack') for i in range(10)]
+    assert rpc.stats()['in_flight'] == 10
+    assert not any(f.done() for f in futures)
+
+    # all requests are answered in one burst
+    device.update()
+    assert rpc.wait(futures, timeout=1)
+    assert [f.result() for f in futures] == [i * 2 for i in range(10)]
+
+    stats = rpc.stats()
+    assert stats['requests'] == 10
+    assert stats['replies'] == 10
+    assert stats['in_flight'] == 0
+    assert 0 <= stats['rtt_p50'] <= stats['rtt_p99'] <= stats['rtt_max']
+    # reply subscriptions are released
+    assert host.callbacks == {}
+
+def test_unanswered_request_times_out():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    rpc = Rpc(host)
+
+    future = rpc.call('set', 1, 'uint8', timeout=0)
+    assert rpc.wait([future], timeout=1)
+    with pytest.raises(RpcTimeout):
+        future.result()
+    assert rpc.stats()['timeouts'] == 1
+    assert rpc.stats()['in_flight'] == 0
+
+def test_ids_wrap_around():
+    host_transport, device_transport = link()
+    rpc = Rpc(Pytelemetry(host_transport), id_range=2)
+    rpc.call('set', 1, 'uint8')
+    rpc.call('set', 1, 'uint8')
+    with pytest.raises(RuntimeError):
+        rpc.call('set', 1, 'uint8')
+
+def test_indexed_topics_rejected():
+    host_transport, device_transport = link()
+    rpc = Rpc(Pytelemetry(host_transport))
+    with pytest.raises(ValueError):
+        rpc.call('gain:3', 1, 'uint8')
+    with pytest.raises(ValueError):
+        rpc.call('gain', 1, 'uint8', reply_topic='ack:3')
+    assert rpc.stats()['requests'] == 0
+
+def test_wait_sleeps():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    rpc = Rpc(host)
+    updates = []
+    update = host.update
+    host.update = lambda: updates.append(1) or update()
+
+    future = rpc.call('set', 1, 'uint8')
+    assert not rpc.wait([future], timeout=0.05)
+    # Waits for bytes instead of spinning on update()
+    assert len(updates) < 100
+
+def test_failed_publish_is_released():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    rpc = Rpc(host)
+    with pytest.raises(IndexError):
+        rpc.call('x', 1, 'int323')
+    assert host.callbacks == {}
+    assert rpc.stats()['in_flight'] == 0
+    assert rpc.stats()['requests'] == 0
+
+def test_calls_keep_other_routes():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    host.subscribe('status', lambda topic, data, opts: None)
+    host._on_frame('status', 1)
+    rpc = Rpc(host)
+
+    futures = [rpc.call('set', i, 'int32', reply_topic='ack') for i in range(100)]
+    # Subscriptions of replies only touch their own topic
+    assert 'status' in host.routes
+    assert host.api.rx_topics == set([b'status'] + [('ack:%d' % i).encode('utf8') for i in range(100)])
+    for i in range(100):
+        host._on_frame('ack:%d' % i, i)
+    assert all(f.done() for f in futures)
+    assert host.api.rx_topics == set([b'status'])
@@ -0,0 +1,119 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from threading import Thread, Event
+import sys
+import time
+import pytest
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_scheduled_publishes():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append((topic, data)))
+    counter = iter(range(100))
+
+    c.schedule('tick', lambda: next(counter), 'uint8', 0.05)
+    c.schedule('const', 7, 'uint8', 0.1)
+    with pytest.raises(IndexError):
+        c.schedule('foo', 1, 'int323', 1)
+
+    start = time.time()
+    c.run(until=0.32)
+    assert 0.3 < time.time() - start < 0.5
+
+    ticks = [data for topic, data in received if topic == 'tick']
+    consts = [data for topic, data in received if topic == 'const']
+    assert ticks == list(range(len(ticks)))
+    assert 6 <= len(ticks) <= 8
+    assert consts == [7] * len(consts) and 3 <= len(consts) <= 5
+
+    c.unschedule('tick')
+    del received[:]
+    c.run(until=0.1)
+    assert set(topic for topic, data in received) <= set(['const'])
+
+def test_stop_event():
+    t = transportMock()
+    c = Pytelemetry(t)
+    stop = Event()
+    stopper = Thread(target=lambda: (time.sleep(0.1), stop.set()))
+    stopper.start()
+    start = time.time()
+    c.run(stop_event=stop)
+    stopper.join()
+    assert time.time() - start < 0.5
+
+@pytest.mark.skipif(not sys.platform.startswith(('linux', 'darwin')),
+                    reason="pseudo-terminals are not available")
+def test_idle_link_does_not_spin():
+    pytest.importorskip('serial')
+    from pytelemetry.simulator import DeviceSimulator, SimulatedTopic
+    from pytelemetry.transports.serialtransport import SerialTransport
+
+    with DeviceSimulator([SimulatedTopic('adc', 'uint16', 20)]) as device:
+        transport = SerialTransport()
+        transport.connect({'port': device.port, 'baudrate': 115200})
+        c = Pytelemetry(transport)
+        c.api.rx_chunk_size = 4096
+        received = []
+        c.subscribe('adc', lambda topic, data, opts: received.append(data))
+
+        cpu = time.process_time()
+        c.run(until=0.5)
+        cpu = time.process_time() - cpu
+        transport.disconnect()
+
+    assert 8 <= len(received) <= 12
+    # Only woken by received frames (and the simulator thread of this process)
+    assert cpu < 0.2
+
+def test_wait_does_not_probe_readable():
+    pytest.importorskip('serial')
+    from pytelemetry.simulator import DeviceSimulator, SimulatedTopic
+    from pytelemetry.transports.serialtransport import SerialTransport
+
+    with DeviceSimulator([SimulatedTopic('adc', 'uint16', 50)]) as device:
+        transport = SerialTransport()
+        transport.connect({'port': device.port, 'baudrate': 115200})
+        c = Pytelemetry(transport)
+        probes = []
+        readable = transport.readable
+        transport.readable = lambda: probes.append(1) or readable()
+        updates = []
+        update = c.api.update
+        c.api.update = lambda: updates.append(1) or update()
+
+        c.run(until=0.2)
+        transport.disconnect()
+
+    # Transport stats are only measured by update(), as in update() loops
+    assert len(updates) > 0
+    assert len(probes) == len(updates)
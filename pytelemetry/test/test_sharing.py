@@ -0,0 +1,139 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+import multiprocessing
+import pytest
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+pytest.importorskip('multiprocessing.shared_memory')
+from pytelemetry.sharing import SharedMemoryPublisher, SharedMemoryReader
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+@pytest.fixture
+def ring():
+    ring = SharedMemoryPublisher(size=4096, max_topics=8)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+def test_fan_out(ring):
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.subscribe('foo', lambda topic, data, opts: None)
+    c.add_sink(ring)
+    readers = [SharedMemoryReader(ring.name) for _ in range(2)]
+
+    c.publish('foo', 1, 'uint8')
+    c.publish('bar:2', -3.5, 'float32')
+    c.publish('name', 'baz', 'string')
+    c.publish('spectrum', [1, -2, 3], 'int16_array')
+    c.update()
+
+    for reader in readers:
+        records = reader.read()
+        assert [r[0] for r in records] == [1, 2, 3, 4]
+        assert all(r[1] is not None for r in records)
+        assert [(r[2], r[3]) for r in records[:3]] == [('foo', 1), ('bar:2', -3.5), ('name', 'baz')]
+        assert records[3][2] == 'spectrum'
+        assert list(records[3][3]) == [1, -2, 3]
+        assert reader.topics() == ['foo', 'bar:2', 'name', 'spectrum']
+        assert reader.read() == []
+
+    # readers follow at their own pace
+    c.publish('foo', 2, 'uint8')
+    c.publish('foo', 3, 'uint8')
+    c.update()
+    assert [r[3] for r in readers[0].read(max_records=1)] == [2]
+    assert [r[3] for r in readers[0].read()] == [3]
+    assert [r[3] for r in readers[1].read()] == [2, 3]
+
+    for reader in readers:
+        assert reader.stats() == {'overruns': 0, 'lost_records': 0, 'corrupted_records': 0}
+        reader.close()
+    assert ring.stats()['written_records'] == 6
+
+def test_wrap_and_overrun(ring):
+    reader = SharedMemoryReader(ring.name)
+    values = []
+    # records of 24 + 4 bytes, ring wraps every 146 records
+    for i in range(100):
+        ring.write('adc', 'uint32', bytearray([i, 0, 0, 0]), i)
+    values.extend(r[3] for r in reader.read())
+    for i in range(100, 300):
+        ring.write('adc', 'uint32', bytearray([i % 256, i // 256, 0, 0]), i)
+        if i % 50 == 0:
+            values.extend(r[3] for r in reader.read())
+    values.extend(r[3] for r in reader.read())
+    assert values == list(range(300))
+    assert reader.stats()['overruns'] == 0
+
+    # a reader left behind resumes from the newest record
+    for i in range(300, 600):
+        ring.write('adc', 'uint32', bytearray([i % 256, i // 256, 0, 0]), i)
+    assert reader.read() == []
+    assert reader.stats() == {'overruns': 1, 'lost_records': 300, 'corrupted_records': 0}
+    ring.write('adc', 'uint32', bytearray([1, 0, 0, 0]), 600)
+    assert [r[3] for r in reader.read()] == [1]
+    reader.close()
+
+def test_full_directory(ring):
+    for i in range(10):
+        ring.write('topic%d' % i, 'uint8', b'\x01', None)
+    assert ring.stats()['topics'] == 8
+    assert ring.stats()['dropped_records'] == 2
+
+def test_unknown_datatype(ring):
+    reader = SharedMemoryReader(ring.name)
+    # Written by a newer publisher
+    ring.codes['mystery'] = 99
+    ring.write('foo', 'mystery', b'\x01', None)
+    ring.write('foo', 'uint16', b'\x01', None)
+    ring.write('foo', 'uint8', b'\x02', 5)
+    assert reader.read() == [(3, 5, 'foo', 2)]
+    assert reader.stats()['corrupted_records'] == 2
+    reader.close()
+
+def read_in_child(name, expected, output):
+    reader = SharedMemoryReader(name)
+    output.put(reader.topics())
+    records = []
+    while len(records) < expected:
+        records.extend(reader.read())
+    output.put([(r[2], r[3]) for r in records])
+    reader.close()
+
+def test_other_process(ring):
+    output = multiprocessing.Queue()
+    child = multiprocessing.Process(target=read_in_child, args=(ring.name, 3, output))
+    ring.write('foo', 'uint8', b'\x01', None)
+    child.start()
+    assert output.get(timeout=10) == ['foo']
+    for i in range(3):
+        ring.write('bar', 'uint16', bytearray([i, 1]), None)
+    assert output.get(timeout=10) == [('bar', 256), ('bar', 257), ('bar', 258)]
+    child.join()
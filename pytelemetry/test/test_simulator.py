@@ -0,0 +1,108 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.telemetry.telemetry import monotonic_ns
+import sys
+import pytest
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith(('linux', 'darwin')),
+                                reason="pseudo-terminals are not available")
+
+serial = pytest.importorskip('serial')
+from pytelemetry.simulator import DeviceSimulator, SimulatedTopic
+from pytelemetry.transports.serialtransport import SerialTransport
+
+def drive(tlm, duration, until=None):
+    deadline = monotonic_ns() + int(duration * 1e9)
+    while monotonic_ns() < deadline:
+        tlm.update()
+        if until is not None and until():
+            return
+
+def connect(device):
+    transport = SerialTransport()
+    transport.connect({'port': device.port, 'baudrate': 115200})
+    return transport
+
+def test_topic_mix():
+    topics = [SimulatedTopic('adc', 'uint16', 500),
+              SimulatedTopic('temperature', 'float32', 50),
+              SimulatedTopic('spectrum', 'int16_array', 20, 16)]
+    with DeviceSimulator(topics) as device:
+        transport = connect(device)
+        tlm = Pytelemetry(transport)
+        tlm.api.rx_chunk_size = 4096
+        received = dict()
+        tlm.subscribe(None, lambda topic, data, opts: received.setdefault(topic, []).append(data))
+
+        drive(tlm, 0.5)
+        transport.disconnect()
+
+    assert set(received) == set(['adc', 'temperature', 'spectrum'])
+    # Consecutive values of the ramp
+    adc = received['adc']
+    assert adc == list(range(adc[0], adc[0] + len(adc)))
+    assert len(adc) > 5 * len(received['temperature'])
+    assert all(len(spectrum) == 16 for spectrum in received['spectrum'])
+    assert tlm.stats()['protocol']['rx_corrupted_crc'] == 0
+
+def test_corruption_and_bursts():
+    topics = [SimulatedTopic('adc', 'uint16', 100)]
+    with DeviceSimulator(topics, corruption=0.5, burst_size=50, burst_interval=0.1, seed=1) as device:
+        transport = connect(device)
+        tlm = Pytelemetry(transport)
+        tlm.api.rx_chunk_size = 4096
+        received = []
+        tlm.subscribe('adc', lambda topic, data, opts: received.append(data))
+
+        drive(tlm, 0.5)
+        transport.disconnect()
+        sent = device.stats()
+
+    assert sent['corrupted_frames'] > 0
+    # Bursts come on top of the 100 Hz rate
+    assert sent['sent_frames'] > 150
+    assert len(received) < sent['sent_frames']
+    stats = tlm.stats()
+    assert stats['protocol']['rx_corrupted_crc'] + stats['protocol']['rx_corrupted_header'] + \
+           stats['protocol']['rx_corrupted_topic'] + stats['protocol']['rx_corrupted_payload'] + \
+           stats['framing']['rx_uncomplete_frames'] > 0
+
+def test_echo_and_ack():
+    with DeviceSimulator() as device:
+        transport = connect(device)
+        tlm = Pytelemetry(transport)
+        received = []
+        tlm.subscribe(None, lambda topic, data, opts: received.append((topic, opts, data)))
+
+        tlm.publish('gain', 1.5, 'float32')
+        tlm.publish('count', 42, 'uint8')
+        tlm.publish('name', 'foo', 'string')
+        drive(tlm, 2, until=lambda: len(received) == 3)
+
+        device.reply = 'ack'
+        tlm.publish('set_gain:7', 3, 'uint16')
+        drive(tlm, 2, until=lambda: len(received) == 4)
+        transport.disconnect()
+
+    assert received == [('gain', None, 1.5), ('count', None, 42), ('name', None, 'foo'),
+                        ('ack', {'index': 7}, 1)]
+
+def test_reply_errors_are_counted():
+    # Replies on a None topic cannot be encoded
+    with DeviceSimulator(reply='ack', ack_topic=None) as device:
+        transport = connect(device)
+        tlm = Pytelemetry(transport)
+        received = []
+        tlm.subscribe(None, lambda topic, data, opts: received.append((topic, data)))
+
+        tlm.publish('set_gain', 3, 'uint16')
+        drive(tlm, 2, until=lambda: device.stats()['errors'] == 1)
+
+        # The simulator is still answering
+        device.ack_topic = 'ack'
+        tlm.publish('set_gain', 4, 'uint16')
+        drive(tlm, 2, until=lambda: len(received) == 1)
+        transport.disconnect()
+
+    assert device.stats()['errors'] == 1
+    assert received == [('ack', 1)]
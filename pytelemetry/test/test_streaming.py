@@ -0,0 +1,94 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry, iter_decode
+from pytelemetry.telemetry.telemetry import Telemetry, monotonic_ns
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+# For Python 2 compatibility, if unittest.mock is not available
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_frames():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe(None, cb)
+
+    c.publish('foo', 1, 'uint8')
+    c.publish('bar:2', 'baz', 'string')
+    frames = [(topic, data) for ts, topic, data in c.frames(timeout=0.01)]
+    assert frames == [('foo', 1), ('bar:2', 'baz')]
+    assert cb.call_count == 0
+
+    # callbacks are restored
+    c.publish('foo', 2, 'uint8')
+    c.update()
+    cb.assert_called_once_with('foo', 2, None)
+
+def test_frames_bypass_decimation():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe('foo', cb, decimate=0.001)
+    # A sample of a bucket that is already over
+    c.decimators['foo']('foo', 1, None, monotonic_ns() - 10**9)
+
+    # Not emitted while frames are iterated
+    c.publish('foo', 2, 'uint8')
+    assert [data for ts, topic, data in c.frames(timeout=0.01)] == [2]
+    assert cb.call_count == 0
+
+    c.update()
+    assert cb.call_count == 1
+
+def test_frames_lazy():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.enable_batching()
+    for i in range(10):
+        c.publish('foo', i, 'uint8')
+
+    frames = c.frames()
+    ts, topic, data = next(frames)
+    assert (topic, data) == ('foo', 0)
+    assert next(frames)[0] == ts # same container
+    frames.close()
+
+def test_iter_decode():
+    t = Telemetry(None, None)
+    stream = bytearray()
+    for i in range(50):
+        stream.extend(t.delimiter.encode(t._encode_frame('foo', i, 'uint16')))
+    # garbage before the first frame, frames split across chunks
+    stream[0:0] = b'\x00\x7f'
+    chunks = [stream[i:i + 7] for i in range(0, len(stream), 7)]
+
+    assert list(iter_decode(chunks)) == [('foo', i) for i in range(50)]
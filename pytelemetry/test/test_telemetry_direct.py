@@ -1,5 +1,8 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 from pytelemetry.telemetry.telemetry import Telemetry
+from pytelemetry.telemetry.crc import crc16
+import pytest
+import struct
 
 def test_special_characters():
     t = Telemetry(None,None)
@@ -12,3 +15,64 @@ def test_special_characters():
         frame = bytes(t._encode_frame(topic, data, typ))
         decoded = t._decode_frame(frame)
         assert decoded == (topic, data), '%s != %s' % (decoded, (topic, data))
+
+def test_arrays():
+    t = Telemetry(None,None)
+
+    tests = [ ('adc', [0, 1, 255, 128], 'uint8_array'),
+              ('adc', [0, 65535, 1024], 'uint16_array'),
+              ('adc', [0, 4294967295], 'uint32_array'),
+              ('adc', [-128, 127], 'int8_array'),
+              ('adc', [-32768, 32767], 'int16_array'),
+              ('adc', [-2147483648, 2147483647], 'int32_array'),
+              ('adc', [0.5, -1.25, 1024.0], 'float32_array'),
+              ('empty', [], 'float32_array') ]
+
+    for topic, data, typ in tests:
+        frame = bytes(t._encode_frame(topic, data, typ))
+        decoded_topic, decoded = t._decode_frame(frame)
+        assert (decoded_topic, list(decoded)) == (topic, data)
+
+def test_array_is_little_endian():
+    t = Telemetry(None,None)
+    frame = t._encode_frame('a', [1, 2], 'uint16_array')
+    assert bytes(frame[:-2]) == b'\x12\x00a\x00\x01\x00\x02\x00'
+
+def test_array_corrupted_size():
+    t = Telemetry(None,None)
+    frame = t._encode_frame('a', [1, 2], 'uint16_array')
+    # Drop one payload byte and fix crc
+    frame = frame[:-3]
+    frame.extend(struct.pack("<H", crc16(frame)))
+    assert t._decode_frame(frame) is None
+    assert t.stats()['rx_corrupted_payload'] == 1
+
+def test_unknown_type_skipped():
+    # A reader that does not know array types drops them without side effects
+    t = Telemetry(None,None)
+    frame = t._encode_frame('a', [1, 2], 'uint16_array')
+    del t.rtypes[t.types['uint16_array']]
+    assert t._decode_frame(frame) is None
+    assert t.stats()['rx_corrupted_header'] == 1
+    assert t._decode_frame(t._encode_frame('b', 3, 'uint8')) == ('b', 3)
+
+def test_numpy_array():
+    np = pytest.importorskip("numpy")
+    t = Telemetry(None,None)
+    samples = np.arange(64, dtype=np.int64)
+    topic, decoded = t._decode_frame(t._encode_frame('adc', samples, 'int16_array'))
+    assert np.array_equal(np.frombuffer(decoded, dtype=np.int16), samples)
+
+def test_numpy_array_out_of_range():
+    np = pytest.importorskip("numpy")
+    t = Telemetry(None,None)
+    # Raised like for lists instead of wrapping around
+    for samples, typ in [ (np.array([0, 256]), 'uint8_array'),
+                          (np.array([-1, 0]), 'uint16_array'),
+                          (np.array([-32769]), 'int16_array'),
+                          (np.array([2**31]), 'int32_array') ]:
+        with pytest.raises(OverflowError):
+            t._encode_frame('adc', samples, typ)
+        with pytest.raises(OverflowError):
+            t._encode_frame('adc', list(samples), typ)
+    assert t._encode_frame('adc', np.array([255, 0]), 'uint8_array') == t._encode_frame('adc', [255, 0], 'uint8_array')
@@ -0,0 +1,168 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.telemetry.telemetry import Telemetry
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+# For Python 2 compatibility, if unittest.mock is not available
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+class linkedTransportMock:
+    """ One end of a link, writes go to the other end """
+    def __init__(self, rx, tx):
+        self.rx = rx
+        self.tx = tx
+
+    def read(self, maxbytes=1):
+        data = []
+        while len(data) < maxbytes and not self.rx.empty():
+            data.append(self.rx.get())
+        return data
+
+    def readable(self):
+        return self.rx.qsize()
+
+    def write(self, data):
+        for c in data:
+            self.tx.put(c)
+        return 0
+
+    def writeable(self):
+        return True
+
+def link():
+    a, b = Queue(), Queue()
+    return linkedTransportMock(a, b), linkedTransportMock(b, a)
+
+def sent_bytes(transport, action):
+    before = transport.tx.qsize()
+    action()
+    return transport.tx.qsize() - before
+
+def test_negotiated_ids():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    device = Pytelemetry(device_transport)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    device.subscribe('some/very/long/topic/name', cb)
+    host.enable_topic_ids()
+
+    publish = lambda: host.publish('some/very/long/topic/name', 42, 'uint8')
+
+    # announce + full frame, until acknowledged
+    full_size = sent_bytes(host_transport, publish)
+    device.update()
+    cb.assert_called_once_with('some/very/long/topic/name', 42, None)
+    assert device.stats()['protocol']['rx_control_frames'] == 1
+
+    host.update()
+    assert host.stats()['protocol']['rx_control_frames'] == 1
+
+    short_size = sent_bytes(host_transport, publish)
+    assert short_size == 8 # SOF, header, id, payload, crc, EOF
+    assert short_size < full_size
+    device.update()
+    cb.assert_called_with('some/very/long/topic/name', 42, None)
+    assert cb.call_count == 2
+    assert device.stats()['protocol']['rx_decoded_frames'] == 2
+
+def test_peer_without_ids_gets_full_topics():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    host.enable_topic_ids()
+
+    # peer never acknowledges
+    first = sent_bytes(host_transport, lambda: host.publish('topic', 1, 'uint8'))
+    second = sent_bytes(host_transport, lambda: host.publish('topic', 1, 'uint8'))
+    assert second == 13
+    assert first > second
+
+def test_unknown_id_falls_back_to_topic_string():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    device = Pytelemetry(device_transport)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    device.subscribe('topic', cb)
+    host.enable_topic_ids()
+    host.publish('topic', 1, 'uint8')
+    device.update()
+    host.update()
+
+    # device restarts and loses its table
+    device = Pytelemetry(device_transport)
+    device.subscribe('topic', cb)
+    host.publish('topic', 2, 'uint8')
+    device.update()
+    assert device.stats()['protocol']['rx_unknown_topic_ids'] == 1
+    assert cb.call_count == 1
+
+    # host is told, announces again and sends the full topic meanwhile
+    host.update()
+    assert sent_bytes(host_transport, lambda: host.publish('topic', 3, 'uint8')) == 13
+    device.update()
+    cb.assert_called_with('topic', 3, None)
+    host.update()
+    assert sent_bytes(host_transport, lambda: host.publish('topic', 4, 'uint8')) == 8
+
+def test_two_bytes_ids():
+    t = Telemetry(None, None)
+    t.enable_topic_ids()
+    t.tx_topic_ids['foo'] = 300
+    t.tx_confirmed_topics.add('foo')
+    t.rx_topic_ids[300] = 'foo'
+
+    frame = t._encode_frame('foo', 1234, 'uint16')
+    assert len(frame) == 2 + 2 + 2 + 2
+    assert t._decode_frame(frame) == ('foo', 1234)
+
+def test_unknown_ids_reported_once():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    device = Pytelemetry(device_transport)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    device.subscribe('topic', cb)
+    host.enable_topic_ids()
+    host.publish('topic', 1, 'uint8')
+    device.update()
+    host.update()
+
+    # device restarts while many frames are in flight
+    device = Pytelemetry(device_transport)
+    device.subscribe('topic', cb)
+    for i in range(100):
+        host.publish('topic', i, 'uint8')
+    sent = device.stats()['protocol']['tx_encoded_frames']
+    device.update()
+    assert device.stats()['protocol']['rx_unknown_topic_ids'] == 100
+    assert device.stats()['protocol']['tx_encoded_frames'] == sent + 1
+
+    # a single announce back, acknowledged once
+    host_sent = host.stats()['protocol']['tx_encoded_frames']
+    host.update()
+    assert host.stats()['protocol']['tx_encoded_frames'] == host_sent + 1
+    device.update()
+    host.update()
+    assert 'topic' in host.api.tx_confirmed_topics
+    host.publish('topic', 7, 'uint8')
+    device.update()
+    cb.assert_called_with('topic', 7, None)
+
+def test_fall_back_announces_once():
+    host_transport, device_transport = link()
+    host = Pytelemetry(host_transport)
+    device = Pytelemetry(device_transport)
+    host.enable_topic_ids()
+    host.publish('topic', 1, 'uint8')
+    device.update()
+    host.update()
+    assert 'topic' in host.api.tx_confirmed_topics
+
+    # Unknown reports of the same id while the announce is not acknowledged
+    tid = host.api.tx_topic_ids['topic']
+    assert sent_bytes(host_transport, lambda: host.api._fall_back_topic_id(tid)) > 0
+    assert sent_bytes(host_transport, lambda: host.api._fall_back_topic_id(tid)) == 0
@@ -0,0 +1,188 @@
+from __future__ import division, print_function
+from pytelemetry import Pytelemetry
+from pytelemetry.transmit import CONTROL
+from threading import Thread, Event
+import time
+import pytest
+try:
+    from queue import Queue  # Python 3
+except ImportError:
+    from Queue import Queue  # Python 2
+
+# For Python 2 compatibility, if unittest.mock is not available
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+class transportMock:
+    def __init__(self):
+        self.queue = Queue()
+        self.writes = 0
+        self.writers = set()
+
+    def read(self, maxbytes=1):
+        data = []
+        amount = 0
+        while amount < maxbytes and not self.queue.empty():
+            c = self.queue.get()
+            data.append(c)
+            amount += 1
+        return data
+
+    def readable(self):
+        return self.queue.qsize()
+
+    def write(self, data):
+        import threading
+        self.writers.add(threading.current_thread().name)
+        self.writes += 1
+        for i in range(len(data)):
+            self.queue.put(data[i])
+        return 0
+
+    def writeable(self):
+        return not self.queue.full()
+
+def test_concurrent_publishers():
+    t = transportMock()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append((topic, opts['index'], data)))
+    c.start_transmit_thread()
+
+    def producer(n):
+        for i in range(200):
+            c.publish('producer%d:%d' % (n, i), i, 'uint16')
+
+    producers = [Thread(target=producer, args=(n,)) for n in range(4)]
+    for p in producers:
+        p.start()
+    for p in producers:
+        p.join()
+    c.stop_transmit_thread()
+
+    # Only the transmit thread wrote, in batches
+    assert t.writers == set(['TransmitThread'])
+    assert t.writes < 800
+
+    c.update()
+    assert len(received) == 800
+    for n in range(4):
+        values = [data for topic, i, data in received if topic == 'producer%d' % n]
+        assert values == list(range(200))
+
+    stats = c.stats()
+    assert stats['framing']['tx_encoded_frames'] == 800
+    assert stats['protocol']['tx_encoded_frames'] == 800
+    assert stats['framing']['tx_processed_bytes'] == stats['framing']['rx_processed_bytes'] - 2 * 800 - stats['framing']['rx_escaped_bytes']
+
+def test_errors_are_counted():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.start_transmit_thread()
+
+    with pytest.raises(IndexError):
+        c.publish('foo', 1, 'int323')
+    c.publish('foo', 'not a number', 'uint8')
+    c.publish('foo', 1, 'uint8')
+    c.stop_transmit_thread()
+
+    assert c.stats()['protocol']['tx_encoded_frames'] == 1
+    assert c.transmitter is None
+
+def test_batching_and_topic_ids_in_transmit_thread():
+    t = transportMock()
+    c = Pytelemetry(t)
+    cb = mock.Mock(spec=["topic","data","opts"])
+    c.subscribe('foo', cb)
+    c.enable_batching()
+    c.enable_topic_ids()
+    c.start_transmit_thread()
+
+    c.publish('foo', 1, 'uint8')
+    c.publish('foo', 2, 'uint8')
+    c.stop_transmit_thread()
+    # Loopback : announce and ack, ack reply is queued for the transmit thread
+    c.start_transmit_thread()
+    c.update()
+    c.stop_transmit_thread()
+    c.update()
+    assert [args[0][1] for args in cb.call_args_list] == [1, 2]
+    assert 'foo' in c.api.tx_confirmed_topics
+
+def test_control_frames_bypass_bulk():
+    class slowTransport(transportMock):
+        def write(self, data):
+            # 1 ms per 100 bytes on the wire
+            time.sleep(len(data) / 100000.)
+            return transportMock.write(self, data)
+
+    t = slowTransport()
+    c = Pytelemetry(t)
+    received = []
+    c.subscribe(None, lambda topic, data, opts: received.append(topic))
+    c.start_transmit_thread(max_write=256, control_topics=['estop'])
+
+    for i in range(50):
+        c.publish('bulk', 'x' * 200, 'string')
+    c.publish('estop', 1, 'uint8')
+    c.publish('command', 2, 'uint8', priority=CONTROL)
+    transmitter = c.transmitter
+    c.stop_transmit_thread()
+    c.update()
+
+    assert len(received) == 52
+    # written after at most the bulk write in progress
+    assert received.index('estop') <= 2
+    assert received.index('command') == received.index('estop') + 1
+    assert received[-1] == 'bulk'
+
+    stats = transmitter.stats()
+    assert stats['queued'] == 0
+    assert stats['control']['requests'] == 2
+    assert stats['bulk']['requests'] == 50
+    assert stats['bulk']['max_queued'] >= 40
+    assert stats['control']['latency_max'] < stats['bulk']['latency_max']
+    # bulk frames are written by batches of about max_write bytes
+    assert stats['writes'] < 50
+
+def test_stop_timeout_keeps_thread():
+    class blockedTransport(transportMock):
+        def __init__(self):
+            transportMock.__init__(self)
+            self.unblocked = Event()
+
+        def write(self, data):
+            self.unblocked.wait()
+            return transportMock.write(self, data)
+
+    t = blockedTransport()
+    c = Pytelemetry(t)
+    c.start_transmit_thread()
+    c.publish('foo', 1, 'uint8')
+
+    assert c.stop_transmit_thread(timeout=0.05) is False
+    # Still owning the transmission
+    assert c.transmitter is not None
+    assert c.api.tx_executor is not None
+
+    t.unblocked.set()
+    assert c.stop_transmit_thread() is True
+    assert c.transmitter is None
+    assert c.api.tx_executor is None
+
+def test_reset_transmit_stats():
+    t = transportMock()
+    c = Pytelemetry(t)
+    c.start_transmit_thread()
+    c.publish('foo', 1, 'uint8')
+    c.flush()
+    # publish and flush requests written
+    while c.stats()['transmit']['bulk']['requests'] < 2:
+        time.sleep(0.001)
+    c.resetStats()
+    stats = c.stats()['transmit']
+    assert stats['requests'] == 0
+    assert stats['bulk']['requests'] == 0
+    c.stop_transmit_thread()
@@ -0,0 +1,230 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import deque
+from logging import getLogger
+from threading import Thread, Condition
+from pytelemetry.telemetry.telemetry import monotonic_ns
+
+# Priority classes of transmitted frames. Control frames are written before
+# any pending bulk frame
+CONTROL = 0
+BULK = 1
+CLASSES = {CONTROL: 'control', BULK: 'bulk'}
+
+class TransmitThread:
+    """
+        Thread owning the transmission side of a Telemetry instance.
+
+        Any thread can call publish(), which only validates the datatype and
+        queues the request. The transmit thread encodes queued requests in
+        batches, writes each batch to the transport in a single write, and is
+        the only one touching the transmission state and counters (Telemetry
+        and Delimiter TX counters, topic ids, pending containers, transport
+        TX measurements).
+
+        Requests are queued per priority class. Control requests (topics
+        listed in control_topics, publishes with priority=CONTROL and protocol
+        replies like topic id acknowledgements) are always written first. Bulk
+        requests are written by batches of at most max_write bytes, and the
+        thread goes back to control requests between two bulk writes, so a
+        control frame waits at most for one bulk write.
+    """
+    def __init__(self, api, max_batch=64, maxsize=0, max_write=1024, control_topics=()):
+        """
+            :param api: the Telemetry instance
+            :param max_batch: maximum amount of requests written at once
+            :param maxsize: maximum amount of queued requests per class,
+            publish() blocks when reached. Unbounded by default
+            :param max_write: amount of bytes above which a batch of bulk
+            frames is written without waiting for more frames
+            :param control_topics: topics published with control priority
+        """
+        self.api = api
+        self.max_batch = max_batch
+        self.maxsize = maxsize
+        self.max_write = max_write
+        self.control_topics = set(control_topics)
+        # (function, args, enqueue time) per class
+        self.queues = {CONTROL: deque(), BULK: deque()}
+        self.condition = Condition()
+        self.log_tx = getLogger('telemetry.tx')
+        self.thread = None
+        self.running = False
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.requests = 0
+        self.writes = 0
+        self.written_bytes = 0
+        self.errors = 0
+        # class -> [requests, max queued, total latency, max latency] in ns
+        self.classes = dict((c, [0, 0, 0, 0]) for c in CLASSES)
+
+    def stats(self):
+        """
+Returns counters of the thread. Each class (control, bulk) reports its current
+and maximum queue depth, and the average and maximum latency in ns from
+publish() to the end of the transport write.
+        """
+        d = {
+            "queued" : sum(len(q) for q in self.queues.values()),
+            "requests" : self.requests,
+            "writes" : self.writes,
+            "written_bytes" : self.written_bytes,
+            "errors" : self.errors
+        }
+        for c, name in CLASSES.items():
+            requests, max_queued, latency, max_latency = self.classes[c]
+            d[name] = {
+                "queued" : len(self.queues[c]),
+                "max_queued" : max_queued,
+                "requests" : requests,
+                "latency_avg" : latency // requests if requests else None,
+                "latency_max" : max_latency if requests else None
+            }
+        return d
+
+    def start(self):
+        self.api.tx_executor = self.execute
+        self.api.tx_before_wait = self._write_admitted
+        self.running = True
+        self.thread = Thread(target=self._run, name='TransmitThread')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+Sends all queued requests, then stops the thread. Returns False if the thread
+is still writing after timeout seconds : it keeps owning the transmission and
+stop() can be called again.
+        """
+        if self.thread is None:
+            return True
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            self.log_tx.error("Transmit thread still running after {0} s, {1} requests queued"
+                              .format(timeout, sum(len(q) for q in self.queues.values())))
+            return False
+        self.thread = None
+        self.api.tx_executor = None
+        self.api.tx_before_wait = None
+        return True
+
+    def publish(self, topic, data, datatype, priority=None):
+        if not datatype in self.api.types:
+            raise IndexError("Provided datatype {0} not found for ({1}, {2})".format(datatype, topic, data))
+        if priority is None:
+            priority = CONTROL if topic in self.control_topics else BULK
+        self._put(priority, self.api.publish, (topic, data, datatype))
+
+    def flush(self):
+        self._put(BULK, self.api.flush, ())
+
+    def execute(self, function, args):
+        # Runs function(*args) in the transmit thread, used for protocol replies
+        self._put(CONTROL, function, args)
+
+    def _put(self, priority, function, args):
+        queue = self.queues[priority]
+        with self.condition:
+            while self.maxsize and len(queue) >= self.maxsize:
+                self.condition.wait()
+            queue.append((function, args, monotonic_ns()))
+            entry = self.classes[priority]
+            entry[1] = max(entry[1], len(queue))
+            self.condition.notify_all()
+
+    def _take(self):
+        # Returns (class, requests) to write next, None once stopped and empty
+        control = self.queues[CONTROL]
+        bulk = self.queues[BULK]
+        with self.condition:
+            while not control and not bulk:
+                if not self.running:
+                    return None
+                self.condition.wait()
+            if control:
+                priority, queue = CONTROL, control
+                amount = min(len(control), self.max_batch)
+            else:
+                priority, queue = BULK, bulk
+                amount = min(len(bulk), self.max_batch)
+            requests = [queue.popleft() for _ in range(amount)]
+            # Unblocks publishers waiting for room
+            self.condition.notify_all()
+        return priority, requests
+
+    def _run(self):
+        while True:
+            taken = self._take()
+            if taken is None:
+                # Containers still pending
+                self.api.tx_buffer = bytearray()
+                self.api.flush()
+                self._write(CONTROL, [])
+                return
+            priority, requests = taken
+
+            self.api.tx_buffer = bytearray()
+            done = []
+            for request in requests:
+                if priority == BULK and done and len(self.api.tx_buffer) >= self.max_write:
+                    # Written now, control requests go first
+                    self._requeue(requests[len(done):])
+                    break
+                function, args, queued = request
+                try:
+                    function(*args)
+                except Exception as e:
+                    self.log_tx.error("Could not send {0} : {1}".format(args, e))
+                    self.errors += 1
+                self.requests += 1
+                done.append(queued)
+                if priority == BULK and self.queues[CONTROL]:
+                    self._requeue(requests[len(done):])
+                    break
+
+            # Containers are sent at the end of each batch
+            self.api.flush()
+            self._write(priority, done)
+
+    def _requeue(self, requests):
+        # Puts back bulk requests taken but not written, in order
+        if not requests:
+            return
+        with self.condition:
+            self.queues[BULK].extendleft(reversed(requests))
+
+    def _write_admitted(self):
+        # The link budget is about to delay a frame : frames it already admitted
+        # are written first instead of waiting along
+        frames = self.api.tx_buffer
+        if frames:
+            self._write_frames(bytes(frames))
+            del frames[:]
+
+    def _write_frames(self, frames):
+        try:
+            if self.api.transport.writeable():
+                self.api.transport.write(frames)
+                self.writes += 1
+                self.written_bytes += len(frames)
+        except Exception as e:
+            self.log_tx.error("Could not write {0} bytes : {1}".format(len(frames), e))
+            self.errors += 1
+
+    def _write(self, priority, queued):
+        frames = self.api.tx_buffer
+        self.api.tx_buffer = None
+        if frames:
+            self._write_frames(frames)
+
+        now = monotonic_ns()
+        entry = self.classes[priority]
+        for t in queued:
+            entry[0] += 1
+            entry[2] += now - t
+            entry[3] = max(entry[3], now - t)
@@ -6,6 +6,7 @@ import six
 class SerialTransport:
     def __init__(self):
         self.driver = None
+        self.baudrate = None
         self.log_tr = getLogger('telemetry.transport.serial')
         self.log_tr.info("SerialTransport initialized.")
 
@@ -31,6 +32,7 @@ class SerialTransport:
         # Default values for options for retrocompatibility
         if not 'timeout' in options:
             options['timeout'] = 1
+        self.baudrate = options['baudrate']
         self.driver = serial.Serial(port=options['port'],
                                     baudrate=options['baudrate'],
                                     write_timeout=options['timeout'])
@@ -97,3 +99,8 @@ class SerialTransport:
 
     def writeable(self):
         return 1
+
+    def fileno(self):
+        # File descriptor of the port, lets Pytelemetry.run() sleep until bytes
+        # are received. Not available on Windows
+        return self.driver.fileno()